@@ -18,17 +18,17 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
 import logging
 import argparse
-import statistics
 import datetime as dt
-from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import allele_lengths as al
+from app.utils import length_statistics as ls
 from app.utils import sparql_queries
+from app.utils import metrics
 from app.utils import auxiliary_functions as aux
 
 
@@ -128,16 +128,27 @@ def loci_annotations(schema, virtuoso_graph, local_sparql):
 	return annotations
 
 
+def summary_stats(loci, offsets, lengths):
+	""" Computes the number of alleles, mode, minimum and
+	    maximum length of all loci with array operations.
+	"""
+
+	stats = ls.loci_statistics(offsets, lengths)
+	total_alleles = dict(zip(loci, stats['count'].tolist()))
+	modes = dict(zip(loci, stats['mode'].tolist()))
+	min_len = dict(zip(loci, stats['min'].tolist()))
+	max_len = dict(zip(loci, stats['max'].tolist()))
+
+	return [total_alleles, modes, min_len, max_len]
+
+
 def loci_stats(loci_data):
 	"""
 	"""
 
-	total_alleles = {k: len(v) for k, v in loci_data.items()}
-	modes = {k: Counter(v).most_common()[0][0] for k, v in loci_data.items()}
-	min_len = {k: min(v) for k, v in loci_data.items()}
-	max_len = {k: max(v) for k, v in loci_data.items()}
+	loci, offsets, lengths = ls.from_lists(loci_data)
 
-	return [total_alleles, modes, min_len, max_len]
+	return summary_stats(loci, offsets, lengths)
 
 
 def generate_info(schema, last_modified, virtuoso_graph, local_sparql):
@@ -192,21 +203,11 @@ def fast_update(schema, last_modified, file, lengths_dir,
 	loci_names = {l['locus']['value']: l['name']['value'] for l in loci}
 
 	if len(loci_info) == 0:
-		length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-
-		loci_stats = {}
-		for locus_file in length_files:
-			with open(locus_file, 'rb') as lf:
-				locus_data = pickle.load(lf)
-
-			locus_uri = list(locus_data.keys())[0]
-			locus_name = loci_names[locus_uri]
-			alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-			total_alleles = len(alleles_lengths)
-			locus_mode = Counter(alleles_lengths).most_common()[0][0]
-			locus_min = min(alleles_lengths)
-			locus_max = max(alleles_lengths)
-			loci_stats[locus_name] = [locus_mode, total_alleles, locus_min, locus_max]
+		schema_lengths = al.load(lengths_dir)
+		loci = [loci_names[locus_uri] for locus_uri in schema_lengths.loci]
+		total_alleles, modes, min_len, max_len = summary_stats(loci, schema_lengths.offsets,
+															   schema_lengths.lengths)
+		loci_stats = {l: [modes[l], total_alleles[l], min_len[l], max_len[l]] for l in loci}
 
 		annotations = loci_annotations(schema, virtuoso_graph, local_sparql)
 		for a in annotations:
@@ -233,21 +234,11 @@ def fast_update(schema, last_modified, file, lengths_dir,
 			logging.info('Information about loci annotations and length modes for schema {0} is up-to-date.'.format(schema))
 
 		elif json_date != virtuoso_date:
-			length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-
-			loci_stats = {}
-			for locus_file in length_files:
-				with open(locus_file, 'rb') as lf:
-					locus_data = pickle.load(lf)
-
-				locus_uri = list(locus_data.keys())[0]
-				locus_name = loci_names[locus_uri]
-				alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-				total_alleles = len(alleles_lengths)
-				locus_mode = Counter(alleles_lengths).most_common()[0][0]
-				locus_min = min(alleles_lengths)
-				locus_max = max(alleles_lengths)
-				loci_stats[locus_name] = [locus_mode, total_alleles, locus_min, locus_max]
+			schema_lengths = al.load(lengths_dir)
+			loci = [loci_names[locus_uri] for locus_uri in schema_lengths.loci]
+			total_alleles, modes, min_len, max_len = summary_stats(loci, schema_lengths.offsets,
+																   schema_lengths.lengths)
+			loci_stats = {l: [modes[l], total_alleles[l], min_len[l], max_len[l]] for l in loci}
 
 			annotations = loci_annotations(schema, virtuoso_graph, local_sparql)
 			for a in annotations:
@@ -493,11 +484,12 @@ if __name__ == '__main__':
 
 	args = parse_arguments()
 
-	if args[0] == 'global_species':
-		global_species(args[3], args[4], args[5])
-	elif args[0] == 'single_species':
-		single_species(args[1], args[3], args[4],
-			           args[5])
-	elif args[0] == 'single_schema':
-		single_schema(args[1], args[2], args[3],
-			          args[4], args[5])
+	with metrics.job_timer('annotations'):
+		if args[0] == 'global_species':
+			global_species(args[3], args[4], args[5])
+		elif args[0] == 'single_species':
+			single_species(args[1], args[3], args[4],
+				           args[5])
+		elif args[0] == 'single_schema':
+			single_schema(args[1], args[2], args[3],
+				          args[4], args[5])
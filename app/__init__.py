@@ -38,7 +38,11 @@ login_manager = LoginManager()
 security = Security()
 
 # Queue management
-celery = Celery(__name__, broker=Config.CELERY_BROKER_URL, backend=Config.CELERY_RESULT_BACKEND)
+# tasks that are not acknowledged within the visibility timeout are
+# delivered again by Redis (insertion tasks are acknowledged when
+# they finish and can run for several hours)
+celery = Celery(__name__, broker=Config.CELERY_BROKER_URL, backend=Config.CELERY_RESULT_BACKEND,
+                changes={'broker_transport_options': {'visibility_timeout': Config.CELERY_VISIBILITY_TIMEOUT}})
 
 
 ####### Config jwt ##############################################################
@@ -106,6 +110,24 @@ def create_app(config_class=Config):
     from werkzeug.middleware.proxy_fix import ProxyFix
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_for=1, x_host=1)
 
+    # Setup service metrics
+    from app.utils import metrics
+    metrics.init_app(app)
+
+    # Setup opt-in request profiling
+    if app.config['PROFILE_SAMPLE_RATE'] > 0 or app.config['PROFILE_HEADER'] is not None:
+        from app.utils import profiling
+        from app.api import api
+        profiling.install_sqlalchemy_hooks()
+        profiling.install_serialization_hook(api)
+        app.wsgi_app = profiling.ProfilerMiddleware(app.wsgi_app,
+                                                    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                                                    header=app.config['PROFILE_HEADER'],
+                                                    header_interval=app.config['PROFILE_HEADER_INTERVAL'],
+                                                    profile_dir=app.config['PROFILE_DIR'],
+                                                    max_dumps=app.config['PROFILE_MAX_DUMPS'],
+                                                    logfile=app.config['PROFILE_LOG'])
+
     from app.api import blueprint as api_bp
     app.register_blueprint(api_bp)
     
@@ -19,7 +19,7 @@ import sys
 import time
 import shutil
 import pickle
-import zipfile
+import logging
 import hashlib
 import itertools
 import statistics
@@ -48,7 +48,7 @@ from flask import (
     current_app, render_template,
     flash, redirect,
     url_for, request,
-    make_response, Response,
+    Response,
     stream_with_context, send_from_directory,
     jsonify)
 
@@ -57,8 +57,20 @@ from werkzeug.utils import secure_filename
 # App imports
 import rm_functions
 from app.models import User, Role
+from app.utils import metrics
+from app.utils import ns_counters
 from app.utils import wrappers as w
+from app.utils import file_transfer as ft
+from app.utils import compressed_schemas as cs
+from app.utils import compression_queue as cq
+from app.utils import precompute
 from app.utils import sparql_queries as sq
+from app.utils import sequence_index as si
+from app.utils import upload_data as ud
+from app.utils import upload_status as us
+from app.utils import upload_progress as up
+from app.utils import insertion_journal as ij
+from app.utils import allele_lengths as al
 from app.utils import auxiliary_functions as aux
 from app import (db, celery, login_manager,
                  datastore_cheat, security, jwt as jwtm)
@@ -66,10 +78,14 @@ from app import (db, celery, login_manager,
 from app.api import api, blueprint
 
 from SPARQLWrapper import SPARQLWrapper
+from celery import chain, group
+from celery.exceptions import Ignore
 
 # Get the error handlers to work with Flask-restplus
 jwtm._set_error_handler_callbacks(api)
 
+logger = logging.getLogger(__name__)
+
 
 # queue to add loci to new schemas
 # this will return an AsyncResult object/id
@@ -88,36 +104,246 @@ def insert_loci(temp_dir, graph, sparql, url, user, password):
                                       '--p', password])
 
 
+# failed insertion jobs (and jobs of workers that stopped) are
+# run again and resume from the progress journal in the upload
+# temporary directory
+INSERTION_RETRIES = 3
+
+
+def run_insertion(command):
+    """ Runs an insertion script. Jobs that the broker delivers
+        again while the first run of the job is still inserting
+        the data of the upload are ignored (the insertion scripts
+        hold a lock on the temporary directory of the upload).
+    """
+
+    try:
+        subprocess.check_output(command)
+    except subprocess.CalledProcessError as e:
+        if e.returncode == ij.ALREADY_RUNNING:
+            raise Ignore()
+        raise
+
+
 # queue to add alleles to new schemas
-@celery.task(name='ns.api.routes.insert_alleles')
-def insert_alleles(temp_dir, graph, sparql, url, user, password):
+@celery.task(name='ns.api.routes.insert_alleles',
+             autoretry_for=(subprocess.CalledProcessError,),
+             max_retries=INSERTION_RETRIES, retry_backoff=60,
+             acks_late=True)
+def insert_alleles(temp_dir, graph, sparql, url, user, password, pipeline=False):
     """
     """
 
-    result = subprocess.check_output(['python',
-                                      'schema_alleles_inserter.py',
-                                      '-i', temp_dir,
-                                      '--g', graph,
-                                      '--s', sparql,
-                                      '--b', url,
-                                      '--u', user,
-                                      '--p', password])
+    command = ['python',
+               'schema_alleles_inserter.py',
+               '-i', temp_dir,
+               '--g', graph,
+               '--s', sparql,
+               '--b', url,
+               '--u', user,
+               '--p', password]
+    # the following steps are run by the upload pipeline
+    if pipeline is True:
+        command.append('--pipeline')
+
+    run_insertion(command)
 
 
 # queue to add alleles to existing schemas
-@celery.task(name='ns.api.routes.update_alleles')
+@celery.task(name='ns.api.routes.update_alleles',
+             autoretry_for=(subprocess.CalledProcessError,),
+             max_retries=INSERTION_RETRIES, retry_backoff=60,
+             acks_late=True)
 def update_alleles(temp_dir, graph, sparql, url, user, password):
     """
     """
 
-    result = subprocess.check_output(['python',
-                                      'schema_updater.py',
-                                      '-i', temp_dir,
-                                      '--g', graph,
-                                      '--s', sparql,
-                                      '--b', url,
-                                      '--u', user,
-                                      '--p', password])
+    run_insertion(['python',
+                   'schema_updater.py',
+                   '-i', temp_dir,
+                   '--g', graph,
+                   '--s', sparql,
+                   '--b', url,
+                   '--u', user,
+                   '--p', password])
+
+
+# queue to compress schemas
+# the number of workers that consume this queue limits
+# the number of schemas that are compressed simultaneously
+@celery.task(name='ns.api.routes.compress_schema')
+def compress_schema(species_id, schema_id, graph, sparql, url, user, password,
+                    raise_errors=True, token=None):
+    """ Compresses a schema. Tasks queued without the token
+        returned by `cq.request_compression` request it first
+        and return if the request is coalesced with another
+        task.
+    """
+
+    if token is None:
+        token = cq.request_compression(species_id, schema_id)
+        if token is None:
+            return
+
+    if cq.mark_running(species_id, schema_id, token) is False:
+        return
+
+    command = ['python',
+               'schema_compressor.py',
+               '-m', 'single',
+               '--sp', str(species_id),
+               '--sc', str(schema_id),
+               '--g', graph,
+               '--s', sparql,
+               '--b', url,
+               '--u', user,
+               '--p', password]
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        while True:
+            try:
+                returncode = process.wait(timeout=cq.HEARTBEAT)
+                break
+            except subprocess.TimeoutExpired:
+                # keep the schema marked as running
+                cq.refresh(species_id, schema_id, token)
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+    except subprocess.CalledProcessError:
+        # the upload pipeline continues if compression fails
+        # (the schema can be compressed later)
+        if raise_errors is True:
+            raise
+    finally:
+        # accept new requests for the schema or compress it again
+        # if it was requested while it was being compressed
+        if cq.release(species_id, schema_id, token) is True:
+            compress_schema.apply_async(queue='compress_queue',
+                                        args=(species_id, schema_id, graph,
+                                              sparql, url, user, password),
+                                        kwargs={'raise_errors': raise_errors,
+                                                'token': token})
+
+
+# queue to create the pre-computed files of schemas
+# runs in parallel with compression in the upload pipeline
+@celery.task(name='ns.api.routes.precompute_schema')
+def precompute_schema(species_id, schema_id, graph, sparql, url):
+    """ Creates the pre-computed files of a schema. Errors are
+        logged, the upload pipeline continues if the files cannot
+        be created (they are created again when the schema changes).
+    """
+
+    try:
+        precompute.schema_changed(species_id, schema_id, graph, sparql, url)
+    except Exception as e:
+        logger.exception('Could not create pre-computed files of schema '
+                         '{0} of species {1}: {2}'.format(schema_id, species_id, e))
+
+
+def unlock_schema(schema_uri, graph, sparql, user, password):
+    """ Unlocks a schema.
+
+        Returns
+        -------
+        bool
+            True if the schema was unlocked, False otherwise.
+    """
+
+    results = [aux.send_data(sq.DELETE_SCHEMA_LOCK.format(graph, schema_uri),
+                             sparql, user, password),
+               aux.send_data(sq.INSERT_SCHEMA_LOCK.format(graph, schema_uri, 'Unlocked'),
+                             sparql, user, password)]
+
+    failed = [r for r in results if r.status_code > 201]
+    for r in failed:
+        logger.error('Could not unlock schema {0}. Response:\n{1}'.format(schema_uri,
+                                                                          r.text))
+
+    return len(failed) == 0
+
+
+# last task of the upload pipeline
+@celery.task(name='ns.api.routes.finish_upload')
+def finish_upload(temp_dir, graph, sparql, url, user, password):
+    """ Unlocks a schema after its alleles were inserted and
+        removes the temporary directory of the upload.
+    """
+
+    species_id, schema_id = os.path.basename(temp_dir).split('_')[:2]
+    schema_uri = '{0}species/{1}/schemas/{2}'.format(url, species_id, schema_id)
+
+    unlocked = unlock_schema(schema_uri, graph, sparql, user, password)
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if unlocked is True:
+        up.publish(species_id, schema_id, up.COMPLETE)
+    else:
+        up.publish(species_id, schema_id, up.FAILED,
+                   {'message': 'Alleles were inserted but the schema could not be unlocked.'})
+
+
+# called when a task of an upload fails after its retries
+@celery.task(name='ns.api.routes.upload_failed')
+def upload_failed(temp_dir, graph, sparql, url, user, password, unlock=True):
+    """ Reports the failure of the upload or update of a schema.
+        Schemas that were being updated are unlocked, the data
+        they had before the update is consistent. New schemas
+        whose alleles were partially inserted stay locked until
+        the upload is resumed. The temporary directory is kept,
+        it has the progress journal and the data that was not
+        inserted.
+    """
+
+    species_id, schema_id = os.path.basename(temp_dir).split('_')[:2]
+    schema_uri = '{0}species/{1}/schemas/{2}'.format(url, species_id, schema_id)
+
+    logger.error('Could not insert data of schema {0} from {1}.'.format(schema_uri,
+                                                                        temp_dir))
+    if unlock is True:
+        unlock_schema(schema_uri, graph, sparql, user, password)
+        message = 'Could not insert the data of the schema.'
+    else:
+        message = ('Could not insert the data of the schema. The schema '
+                   'stays locked until the upload is resumed.')
+
+    up.publish(species_id, schema_id, up.FAILED, {'message': message})
+
+
+def upload_pipeline(temp_dir, graph, sparql, url, user, password):
+    """ Creates the tasks that complete the upload of a schema.
+        The alleles are inserted, then the schema is compressed
+        and the pre-computed files are created in parallel, and
+        the schema is unlocked when both tasks finish.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+
+        Returns
+        -------
+        celery.canvas.Signature
+            The workflow of the upload.
+    """
+
+    species_id, schema_id = os.path.basename(temp_dir).split('_')[:2]
+    credentials = (graph, sparql, url, user, password)
+
+    # finish_upload does not run if a task fails, the errback
+    # reports the failure and keeps the new schema locked
+    pipeline = chain(insert_alleles.si(temp_dir, *credentials, pipeline=True).set(queue='alleles_queue'),
+                     group(compress_schema.si(species_id, schema_id, *credentials,
+                                              raise_errors=False).set(queue='compress_queue'),
+                           precompute_schema.si(species_id, schema_id,
+                                                graph, sparql, url).set(queue='precompute_queue')),
+                     finish_upload.si(temp_dir, *credentials).set(queue='precompute_queue'))
+    pipeline.link_error(upload_failed.si(temp_dir, *credentials,
+                                         unlock=False).set(queue='precompute_queue'))
+
+    return pipeline
 
 
 # queue to insert single locus
@@ -268,9 +494,44 @@ def add_allele(new_locus_url, spec_name, loci_id, new_user_url,
     if result.status_code > 201:
         return {'FAIL': 'Could not {0} new allele.'.format(operation[1])}, result.status_code
     else:
+        index_records = [(new_seq_url.split('/')[-1], int(loci_id),
+                          int(new_allele_url.split('/')[-1]), len(sequence))]
+        new_seqs = si.add_alleles(index_records)
+        if new_seqs is None:
+            new_seqs = 1 if isNewSeq else 0
+        ns_counters.alleles_added(index_records, new_seqs)
         return {operation[0]: 'A new allele has been {0} to {1}'.format(operation[2], new_allele_url)}, result.status_code
 
 
+def sequence_exists(seq_hash, seq_uri):
+    """ Determines if a sequence exists in the NS. Checks the
+        local sequence index first and only queries Virtuoso
+        if the index cannot answer.
+
+        Parameters
+        ----------
+        seq_hash: str
+            SHA-256 hash of the DNA sequence.
+        seq_uri: str
+            URI of the sequence.
+
+        Returns
+        -------
+        bool
+            True if the sequence exists,
+            False otherwise.
+    """
+
+    seq_exists = si.sequence_exists(seq_hash)
+    metrics.cache_lookup('sequence_index', seq_exists is not None)
+    if seq_exists is None:
+        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                              (sq.ASK_SEQUENCE_HASH.format(seq_uri)))
+        seq_exists = result['boolean']
+
+    return seq_exists
+
+
 def enforce_locking(user_role, user_uri, locking_value):
     """ Enforce role permissions on users, in order to 
         modify data.
@@ -1218,26 +1479,22 @@ class DownloadCompressedSchemas(Resource):
     def get(self, species_id, schema_id, timestamp):
         """ Get the compressed schema. """
 
-        filename = "{0}_{1}".format(
-            str(species_id), str(schema_id))
-
-        for f_name in os.listdir("compressed_schemas"):
-            if f_name.startswith(filename):
-                compressed_schema_filename = f_name
+        root_dir = os.path.abspath(current_app.config['SCHEMAS_ZIP'])
 
-        response = make_response()
+        zip_status, compressed_schema_filename = cs.get_index(root_dir).lookup(species_id, schema_id)
+        if zip_status != cs.READY:
+            return {'Not found': 'Could not find a compressed version of specified schema.'}, 404
 
-        # Set response Headers
-        response.headers['Content-Description'] = 'File Transfer'
-        response.headers['Cache-Control'] = 'no-cache'
-        response.headers['Content-Type'] = 'application/zip'
-        response.headers['X-Accel-Redirect'] = "/compressed_schemas/" + compressed_schema_filename
+        if current_app.config['X_ACCEL_REDIRECT'] is False:
+            return cs.send_archive(root_dir, compressed_schema_filename)
 
-        return response
+        # nginx creates the ETag and answers conditional requests
+        return ft.accel_redirect(current_app.config['X_ACCEL_SCHEMAS_ZIP'] + compressed_schema_filename,
+                                 compressed_schema_filename, 'application/zip')
 
 
 @download_conf.route("/prodigal_training_files/<string:ptf_hash>")
-class DownloadCompressedSchemas(Resource):
+class DownloadProdigalTrainingFiles(Resource):
     """ Download a prodigal training file. """
 
     @api.doc(responses={200: 'OK',
@@ -1250,19 +1507,46 @@ class DownloadCompressedSchemas(Resource):
     def get(self, ptf_hash):
         """ Get the prodigal training file. """
 
-        ptf_file_name = str(ptf_hash)
+        ptf_file_name = secure_filename(str(ptf_hash))
 
-        response = make_response()
+        root_dir = os.path.abspath(current_app.config['SCHEMAS_PTF'])
+        if os.path.isfile(os.path.join(root_dir, ptf_file_name)) is False:
+            return {'Not found': 'Could not find a training file with provided hash.'}, 404
 
-        # Set response Headers
-        response.headers['Content-Description'] = 'File Transfer'
-        response.headers['Cache-Control'] = 'no-cache'
-        response.headers['Content-Type'] = 'application/octet-stream; charset=iso-8859-1'
-        response.headers['X-Accel-Redirect'] = "/prodigal_training_files/" + ptf_file_name
+        # training files are named after the hash of their content
+        if current_app.config['X_ACCEL_REDIRECT'] is True:
+            return ft.accel_redirect(current_app.config['X_ACCEL_SCHEMAS_PTF'] + ptf_file_name,
+                                     ptf_file_name, 'application/octet-stream',
+                                     cache_control=ft.IMMUTABLE)
+
+        response = send_from_directory(root_dir, ptf_file_name, as_attachment=True)
+        response.headers['Cache-Control'] = ft.IMMUTABLE
 
         return response
 
 
+# NS metrics Routes
+# Namespace for service metrics
+metrics_conf = api.namespace('metrics', description='service metrics.')
+
+
+@metrics_conf.route("/prometheus")
+class MetricsPrometheus(Resource):
+    """ Service metrics in the Prometheus text format. """
+
+    @api.doc(responses={200: 'OK',
+                        500: 'Internal Server Error',
+                        403: 'Unauthorized',
+                        401: 'Unauthenticated'},
+             security=["access_token"])
+    @w.admin_required
+    def get(self):
+        """ Get request, SPARQL, cache, queue and job metrics (Admin only). """
+
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 # NS statistics Routes
 # Namespace for NS statistics operations
 stats_conf = api.namespace('stats', description='statistics of the database.')
@@ -1282,12 +1566,19 @@ class StatsSummary(Resource):
     def get(self):
         """ Count the number of items in Typon """
 
+        # serve the materialized counts
+        counts = ns_counters.get_counts()
+        metrics.cache_lookup('ns_counters', counts is not None)
+        if counts is not None:
+            return ns_counters.to_bindings(counts), 200
+
         # get simple counts for data in the NS
         result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
                               (sq.NS_STATS.format(current_app.config['DEFAULTHGRAPH'])))
 
         stats = result['results']['bindings']
         if stats != []:
+            ns_counters.reconcile(ns_counters.from_bindings(stats))
             return stats, 200
         else:
             return {'NOT FOUND': 'Could not retrieve summary info from NS.'}, 404
@@ -2014,11 +2305,10 @@ class LociNSAlleles(Resource):
             current_app.config['BASE_URL'], str(seq_hash))
 
         # check if there is a sequence with the same hash
-        hash_presence = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                     (sq.ASK_SEQUENCE_HASH.format(new_seq_url)))
+        seq_exists = sequence_exists(seq_hash, new_seq_url)
 
         # if the sequence already exists in the NS
-        if hash_presence['boolean']:
+        if seq_exists:
             # celery task
             task = add_allele.apply(
                 args=[locus_url, species_name, loci_id,
@@ -2286,6 +2576,7 @@ class SpeciesListAPItypon(Resource):
                                current_app.config['VIRTUOSO_PASS'])
 
         if result.status_code in [200, 201]:
+            ns_counters.increment({'species': 1})
             return {'message': '{0} added to the NS.'.format(taxon_name)}, 201
         else:
             return {'message': 'Could not add new taxon to the NS.',
@@ -2645,6 +2936,7 @@ class SchemaListAPItypon(Resource):
                                current_app.config['VIRTUOSO_PASS'])
 
         if result.status_code in [200, 201]:
+            ns_counters.increment({'schemas': 1})
             # save file with schema files hashes
             root_dir = os.path.abspath(current_app.config['SCHEMA_UP'])
 
@@ -2655,11 +2947,8 @@ class SchemaListAPItypon(Resource):
             if os.path.isdir(temp_dir) is False:
                 os.mkdir(temp_dir)
 
-            # save file with schema hashes after schema is created
-            hashes_file = os.path.join(temp_dir, '{0}_{1}_hashes'.format(species_id, schema_id))
-            with open(hashes_file, 'wb') as hf:
-                schema_hashes = {k:[False, [False, False, False]] for k in schema_hashes}
-                pickle.dump(schema_hashes, hf)
+            # create log with the status of the schema loci
+            us.create(temp_dir, schema_hashes)
 
             return {'message': 'A new schema for {0} was created sucessfully'.format(species_url),
                     "url": new_schema_url}, 201
@@ -3115,8 +3404,19 @@ class SchemaPtfAPItypon(Resource):
         ptf_hash = ptf_query['results']['bindings'][0]['ptf']['value']
 
         root_dir = os.path.abspath(current_app.config['SCHEMAS_PTF'])
+        if os.path.isfile(os.path.join(root_dir, ptf_hash)) is False:
+            return {'Not found': 'Could not find the training file for specified schema.'}, 404
 
-        return send_from_directory(root_dir, ptf_hash, as_attachment=True)
+        # training files are named after the hash of their content
+        if current_app.config['X_ACCEL_REDIRECT'] is True:
+            return ft.accel_redirect(current_app.config['X_ACCEL_SCHEMAS_PTF'] + ptf_hash,
+                                     ptf_hash, 'application/octet-stream',
+                                     cache_control=ft.IMMUTABLE)
+
+        response = send_from_directory(root_dir, ptf_hash, as_attachment=True)
+        response.headers['Cache-Control'] = ft.IMMUTABLE
+
+        return response
 
     # upload schema Prodigal training file
     @api.hide
@@ -3198,20 +3498,32 @@ class SchemaZipAPItypon(Resource):
         if locking_status != 'Unlocked':
             return {'Unauthorized': 'Schema is locked.'}, 403
 
-        zip_prefix = '{0}_{1}'.format(species_id, schema_id)
-
         root_dir = os.path.abspath(current_app.config['SCHEMAS_ZIP'])
 
-        schema_zip = [z for z in os.listdir(
-            root_dir) if z.startswith(zip_prefix) is True]
-        if len(schema_zip) == 1 and '.zip' in schema_zip[0]:
+        zip_status, schema_zip = cs.get_index(root_dir).lookup(species_id, schema_id)
+        if zip_status == cs.READY:
             if request_type == 'check':
-                return {'zip': schema_zip}, 200
+                # report compression tasks that will replace the archive
+                compression_state = cq.get_state(species_id, schema_id)
+                if compression_state is not None:
+                    return {'zip': [schema_zip],
+                            'compression': compression_state}, 200
+                return {'zip': [schema_zip]}, 200
             elif request_type == 'download':
-                return send_from_directory(root_dir, schema_zip[0], as_attachment=True)
-        elif (len(schema_zip) == 1 and '.zip' not in schema_zip[0]) or len(schema_zip) > 1:
+                # nginx serves the file and handles Range requests
+                if current_app.config['X_ACCEL_REDIRECT'] is True:
+                    return ft.accel_redirect(current_app.config['X_ACCEL_SCHEMAS_ZIP'] + schema_zip,
+                                             schema_zip, 'application/zip')
+                # supports resuming interrupted downloads with Range requests
+                return cs.send_archive(root_dir, schema_zip)
+        elif zip_status == cs.WORKING:
             return {'Working': 'A new compressed version of the schema is being created. Please try again later.'}, 403
-        elif len(schema_zip) == 0:
+        elif zip_status == cs.MISSING:
+            compression_state = cq.get_state(species_id, schema_id)
+            if compression_state is not None:
+                return {'Working': 'Schema is {0} for compression. '
+                                   'Please try again later.'.format(compression_state),
+                        'compression': compression_state}, 403
             return {'Not found': 'Could not find a compressed version of specified schema.'}, 404
 
     # send post to compress single schema
@@ -3253,10 +3565,25 @@ class SchemaZipAPItypon(Resource):
             if permission[0] is not True:
                 return permission[1], 403
 
-        # add '&' at the end so that it will not wait for process to finish
-        compress_cmd = ('python schema_compressor.py -m single '
-                        '--sp {0} --sc {1} &'.format(species_id, schema_id))
-        os.system(compress_cmd)
+        # only queue one compression task per schema
+        token = cq.request_compression(species_id, schema_id)
+        if token is None:
+            return {'OK': 'Schema is already {0} for compression by '
+                          'the NS.'.format(cq.get_state(species_id, schema_id))}, 201
+
+        try:
+            compress_schema.apply_async(queue='compress_queue',
+                                        args=(species_id,
+                                              schema_id,
+                                              current_app.config['DEFAULTHGRAPH'],
+                                              current_app.config['LOCAL_SPARQL'],
+                                              current_app.config['BASE_URL'],
+                                              current_app.config['VIRTUOSO_USER'],
+                                              current_app.config['VIRTUOSO_PASS']),
+                                        kwargs={'token': token})
+        except Exception:
+            cq.release(species_id, schema_id, token)
+            raise
 
         return {'OK': 'Schema will be compressed by the NS.'}, 201
 
@@ -3684,34 +4011,33 @@ class SchemaLociDataAPItypon(Resource):
         if os.path.isdir(temp_dir) is False:
             return {'message': 'There is no temp folder for specified schema.'}, 404
 
-        # count number of loci in Chewie-NS
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                    (sq.COUNT_TOTAL_LOCI.format(current_app.config['DEFAULTHGRAPH'])))
-        nr_loci = result['results']['bindings'][0]['count']['value']
-        # links to species
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                    (sq.COUNT_SPECIES_LOCI.format(current_app.config['DEFAULTHGRAPH'], species_uri)))
-        sp_loci = result['results']['bindings'][0]['count']['value']
-        # links to schema
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                    (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
-        sc_loci = result['results']['bindings'][0]['count']['value']
+        # get the loci counts reported by the upload processes
+        progress = up.get_progress(species_id, schema_id) or {}
+        if 'nr_loci' in progress:
+            nr_loci = progress['nr_loci']
+            sp_loci = progress['sp_loci']
+            sc_loci = progress['sc_loci']
+        else:
+            # count number of loci in Chewie-NS
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                        (sq.COUNT_TOTAL_LOCI.format(current_app.config['DEFAULTHGRAPH'])))
+            nr_loci = result['results']['bindings'][0]['count']['value']
+            # links to species
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                        (sq.COUNT_SPECIES_LOCI.format(current_app.config['DEFAULTHGRAPH'], species_uri)))
+            sp_loci = result['results']['bindings'][0]['count']['value']
+            # links to schema
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                        (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
+            sc_loci = result['results']['bindings'][0]['count']['value']
 
-        filename = os.path.join(temp_dir, '{0}_{1}_hashes'.format(species_id, schema_id))
-        file_path = os.path.join(temp_dir, filename)
-        # check if file with schema files hashes exists
-        if os.path.isfile(file_path) is False:
+        # check if log with the status of the schema loci exists
+        upload_status = us.get_status(temp_dir)
+        if upload_status is None:
             return {'Not found': 'Could not find file with schema hashes.'}, 404
         else:
-            with open(file_path, 'rb') as hf:
-                schema_hashes = pickle.load(hf)
-
-            inserted = []
-            for k, v in schema_hashes.items():
-                inserted.extend(v[1])
-
-            inserted = set(inserted)
-            if False not in inserted:
+            schema_hashes = upload_status.loci
+            if upload_status.all_inserted() is True:
                 return {'status': 'complete',
                         'hashes': schema_hashes,
                         'nr_loci': nr_loci,
@@ -3775,11 +4101,12 @@ class SchemaLociDataAPItypon(Resource):
         temp_dir = os.path.join(root_dir, '{0}_{1}'.format(species_id, schema_id))
 
         # get the list of schema loci
-        hashes_file = os.path.join(temp_dir, '{0}_{1}_hashes'.format(species_id, schema_id))
-        with open(hashes_file, 'rb') as hf:
-            loci_hashes = pickle.load(hf)
-            # determine incomplete cases
-            loci_hashes = {k:v for k, v in loci_hashes.items() if False in v[1]}
+        upload_status = us.get_status(temp_dir)
+        if upload_status is None:
+            return {'Not found': 'Could not find file with schema hashes.'}, 404
+
+        # determine incomplete cases
+        loci_hashes = upload_status.incomplete_loci()
 
         # check if all loci data has been inserted
         #if len(loci_hashes) == 0:
@@ -3787,20 +4114,12 @@ class SchemaLociDataAPItypon(Resource):
 
         # get file from POST data
         file = request.files['file']
-        filename = file.filename
-
-        # save file in schema temporary directory
-        file_path = os.path.join(temp_dir, filename)
-        file.save(file_path)
-
-        # uncompress ZIP
-        with zipfile.ZipFile(file_path) as zf:
-            zf.extractall(temp_dir)
+        if ud.is_archive(file.stream) is False:
+            return {'message': 'Loci data must be sent in a ZIP archive.'}, 400
 
-        # get loci insert data
-        loci_file = file_path.split('.zip')[0]
-        with open(loci_file, 'rb') as lf:
-            loci_data = pickle.load(lf)
+        # get loci insert data from the uploaded archive
+        # (the archive is not extracted)
+        loci_data = ud.read_archive(file.stream)
 
         # check if all loci belong to schema
         local_loci = set([l[1] for l in loci_data[1]])
@@ -3824,8 +4143,17 @@ class SchemaLociDataAPItypon(Resource):
                         (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
             sc_loci = result['results']['bindings'][0]['count']['value']
 
-            # delete ZIP
-            os.remove(file_path)
+            # save ZIP in schema temporary directory, the loci
+            # inserter reads the data from the archive
+            file.stream.seek(0)
+            file.save(os.path.join(temp_dir, '{0}_{1}_loci.zip'.format(species_id, schema_id)))
+
+            up.publish(species_id, schema_id, 'loci_received',
+                       {'nr_loci': nr_loci, 'sp_loci': sp_loci, 'sc_loci': sc_loci})
+
+            # loci data is sent again when an upload is resumed,
+            # alleles insertion can start again after this point
+            upload_status.release(us.PIPELINE)
 
             # insert loci
             loci_insertion = insert_loci.apply_async(queue='loci_queue',
@@ -4002,34 +4330,82 @@ class SchemaLociDataAPItypon(Resource):
 
         file = request.files['file']
         locus_hash = file.filename
+        if ud.is_archive(file.stream) is False:
+            return {'message': 'Locus data must be sent in a ZIP archive.'}, 400
 
-        hashes_file = os.path.join(temp_dir, '{0}_{1}_hashes'.format(species_id, schema_id))
-        with open(hashes_file, 'rb') as hf:
-            loci_hashes = pickle.load(hf)
+        upload_status = us.get_status(temp_dir)
+        if upload_status is None:
+            return {'Not found': 'Could not find file with schema hashes.'}, 404
 
-        if locus_hash not in loci_hashes:
+        if locus_hash not in upload_status.loci:
             return {'Not acceptable': 'Provided locus data does not match any locus from the schema'}, 406
-        elif locus_hash in loci_hashes:
+        elif locus_hash in upload_status.loci:
             file.save(os.path.join(temp_dir, locus_hash))
+            upload_status.record([(locus_hash, us.ALLELES, None)])
 
-            loci_hashes[locus_hash][0] = True
-            with open(hashes_file, 'wb') as hf:
-                pickle.dump(loci_hashes, hf)
-
-        alleles_values = [v[0] for v in list(loci_hashes.values())]
-        if all(alleles_values) is True:
+        # start insertion once, even if the last files
+        # are received at the same time
+        if upload_status.all_received() is True and upload_status.claim(us.PIPELINE) is True:
             # insert alleles
-            alleles_insertion = insert_alleles.apply_async(queue='alleles_queue',
-                                                           args=(temp_dir,
-                                                                 current_app.config['DEFAULTHGRAPH'],
-                                                                 current_app.config['LOCAL_SPARQL'],
-                                                                 current_app.config['BASE_URL'],
-                                                                 current_app.config['VIRTUOSO_USER'],
-                                                                 current_app.config['VIRTUOSO_PASS']))
+            alleles_insertion = upload_pipeline(temp_dir,
+                                                current_app.config['DEFAULTHGRAPH'],
+                                                current_app.config['LOCAL_SPARQL'],
+                                                current_app.config['BASE_URL'],
+                                                current_app.config['VIRTUOSO_USER'],
+                                                current_app.config['VIRTUOSO_PASS']).apply_async()
 
         return {'OK': 'Received file with data to insert alleles of new locus.'}, 201
 
 
+@species_conf.route('/<int:species_id>/schemas/<int:schema_id>/progress')
+class SchemaProgressAPItypon(Resource):
+
+    @api.hide
+    @api.doc(responses={200: 'OK',
+                        403: 'Unauthorized',
+                        404: 'Not Found'},
+             security=[])
+    def get(self, species_id, schema_id):
+        """Stream the progress of a schema upload or update (Server-Sent Events)."""
+
+        # c_user = get_jwt_identity()
+        c_user = "2"
+
+        schema_uri = '{0}species/{1}/schemas/{2}'.format(
+            current_app.config['BASE_URL'], species_id, schema_id)
+
+        # check if schema exists
+        schema_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            (sq.ASK_SCHEMA.format(schema_uri)))
+        if schema_query['boolean'] is False:
+            return {'Not found': 'Could not find a schema with specified ID.'}, 404
+
+        # only the user that is uploading or updating
+        # the schema and Admins can follow the progress
+        user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
+
+        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
+        user_role = result['results']['bindings'][0]['role']['value']
+
+        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
+        locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
+
+        if user_role != 'Admin' and user_uri != locking_status:
+            return {'Not authorized': 'Only Admin or user that is uploading or '
+                    'updating the schema may follow its progress.'}, 403
+
+        # clients that reconnect send the identifier of the last event
+        last_id = request.headers.get('Last-Event-ID', '')
+        last_id = int(last_id) if last_id.isdigit() else None
+
+        return Response(stream_with_context(up.stream(species_id, schema_id, last_id)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+
+
 @species_conf.route('/<int:species_id>/schemas/<int:schema_id>/status')
 class SchemaStatusAPItypon(Resource):
 
@@ -4088,10 +4464,9 @@ class SchemaStatusAPItypon(Resource):
 
         # determine compressed version date
         compressed_dir = os.path.abspath(current_app.config['SCHEMAS_ZIP'])
-        compressed_schema = [f for f in os.listdir(compressed_dir)
-                                if f.startswith('{0}_{1}'.format(species_id, schema_id))]
-        if len(compressed_schema) > 0 and 'temp' not in compressed_schema[0]:
-            compressed_schema = compressed_schema[0].split('_')[-1].rstrip('.zip')
+        zip_status, compressed_schema = cs.get_index(compressed_dir).lookup(species_id, schema_id)
+        if compressed_schema is not None:
+            compressed_schema = cs.archive_date(compressed_schema)
         else:
             compressed_schema = 'N/A'
 
@@ -4140,10 +4515,15 @@ class SchemaLociUpdateAPItypon(Resource):
             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
-        # count number of alleles
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-            (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
-        nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
+        # get the number of alleles reported by the update process
+        progress = up.get_progress(species_id, schema_id) or {}
+        if 'nr_alleles' in progress:
+            nr_alleles = progress['nr_alleles']
+        else:
+            # count number of alleles
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
+            nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
 
         if user_uri == locking_status:
             root_dir = os.path.abspath(current_app.config['SCHEMA_UP'])
@@ -4151,20 +4531,10 @@ class SchemaLociUpdateAPItypon(Resource):
             # folder to hold files with alleles to insert
             temp_dir = os.path.join(root_dir, '{0}_{1}'.format(species_id, schema_id))
 
-            # read file with results
+            # read file with results (the update process
+            # renames the file after it is fully written)
             identifiers_file = os.path.join(temp_dir, 'identifiers')
             if os.path.isfile(identifiers_file) is True:
-                # determine if file has been fully written
-                start_size = os.stat(identifiers_file).st_size
-                written = False
-                while written is False:
-                    time.sleep(2)
-                    current_size = os.stat(identifiers_file).st_size
-                    if current_size == start_size:
-                        written = True
-                    else:
-                        start_size = current_size
-
                 # get alleles insertion response
                 with open(identifiers_file, 'rb') as rf:
                     results = pickle.load(rf)
@@ -4188,7 +4558,8 @@ class SchemaLociUpdateAPItypon(Resource):
                         403: 'Unauthorized',
                         401: 'Unauthenticated',
                         404: 'Not Found',
-                        406: 'Not acceptable'},
+                        406: 'Not acceptable',
+                        409: 'Conflict'},
              security=[])
     def post(self, species_id, schema_id, loci_id):
 
@@ -4235,26 +4606,50 @@ class SchemaLociUpdateAPItypon(Resource):
         # create folder when uploading first file
         if os.path.isdir(temp_dir) is False:
             os.mkdir(temp_dir)
+        # the first file of a new update removes the data and the
+        # journal of the previous update of the schema
+        elif ij.clear_run(temp_dir) is False:
+            return {'message': 'The previous update of the schema is still '
+                    'being inserted.'}, 409
 
         file = request.files['file']
-        locus_hash = file.filename
-
-        file.save(os.path.join(temp_dir, locus_hash))
+        if ud.is_archive(file.stream) is False:
+            return {'message': 'Locus data must be sent in a ZIP archive.'}, 400
+
+        # the file name is used as the name of the file in the
+        # upload directory and must not replace the files
+        # created by the update process
+        locus_file = secure_filename(file.filename or '')
+        reserved = ('identifiers', ij.JOURNAL_FILE, ij.RUN_FILE,
+                    us.STATUS_FILE.format(species_id, schema_id),
+                    us.LEGACY_FILE.format(species_id, schema_id))
+        if locus_file == '' or locus_file != file.filename or \
+                locus_file.startswith(reserved):
+            return {'message': 'Invalid locus file name.'}, 400
+
+        file.save(os.path.join(temp_dir, locus_file))
 
         if 'complete' in request.headers:
             # count number of alleles in schema
             result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
                                   (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
             nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
+            up.publish(species_id, schema_id, 'alleles_received',
+                       {'nr_alleles': nr_alleles})
+
+            # retries of the task resume from the journal, the
+            # next update clears the directory
+            ij.mark_run(temp_dir)
 
             # start script that inserts submitted alleles
+            credentials = (current_app.config['DEFAULTHGRAPH'],
+                           current_app.config['LOCAL_SPARQL'],
+                           current_app.config['BASE_URL'],
+                           current_app.config['VIRTUOSO_USER'],
+                           current_app.config['VIRTUOSO_PASS'])
             result = update_alleles.apply_async(queue='sync_queue',
-                                                args=(temp_dir,
-                                                      current_app.config['DEFAULTHGRAPH'],
-                                                      current_app.config['LOCAL_SPARQL'],
-                                                      current_app.config['BASE_URL'],
-                                                      current_app.config['VIRTUOSO_USER'],
-                                                      current_app.config['VIRTUOSO_PASS']))
+                                                args=(temp_dir,) + credentials,
+                                                link_error=upload_failed.si(temp_dir, *credentials).set(queue='sync_queue'))
 
             return {'nr_alleles': nr_alleles}, 201
 
@@ -4305,7 +4700,7 @@ class SchemaLociLengthsAPItypon(Resource):
                                     sq.ASK_SCHEMA_LOCUS.format(schema_uri, locus_uri))
 
         if schema_locus['boolean'] is False:
-            return {'Not Found': 'Schema has no locus with provided ID.'}
+            return {'Not Found': 'Schema has no locus with provided ID.'}, 404
 
         root_dir = os.path.abspath(current_app.config['PRE_COMPUTE'])
 
@@ -4313,44 +4708,100 @@ class SchemaLociLengthsAPItypon(Resource):
         schema_dir = os.path.join(root_dir, '{0}_{1}_lengths'.format(species_id, schema_id))
 
         request_data = request.get_json()
+        content = request_data.get('content') if isinstance(request_data, dict) else None
+        # alleles hashes are written to the lengths files of the
+        # schema and the lengths are stored as uint32
+        if isinstance(content, dict) is False or \
+                any([isinstance(v, dict) is False or al.valid_alleles(v) is False
+                     for v in content.values()]):
+            return {'message': 'Alleles hashes must be SHA-256 hexadecimal digests '
+                    'and lengths must be non-negative integers.'}, 400
+
+        file_content = {locus_uri: content[k] for k in content}
 
-        schemas_temp = os.path.abspath(current_app.config['SCHEMA_UP'])
-        schema_temp = os.path.join(schemas_temp, '{0}_{1}'.format(species_id, schema_id))
+        # add new alleles
+        al.add_lengths(schema_dir, file_content)
 
-        file_content = request_data['content']
-        file_content = {locus_uri: file_content[k] for k in file_content}
+        return {'OK': 'Received file alleles lengths to add to schema info.'}, 201
 
-        # if file does not exist
-        if os.path.isdir(schema_dir) is False:
-            os.mkdir(schema_dir)
 
-        locus_file = os.path.join(schema_dir, '{0}_{1}_{2}'.format(species_id, schema_id, loci_id))
+@species_conf.route('/<int:species_id>/schemas/<int:schema_id>/lengths')
+class SchemaLengthsAPItypon(Resource):
 
-        if os.path.isfile(locus_file) is False:
-            with open(locus_file, 'wb') as lf:
-                pickle.dump(file_content, lf)
-        else:
-            with open(locus_file, 'rb') as lf:
-                locus_data = pickle.load(lf)
+    @api.hide
+    @api.doc(responses={201: 'OK',
+                        400: 'Invalid Argument',
+                        500: 'Internal Server Error',
+                        403: 'Unauthorized',
+                        401: 'Unauthenticated',
+                        404: 'Not Found',
+                        406: 'Not acceptable'},
+             security=[])
+    def post(self, species_id, schema_id):
+        """Add the alleles lengths of several loci of a schema."""
+
+        # c_user = get_jwt_identity()
+        c_user = "2"
+
+        schema_uri = '{0}species/{1}/schemas/{2}'.format(
+            current_app.config['BASE_URL'], species_id, schema_id)
+
+        # determine if schema is locked
+        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                                            (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
+        locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
-            ns_data = locus_data[locus_uri]
-            user_data = file_content[locus_uri]
+        if locking_status != 'Unlocked':
+            # check the role of the user that is trying to access
+            user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-            ns_alleles = set(ns_data)
-            user_alleles = set(user_data)
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                                  (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
-            # determine new alleles
-            new_alleles = user_alleles - ns_alleles
-            # add new alleles
-            for a in new_alleles:
-                ns_data[a] = user_data[a]
+            user_role = result['results']['bindings'][0]['role']['value']
 
-            locus_data[locus_uri] = ns_data
+            if user_role != 'Admin' and user_uri != locking_status:
+                return {'Not authorized': 'Only Admin or user that locked schema can send data.'}, 403
 
-            with open(locus_file, 'wb') as lf:
-                pickle.dump(locus_data, lf)
+        # lengths of each locus, with loci identifiers as keys
+        request_data = request.get_json()
+        content = request_data.get('content') if isinstance(request_data, dict) else None
+        if isinstance(content, dict) is False or \
+                any([isinstance(v, dict) is False for v in content.values()]):
+            return {'message': 'Expected alleles lengths for each locus.'}, 400
+
+        # loci identifiers and alleles hashes are written to the
+        # lengths files and the lengths are stored as uint32
+        invalid = [k for k, v in content.items()
+                   if not (k.isascii() and k.isdigit()) or al.valid_alleles(v) is False]
+        if len(invalid) > 0:
+            return {'message': 'Alleles hashes must be SHA-256 hexadecimal digests '
+                    'and lengths must be non-negative integers.',
+                    'loci': invalid}, 400
+
+        loci_lengths = {'{0}loci/{1}'.format(current_app.config['BASE_URL'], k): v
+                        for k, v in content.items()}
+
+        # check if all loci are linked to schema (single query)
+        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                              sq.SELECT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri))
+        schema_loci = set([l['locus']['value'] for l in result['results']['bindings']])
 
-        return {'OK': 'Received file alleles lengths to add to schema info.'}, 201
+        missing = [l for l in loci_lengths if l not in schema_loci]
+        if len(missing) > 0:
+            return {'Not Found': 'Schema has no loci with provided IDs.',
+                    'loci': missing}, 404
+
+        root_dir = os.path.abspath(current_app.config['PRE_COMPUTE'])
+
+        # directory that stores the alleles length values
+        schema_dir = os.path.join(root_dir, '{0}_{1}_lengths'.format(species_id, schema_id))
+
+        added = al.add_lengths(schema_dir, loci_lengths)
+
+        return {'OK': 'Received alleles lengths to add to schema info.',
+                'loci': len(loci_lengths),
+                'added': added}, 201
 
 
 @species_conf.route('/<int:species_id>/loci')
@@ -4410,10 +4861,14 @@ class LociListAPItypon(Resource):
             sequence_uri = '{0}sequences/{1}'.format(
                 current_app.config['BASE_URL'], sequence_hash)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_LOCI_WITH_DNA.format(current_app.config['DEFAULTHGRAPH'], sequence_uri, species_url)))
+            # only query Virtuoso for the loci if the sequence exists
+            if sequence_exists(sequence_hash, sequence_uri):
+                result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                                      (sq.SELECT_LOCI_WITH_DNA.format(current_app.config['DEFAULTHGRAPH'], sequence_uri, species_url)))
 
-            res_loci = result['results']['bindings']
+                res_loci = result['results']['bindings']
+            else:
+                res_loci = []
         else:
 
             result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
@@ -5536,12 +5991,17 @@ class SequencesListAPItypon(Resource):
     def get(self):
         """ Gets the total number of sequences """
 
-        # query number of sequences on database
-        # should return 0 if there are no sequences
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.COUNT_SEQUENCES.format(current_app.config['DEFAULTHGRAPH'])))
+        counts = ns_counters.get_counts()
+        metrics.cache_lookup('ns_counters', counts is not None)
+        if counts is not None:
+            number_sequences = counts['sequences']
+        else:
+            # query number of sequences on database
+            # should return 0 if there are no sequences
+            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                                  (sq.COUNT_SEQUENCES.format(current_app.config['DEFAULTHGRAPH'])))
 
-        number_sequences = result['results']['bindings'][0]['count']['value']
+            number_sequences = result['results']['bindings'][0]['count']['value']
 
         return {'message': 'Total number of sequences in the Chewie-NS: {0}'.format(number_sequences)}
 
@@ -5607,10 +6067,7 @@ class SequencesAPItypon(Resource):
                 current_app.config['BASE_URL'], seq_hash)
 
             # check if the sequence exists
-            result_existence = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                            (sq.ASK_SEQUENCE_HASH.format(seq_url)))
-
-            if not result_existence['boolean']:
+            if not sequence_exists(seq_hash, seq_url):
                 return {'message': 'Provided DNA sequence is not in the NS.'}, 404
 
             result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
@@ -5636,6 +6093,12 @@ class SequencesAPItypon(Resource):
             seq_url = '{0}sequences/{1}'.format(
                 current_app.config['BASE_URL'], request_data['seq_id'])
 
+            # the local index can tell that the sequence does not exist
+            seq_exists = si.sequence_exists(request_data['seq_id'])
+            metrics.cache_lookup('sequence_index', seq_exists is not None)
+            if seq_exists is False:
+                return {'NOT FOUND': 'Could not find information for a sequence with provided hash.'}, 404
+
             # get information on sequence, DNA string, uniprot URI and uniprot label
             result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
                                   (sq.SELECT_SEQUENCE_INFO_BY_HASH.format(current_app.config['DEFAULTHGRAPH'], seq_url, query_part)))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains an adaptive concurrency limiter used by the
+processes that send insertion queries to Virtuoso. The number of
+concurrent requests follows an AIMD (additive increase,
+multiplicative decrease) policy:
+
+- the limit increases by one request for every window of fast and
+  successful requests;
+- the limit is halved when a request fails or takes longer than
+  the latency target, and all requests are paused for a short
+  period after failures. Virtuoso rejects requests or takes a long
+  time to answer while it performs a checkpoint, so the pause gives
+  it time to finish before requests are resumed.
+
+The limiter also collects throughput statistics that are written
+to the log files at the end of each run.
+
+Code documentation
+------------------
+"""
+
+
+import time
+import threading
+import contextlib
+
+from config import Config
+
+
+class Slot(object):
+    """ Outcome of a request sent within the limiter. """
+
+    def __init__(self):
+        self.ok = False
+        self.size = 0
+        self.started = time.time()
+
+    def restart(self):
+        """ Starts measuring the latency of the request again
+            (e.g.: after waiting for a lock).
+        """
+
+        self.started = time.time()
+
+
+class AIMDController(object):
+    """ Limits the number of concurrent requests and adapts the
+        limit to the latency and errors of the requests.
+
+        Parameters
+        ----------
+        max_limit : int
+            Maximum number of concurrent requests.
+        min_limit : int
+            Minimum number of concurrent requests.
+        latency_target : float
+            Requests that take longer than this value (seconds)
+            decrease the limit.
+        decrease_factor : float
+            Factor applied to the limit when it decreases.
+        max_pause : float
+            Maximum time (seconds) requests are paused after
+            consecutive failures.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_target=10.0,
+                 decrease_factor=0.5, max_pause=60.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.max_pause = max_pause
+
+        self.limit = float(self.min_limit)
+        self.in_flight = 0
+        self.paused_until = 0
+        self.consecutive_errors = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+        # statistics
+        self.start = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.slow = 0
+        self.bytes_sent = 0
+        self.total_latency = 0
+        self.peak_limit = self.min_limit
+        self.limit_samples = 0
+
+    def acquire(self):
+        """ Waits until a request can be sent. """
+
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.time()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, started, latency, slot):
+        """ Updates the limit based on the outcome of a request.
+
+            Parameters
+            ----------
+            started : float
+                Time the request was sent.
+            latency : float
+                Time the request took (seconds).
+            slot : Slot
+                Outcome of the request.
+        """
+
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_latency += latency
+            self.bytes_sent += slot.size
+            self.limit_samples += self.limit
+
+            if slot.ok is False:
+                self.errors += 1
+                self.consecutive_errors += 1
+                # pause all requests, longer if failures continue
+                pause = min(self.max_pause, 2 ** self.consecutive_errors)
+                self.paused_until = max(self.paused_until, time.time() + pause)
+                self.decrease(started)
+            elif latency > self.latency_target:
+                self.slow += 1
+                self.consecutive_errors = 0
+                self.decrease(started)
+            else:
+                self.consecutive_errors = 0
+                # grows by one after a full window of requests
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.peak_limit = max(self.peak_limit, int(self.limit))
+
+            self.condition.notify_all()
+
+    def decrease(self, started):
+        """ Decreases the limit once per window of requests. Requests
+            that were sent before the last decrease already reflect it
+            and do not decrease the limit again.
+        """
+
+        if started >= self.last_decrease:
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            self.last_decrease = time.time()
+
+    @contextlib.contextmanager
+    def request(self):
+        """ Context manager that sends a request within the limit.
+            The caller sets the `ok` attribute of the yielded slot
+            when the request succeeds and can set its `size` with
+            the number of bytes sent.
+        """
+
+        self.acquire()
+        slot = Slot()
+        try:
+            yield slot
+        finally:
+            self.release(slot.started, time.time() - slot.started, slot)
+
+    def summary(self):
+        """ Creates a summary of the requests that were sent.
+
+            Returns
+            -------
+            str
+                Number of requests, errors, throughput and
+                concurrency statistics.
+        """
+
+        elapsed = max(time.time() - self.start, 1e-6)
+        requests = max(self.requests, 1)
+
+        return ('{0} requests in {1:.1f}s ({2:.2f} requests/s, {3:.1f} KB/s); '
+                '{4} failed, {5} slow; mean latency {6:.2f}s; '
+                'concurrency mean {7:.1f}, peak {8}, max {9}.'
+                ''.format(self.requests, elapsed, self.requests / elapsed,
+                          self.bytes_sent / 1024 / elapsed,
+                          self.errors, self.slow,
+                          self.total_latency / requests,
+                          self.limit_samples / requests,
+                          self.peak_limit, self.max_limit))
+
+
+def get_controller():
+    """ Creates a controller with the limits in the configuration. """
+
+    return AIMDController(Config.INSERT_MAX_CONCURRENCY,
+                          latency_target=Config.INSERT_LATENCY_TARGET)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the functions used to store the lengths of the
+alleles of each schema, which are sent by clients after uploading or
+synchronizing a schema and used to create the pre-computed files.
+
+The lengths of a schema are stored in the schema's lengths directory
+(``<species>_<schema>_lengths``) in a columnar file that is memory-mapped
+by readers (``lengths.cols``). The file has the following layout
+(integers are little-endian):
+
+- magic bytes ``CNSL``, a version byte (1) and 3 padding bytes;
+- the length of the header (8 bytes) and the header, a JSON object
+  with the ``generation`` of the file, the URIs of the ``loci``,
+  sorted by locus identifier, and the number of ``alleles``;
+- the offsets of the alleles of each locus (int64, one more than
+  the number of loci);
+- the lengths of the alleles of all loci (uint32);
+- the SHA-256 digests of the alleles of all loci (32 bytes each),
+  used to determine which alleles sent by clients are new.
+
+New alleles are appended to a delta file with one line per allele
+(locus URI, allele hash and length), named after the generation of
+the columnar file (``lengths.<generation>.tsv``). Writers hold an
+exclusive lock on the directory and only append alleles that are not
+stored. When the delta file grows large it is merged into a new
+columnar file of the next generation. The delta file is kept until
+the next merge, for readers that mapped the previous columnar file.
+
+Directories created before the columnar file have one pickled file
+per locus or a single delta file (``lengths.tsv``), which are merged
+into a columnar file by the first writer.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import json
+import mmap
+import fcntl
+import pickle
+import struct
+import hashlib
+import threading
+
+import numpy as np
+
+
+COLUMNS_FILE = 'lengths.cols'
+DELTA_FILE = 'lengths.{0}.tsv'
+LOCK_FILE = '.lock'
+# delta file of directories created before the columnar file
+LEGACY_DELTA = 'lengths.tsv'
+
+MAGIC = b'CNSL'
+VERSION = 1
+PREFIX = struct.Struct('<4sB3xQ')
+DIGEST_SIZE = 32
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+# largest length stored in the columnar file (uint32)
+MAX_LENGTH = 2**32 - 1
+
+# the delta file is merged into the columnar file when it has more
+# alleles than this or than a quarter of the alleles in that file
+COMPACT_MIN = 50000
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def locus_key(locus_uri):
+    """ Sorts loci URIs by locus identifier. """
+
+    locus_id = locus_uri.rstrip('/').split('/')[-1]
+
+    return (0, int(locus_id), '') if locus_id.isdigit() else (1, 0, locus_uri)
+
+
+def digest(allele_hash):
+    """ Gets the 32 bytes that identify an allele in the columnar
+        file from the hexadecimal SHA-256 hash sent by clients.
+    """
+
+    try:
+        value = bytes.fromhex(allele_hash)
+    except ValueError:
+        value = b''
+
+    if len(value) != DIGEST_SIZE:
+        value = hashlib.sha256(allele_hash.encode('utf-8')).digest()
+
+    return value
+
+
+def valid_alleles(alleles):
+    """ Determines if the alleles sent by a client have valid
+        hashes (64 hexadecimal characters) and lengths (integers
+        that can be stored in the columnar file).
+
+        Parameters
+        ----------
+        alleles : dict
+            Alleles hashes as keys and lengths as values.
+
+        Returns
+        -------
+        bool
+            True if all alleles are valid.
+    """
+
+    for allele_hash, length in alleles.items():
+        if len(allele_hash) != DIGEST_SIZE*2 or \
+                any([c not in HEX_DIGITS for c in allele_hash]):
+            return False
+        # bool is a subclass of int
+        if type(length) is not int or not 0 <= length <= MAX_LENGTH:
+            return False
+
+    return True
+
+
+def align(size):
+
+    return size + (-size % 8)
+
+
+def is_legacy(file):
+
+    return file == LEGACY_DELTA or not (file.startswith('lengths.') or file.startswith('.'))
+
+
+def legacy_files(lengths_dir):
+    """ Lists the files of a lengths directory that were created
+        before the columnar file.
+    """
+
+    return [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)
+            if is_legacy(f)]
+
+
+def read_legacy(lengths_dir):
+    """ Reads the alleles lengths in the pickled files and in
+        the legacy delta file of a lengths directory.
+    """
+
+    loci = {}
+    for file in legacy_files(lengths_dir):
+        if os.path.basename(file) == LEGACY_DELTA:
+            locus_data = DeltaFile(file).refresh().loci
+        else:
+            with open(file, 'rb') as lf:
+                locus_data = pickle.load(lf)
+        for locus_uri, alleles in locus_data.items():
+            loci.setdefault(locus_uri, {}).update(alleles)
+
+    return loci
+
+
+class SchemaLengths(object):
+    """ Alleles lengths of a schema, stored contiguously for each
+        locus.
+
+        Attributes
+        ----------
+        loci : list
+            Loci URIs, sorted by locus identifier.
+        offsets : numpy.ndarray
+            Position of the first allele of each locus in
+            `lengths`, followed by the number of alleles.
+        lengths : numpy.ndarray
+            Lengths of the alleles of all loci.
+        digests : numpy.ndarray
+            SHA-256 digests of the alleles (one row per allele).
+            None if the object was created for readers, which
+            do not need the digests.
+        generation : int
+            Generation of the columnar file (0 if there is none).
+    """
+
+    def __init__(self, loci, offsets, lengths, digests, generation=0):
+        self.loci = loci
+        self.offsets = offsets
+        self.lengths = lengths
+        self.digests = digests
+        self.generation = generation
+
+    def __len__(self):
+
+        return len(self.loci)
+
+    def locus_lengths(self, index):
+
+        return self.lengths[self.offsets[index]:self.offsets[index+1]]
+
+    def locus_digests(self, index):
+        """ Gets the set of digests of the alleles of a locus. """
+
+        data = self.digests[self.offsets[index]:self.offsets[index+1]].tobytes()
+
+        return set([data[i:i+DIGEST_SIZE] for i in range(0, len(data), DIGEST_SIZE)])
+
+    def items(self):
+        """ Yields the URI and the alleles lengths of each locus. """
+
+        for i, locus_uri in enumerate(self.loci):
+            yield (locus_uri, self.locus_lengths(i))
+
+    def merge(self, loci_lengths, digests=True):
+        """ Creates the lengths of a schema with the alleles of
+            this object and new alleles.
+
+            Parameters
+            ----------
+            loci_lengths : dict
+                Loci URIs as keys and dictionaries with alleles
+                hashes as keys and lengths as values. Alleles
+                must not be in this object.
+            digests : bool
+                False to only merge the lengths (the digests
+                of the new object are None).
+        """
+
+        if len(loci_lengths) == 0:
+            return self
+
+        indexes = {l: i for i, l in enumerate(self.loci)}
+        loci = sorted(set(self.loci) | set(loci_lengths), key=locus_key)
+        lengths = []
+        merged_digests = []
+        offsets = [0]
+        for locus_uri in loci:
+            index = indexes.get(locus_uri)
+            if index is not None:
+                lengths.append(self.locus_lengths(index))
+                if digests is True:
+                    merged_digests.append(self.digests[self.offsets[index]:self.offsets[index+1]])
+            alleles = loci_lengths.get(locus_uri, {})
+            if len(alleles) > 0:
+                lengths.append(np.fromiter(alleles.values(), dtype='<u4', count=len(alleles)))
+                if digests is True:
+                    new_digests = b''.join([digest(h) for h in alleles])
+                    merged_digests.append(np.frombuffer(new_digests,
+                                                        dtype=np.uint8).reshape(-1, DIGEST_SIZE))
+            offsets.append(offsets[-1] + (len(self.locus_lengths(index)) if index is not None else 0)
+                           + len(alleles))
+
+        lengths = np.concatenate(lengths) if len(lengths) > 0 else np.zeros(0, dtype='<u4')
+        if digests is True:
+            merged_digests = (np.concatenate(merged_digests) if len(merged_digests) > 0
+                              else np.zeros((0, DIGEST_SIZE), dtype=np.uint8))
+        else:
+            merged_digests = None
+
+        return SchemaLengths(loci, np.array(offsets, dtype='<i8'),
+                             lengths, merged_digests, self.generation)
+
+
+def empty_lengths():
+
+    return SchemaLengths([], np.zeros(1, dtype='<i8'), np.zeros(0, dtype='<u4'),
+                         np.zeros((0, DIGEST_SIZE), dtype=np.uint8))
+
+
+def read_columns(path):
+    """ Memory-maps a columnar file.
+
+        Returns
+        -------
+        SchemaLengths
+            The alleles lengths in the file (None if the
+            file does not exist).
+    """
+
+    try:
+        with open(path, 'rb') as infile:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+    magic, version, header_size = PREFIX.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('{0} is not a valid lengths file.'.format(path))
+
+    header = json.loads(data[PREFIX.size:PREFIX.size+header_size].decode('utf-8'))
+    nr_loci = len(header['loci'])
+    nr_alleles = header['alleles']
+
+    position = PREFIX.size + header_size
+    offsets = np.frombuffer(data, dtype='<i8', count=nr_loci+1, offset=position)
+    position += offsets.nbytes
+    lengths = np.frombuffer(data, dtype='<u4', count=nr_alleles, offset=position)
+    position = align(position + lengths.nbytes)
+    digests = np.frombuffer(data, dtype=np.uint8, count=nr_alleles*DIGEST_SIZE,
+                            offset=position).reshape(-1, DIGEST_SIZE)
+
+    return SchemaLengths(header['loci'], offsets, lengths, digests,
+                         header['generation'])
+
+
+def write_columns(path, schema_lengths):
+    """ Writes a columnar file. The file is replaced after it is
+        written, readers keep the file they mapped.
+    """
+
+    header = json.dumps({'generation': schema_lengths.generation,
+                         'loci': schema_lengths.loci,
+                         'alleles': int(len(schema_lengths.lengths))}).encode('utf-8')
+    # arrays start at 8-byte boundaries
+    header += b' ' * (align(len(header)) - len(header))
+
+    temp_path = '{0}.tmp'.format(path)
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        outfile.write(header)
+        outfile.write(np.asarray(schema_lengths.offsets, dtype='<i8').tobytes())
+        lengths = np.asarray(schema_lengths.lengths, dtype='<u4').tobytes()
+        outfile.write(lengths)
+        outfile.write(b'\0' * (align(len(lengths)) - len(lengths)))
+        outfile.write(np.ascontiguousarray(schema_lengths.digests, dtype=np.uint8).tobytes())
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+
+class DeltaFile(object):
+    """ Alleles lengths in a delta file.
+
+        Attributes
+        ----------
+        loci : dict
+            Loci URIs as keys and dictionaries with alleles
+            hashes as keys and lengths as values.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loci = {}
+        self.alleles = 0
+        self.offset = 0
+        self.inode = None
+
+    def reset(self, inode=None):
+        self.loci, self.alleles, self.offset, self.inode = {}, 0, 0, inode
+
+    def refresh(self):
+        """ Reads the lines appended since the last refresh. """
+
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self.reset()
+                return self
+
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.reset(stat.st_ino)
+
+            if stat.st_size > self.offset:
+                with open(self.path, 'rb') as infile:
+                    infile.seek(self.offset)
+                    data = infile.read(stat.st_size - self.offset)
+                complete = data.rfind(b'\n') + 1
+                for line in data[:complete].decode('utf-8').splitlines():
+                    fields = line.split('\t')
+                    if len(fields) == 3:
+                        alleles = self.loci.setdefault(fields[0], {})
+                        if fields[1] not in alleles:
+                            self.alleles += 1
+                        alleles[fields[1]] = int(fields[2])
+                self.offset += complete
+
+        return self
+
+
+def get_delta(lengths_dir, generation):
+
+    path = os.path.join(os.path.abspath(lengths_dir), DELTA_FILE.format(generation))
+    with _lock:
+        delta = _cache.get(path)
+        if delta is None:
+            delta = _cache[path] = DeltaFile(path)
+
+    return delta.refresh()
+
+
+def load(lengths_dir):
+    """ Loads the alleles lengths of a schema. The columnar file is
+        memory-mapped and used as is if the delta file is empty.
+        Otherwise, the lengths are merged with the lengths in the
+        delta file and the digests, which readers do not use, are
+        not copied.
+
+        Returns
+        -------
+        SchemaLengths
+            The alleles lengths of the schema (without digests).
+    """
+
+    path = os.path.join(lengths_dir, COLUMNS_FILE)
+    columns = read_columns(path)
+    if columns is None:
+        # directory created before the columnar file
+        return empty_lengths().merge(read_legacy(lengths_dir), digests=False)
+
+    delta = get_delta(lengths_dir, columns.generation)
+    if delta.inode is None:
+        # the delta file of the mapped generation is removed by the
+        # second compaction after it, read the new columnar file
+        latest = read_columns(path)
+        if latest is not None and latest.generation != columns.generation:
+            return load(lengths_dir)
+
+    return columns.merge(delta.loci, digests=False)
+
+
+def compact(lengths_dir, schema_lengths):
+    """ Writes the alleles lengths of a schema to a columnar file of
+        the next generation. Must be called by the process that holds
+        the lock.
+
+        The delta file of the previous generation is kept for readers
+        that mapped the previous columnar file and is removed by the
+        next compaction.
+    """
+
+    previous = schema_lengths.generation
+    schema_lengths.generation = previous + 1
+    write_columns(os.path.join(lengths_dir, COLUMNS_FILE), schema_lengths)
+
+    try:
+        os.remove(os.path.join(lengths_dir, DELTA_FILE.format(previous - 1)))
+    except FileNotFoundError:
+        pass
+
+
+def add_lengths(lengths_dir, loci_lengths):
+    """ Adds the lengths of alleles that are not in the store.
+
+        Parameters
+        ----------
+        lengths_dir : str
+            Path to the lengths directory of the schema.
+        loci_lengths : dict
+            Loci URIs as keys and dictionaries with alleles
+            hashes as keys and lengths as values.
+
+        Returns
+        -------
+        added : int
+            Number of alleles added to the store.
+    """
+
+    os.makedirs(lengths_dir, exist_ok=True)
+    lock_fd = os.open(os.path.join(lengths_dir, LOCK_FILE),
+                      os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+
+        columns = read_columns(os.path.join(lengths_dir, COLUMNS_FILE))
+        if columns is None:
+            # create the columnar file with the alleles
+            # in the files created before it
+            legacy = legacy_files(lengths_dir)
+            schema_lengths = empty_lengths().merge(read_legacy(lengths_dir))
+            known = {l: schema_lengths.locus_digests(i)
+                     for i, l in enumerate(schema_lengths.loci)}
+            new_lengths = {l: {h: v for h, v in alleles.items()
+                               if digest(h) not in known.get(l, set())}
+                           for l, alleles in loci_lengths.items()}
+            schema_lengths = schema_lengths.merge(new_lengths)
+            compact(lengths_dir, schema_lengths)
+            for file in legacy:
+                os.remove(file)
+
+            return sum([len(v) for v in new_lengths.values()])
+
+        delta = get_delta(lengths_dir, columns.generation)
+        indexes = {l: i for i, l in enumerate(columns.loci)}
+        lines = []
+        for locus_uri, alleles in loci_lengths.items():
+            delta_alleles = delta.loci.get(locus_uri, {})
+            index = indexes.get(locus_uri)
+            known = columns.locus_digests(index) if index is not None else set()
+            lines.extend(['{0}\t{1}\t{2}\n'.format(locus_uri, h, int(v))
+                          for h, v in alleles.items()
+                          if h not in delta_alleles and digest(h) not in known])
+
+        if len(lines) > 0:
+            fd = os.open(delta.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            delta.refresh()
+
+        if delta.alleles > max(COMPACT_MIN, len(columns.lengths) // 4):
+            compact(lengths_dir, columns.merge(delta.loci))
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+    return len(lines)
+
+
+def read_lengths(lengths_dir):
+    """ Reads the alleles lengths of a schema.
+
+        Returns
+        -------
+        loci_lengths : dict
+            Loci URIs as keys and lists with the alleles
+            lengths as values.
+    """
+
+    return {locus_uri: lengths.tolist() for locus_uri, lengths in load(lengths_dir).items()}
+
+
+def iter_loci(lengths_dir):
+    """ Yields the locus URI and the alleles lengths (a NumPy
+        array) of each locus of a schema, sorted by locus
+        identifier.
+    """
+
+    for locus_uri, lengths in load(lengths_dir).items():
+        yield (locus_uri, lengths)
@@ -32,6 +32,9 @@ from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.Alphabet import generic_dna
 
+from app.utils import metrics
+from app.utils import profiling
+
 
 UNIPROT_SERVER = SPARQLWrapper("http://sparql.uniprot.org/sparql")
 
@@ -1189,6 +1192,8 @@ def progress_bar(process, total, tickval, ticknum, completed):
     return completed
 
 
+@metrics.sparql_timed('get')
+@profiling.timed('sparql_get')
 def get_data(server, sparql_query):
     """ Gets data from Virtuoso.
 
@@ -1350,6 +1355,8 @@ def sanitize_input(mystring):
     return mystring
 
 
+@metrics.sparql_timed('send')
+@profiling.timed('sparql_send')
 def send_data(sparql_query, url_send_local_virtuoso, virtuoso_user, virtuoso_pass):
     """ Sends data to Virtuoso.
 
@@ -1387,6 +1394,8 @@ def send_data(sparql_query, url_send_local_virtuoso, virtuoso_user, virtuoso_pas
     return r
 
 
+@metrics.sparql_timed('get')
+@profiling.timed('sparql_get')
 def send_big_query(server, sparql_query):
     """ Sends a big query to Virtuoso
     """
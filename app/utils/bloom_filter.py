@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a Bloom filter over the hashes of the sequences
+in the Chewie-NS. The filter answers most existence checks for novel
+sequences without reading the sequence index or querying Virtuoso.
+A negative answer is definitive, a positive answer must be confirmed.
+
+The filter is stored in a file that the processes map in memory.
+The insertion processes set the bits of new sequences directly in
+the file, so the Flask workers see new sequences without reloading
+the filter. Building the filter again creates a new file that
+replaces the previous one, and the readers map the new file when
+they detect that it was replaced.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import math
+import mmap
+import fcntl
+import struct
+import threading
+import contextlib
+
+
+MAGIC = b'CNSBLOOM'
+# magic, number of bits and number of hash functions
+HEADER = struct.Struct('<8sQI')
+
+# expected false positive rate
+ERROR_RATE = 0.01
+# minimum number of sequences the filter is sized for
+MIN_CAPACITY = 100000
+
+
+def filter_parameters(capacity, error_rate=ERROR_RATE):
+    """ Determines the number of bits and hash functions of
+        a Bloom filter.
+
+        Parameters
+        ----------
+        capacity : int
+            Number of items the filter is sized for.
+        error_rate : float
+            False positive rate when the filter has
+            `capacity` items.
+
+        Returns
+        -------
+        list
+            The number of bits and the number of hash functions.
+    """
+
+    capacity = max(capacity, MIN_CAPACITY)
+    size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    hashes = max(1, int(round(size / capacity * math.log(2))))
+
+    return [size, hashes]
+
+
+def bit_positions(seq_hash, size, hashes):
+    """ Gets the positions of the bits for a sequence hash. The
+        SHA-256 hash is already uniform, so two 64 bits values
+        taken from it are combined to create the hash functions
+        (double hashing).
+    """
+
+    h1 = int(seq_hash[:16], 16)
+    h2 = int(seq_hash[16:32], 16) | 1
+
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+@contextlib.contextmanager
+def write_lock(path):
+    """ Context manager that prevents concurrent changes to the
+        filter file by the processes that update and build it.
+    """
+
+    with open('{0}.lock'.format(path), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build(path, hashes_iter, capacity, error_rate=ERROR_RATE):
+    """ Creates a filter file with a set of sequence hashes and
+        replaces the current file.
+
+        Parameters
+        ----------
+        path : str
+            Path to the filter file.
+        hashes_iter : iter
+            Iterable with SHA-256 hashes of the sequences.
+        capacity : int
+            Number of sequences the filter is sized for.
+        error_rate : float
+            False positive rate at full capacity.
+
+        Returns
+        -------
+        total : int
+            Number of hashes added to the filter.
+    """
+
+    size, hashes = filter_parameters(capacity, error_rate)
+    bits = bytearray((size + 7) // 8)
+    total = 0
+    for seq_hash in hashes_iter:
+        for p in bit_positions(seq_hash, size, hashes):
+            bits[p >> 3] |= 1 << (p & 7)
+        total += 1
+
+    temp_path = '{0}.tmp'.format(path)
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, size, hashes))
+        outfile.write(bits)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+    return total
+
+
+def add(path, hashes_iter):
+    """ Adds sequence hashes to the filter file. Does nothing if
+        the filter has not been built.
+
+        Parameters
+        ----------
+        path : str
+            Path to the filter file.
+        hashes_iter : iter
+            Iterable with SHA-256 hashes of the sequences.
+
+        Returns
+        -------
+        bool
+            True if the filter was updated, False if there is
+            no filter file.
+    """
+
+    try:
+        outfile = open(path, 'r+b')
+    except FileNotFoundError:
+        return False
+
+    with outfile:
+        with mmap.mmap(outfile.fileno(), 0) as bits:
+            magic, size, hashes = HEADER.unpack_from(bits)
+            for seq_hash in hashes_iter:
+                for p in bit_positions(seq_hash, size, hashes):
+                    i = HEADER.size + (p >> 3)
+                    bits[i] = bits[i] | (1 << (p & 7))
+            bits.flush()
+
+    return True
+
+
+def remove(path):
+    """ Removes the filter file so that it is no longer used. """
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SharedFilter(object):
+    """ Read-only view of a filter file mapped in memory. The
+        file is mapped again when it is replaced.
+
+        Parameters
+        ----------
+        path : str
+            Path to the filter file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.view = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """ Maps the filter file if it was created or replaced.
+
+            Returns
+            -------
+            view : list
+                The memory map, number of bits and number of
+                hash functions of the filter (None if there is
+                no filter file).
+        """
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            self.inode = None
+            self.view = None
+            return None
+
+        if inode != self.inode:
+            with self.lock:
+                with open(self.path, 'rb') as infile:
+                    bits = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, size, hashes = HEADER.unpack_from(bits)
+                if magic != MAGIC:
+                    return None
+                # the previous map is released when it is no longer used
+                self.view = [bits, size, hashes]
+                self.inode = inode
+
+        return self.view
+
+    def might_contain(self, seq_hash):
+        """ Determines if a sequence might be in the Chewie-NS.
+
+            Parameters
+            ----------
+            seq_hash : str
+                SHA-256 hash of the DNA sequence.
+
+            Returns
+            -------
+            bool
+                False if the sequence is not in the Chewie-NS,
+                True if it might be. None if there is no filter.
+        """
+
+        view = self.refresh()
+        if view is None:
+            return None
+
+        bits, size, hashes = view
+        try:
+            positions = bit_positions(seq_hash, size, hashes)
+        except ValueError:
+            # not a SHA-256 hash
+            return None
+
+        for p in positions:
+            if not bits[HEADER.size + (p >> 3)] & (1 << (p & 7)):
+                return False
+
+        return True
+
+
+_filters = {}
+
+
+def get_filter(path):
+    """ Returns the shared filter for a file (one per process). """
+
+    path = os.path.abspath(path)
+    if path not in _filters:
+        _filters[path] = SharedFilter(path)
+
+    return _filters[path]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions used to load large amounts of RDF
+data into Virtuoso without SPARQL INSERT queries. The data is
+written to gzipped N-Triples files that are sent to Virtuoso's
+SPARQL 1.1 Graph Store endpoint (``/sparql-graph-crud-auth``).
+Virtuoso loads the files with its native Turtle loader, which is
+much faster than compiling and executing SPARQL updates.
+
+Adding triples that already exist does not change the graph, so
+data from files that could not be loaded can be inserted again
+with SPARQL queries.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import gzip
+import time
+import logging
+import requests
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+RDF_TYPE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+TYPON = 'http://purl.phyloviz.net/ontology/typon#'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+
+def graph_store_url(local_sparql):
+    """ Gets the URL of the Graph Store endpoint (VIRTUOSO_GRAPH_CRUD
+        or the endpoint in the same server as the SPARQL endpoint).
+    """
+
+    if Config.VIRTUOSO_GRAPH_CRUD:
+        return Config.VIRTUOSO_GRAPH_CRUD
+
+    return '{0}-graph-crud-auth'.format(local_sparql.rstrip('/'))
+
+
+def iri(value):
+
+    return '<{0}>'.format(value)
+
+
+def typon(term):
+
+    return '<{0}{1}>'.format(TYPON, term)
+
+
+def literal(value, datatype):
+    """ Creates a typed literal in N-Triples syntax. """
+
+    value = (str(value).replace('\\', '\\\\').replace('"', '\\"')
+             .replace('\n', '\\n').replace('\r', '\\r'))
+
+    return '"{0}"^^<{1}{2}>'.format(value, XSD, datatype)
+
+
+def allele_triples(seq_uri, sequence, allele_uri, species, user_uri,
+                   locus_uri, insert_date, allele_id):
+    """ Creates the triples inserted by the INSERT_ALLELE_NEW_SEQUENCE
+        query.
+
+        Returns
+        -------
+        str
+            The triples in N-Triples syntax.
+    """
+
+    seq = iri(seq_uri)
+    allele = iri(allele_uri)
+    locus = iri(locus_uri)
+    triples = [(seq, RDF_TYPE, typon('Sequence')),
+               (seq, typon('nucleotideSequence'), literal(sequence, 'string')),
+               (allele, RDF_TYPE, typon('Allele')),
+               (allele, typon('name'), literal(species, 'string')),
+               (allele, typon('sentBy'), iri(user_uri)),
+               (allele, typon('isOfLocus'), locus),
+               (allele, typon('dateEntered'), literal(insert_date, 'dateTime')),
+               (allele, typon('id'), literal(allele_id, 'integer')),
+               (allele, typon('hasSequence'), seq),
+               (locus, typon('hasDefinedAllele'), allele)]
+
+    return ''.join(['{0} {1} {2} .\n'.format(*t) for t in triples])
+
+
+class TriplesWriter(object):
+    """ Writes triples to gzipped N-Triples files. A new file is
+        started when the current one reaches the maximum size, and
+        only between groups, so that each group (e.g.: the alleles
+        of a locus) is loaded from a single file.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory where files are created.
+        max_size : int
+            Maximum size (bytes, uncompressed) of each file.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size or Config.BULK_LOAD_FILE_SIZE
+        self.files = []
+        self.groups = []
+        self.handle = None
+        self.size = 0
+
+    def start_group(self, group):
+        """ Starts a new group of triples. """
+
+        if self.handle is None or self.size >= self.max_size:
+            self.close()
+            path = os.path.join(self.directory,
+                                'bulk_{0}.nt.gz'.format(len(self.files)+1))
+            self.handle = gzip.open(path, 'wt', encoding='utf-8', compresslevel=1)
+            self.files.append(path)
+            self.groups.append([])
+            self.size = 0
+
+        self.groups[-1].append(group)
+
+    def write(self, triples):
+
+        self.handle.write(triples)
+        self.size += len(triples)
+
+    def close(self):
+        """ Closes the current file.
+
+            Returns
+            -------
+            list
+                A list with a tuple per file that was created,
+                with the path to the file and the list of groups
+                in that file.
+        """
+
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+        return list(zip(self.files, self.groups))
+
+
+def load_file(path, graph_store, virtuoso_graph, virtuoso_user, virtuoso_pass):
+    """ Sends a gzipped N-Triples file to Virtuoso's Graph Store
+        endpoint to add its triples to a graph.
+
+        Parameters
+        ----------
+        path : str
+            Path to the gzipped N-Triples file.
+        graph_store : str
+            URL of the Graph Store endpoint.
+        virtuoso_graph : str
+            URI of the graph.
+
+        Returns
+        -------
+        bool
+            True if the triples were loaded, False otherwise.
+    """
+
+    with gzip.open(path, 'rb') as infile:
+        data = infile.read()
+
+    # N-Triples is a subset of Turtle
+    headers = {'content-type': 'text/turtle'}
+    tries = 0
+    max_tries = 5
+    max_wait = 5
+    while tries < max_tries:
+        try:
+            response = requests.post(graph_store, params={'graph-uri': virtuoso_graph},
+                                     data=data, headers=headers,
+                                     auth=requests.auth.HTTPDigestAuth(virtuoso_user, virtuoso_pass))
+            if response.status_code <= 201:
+                return True
+            message = response.text
+        except requests.RequestException as e:
+            message = e
+
+        tries += 1
+        logger.warning('Could not load {0} ({1}/{2}):\n{3}\n'
+                       ''.format(path, tries, max_tries, message))
+        # Virtuoso rejects requests while it performs a checkpoint
+        time.sleep(max_wait)
+        max_wait += max_wait
+
+    return False
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions used to find and serve the
+compressed versions of the schemas in the Chewie-NS.
+
+The compressed versions are ZIP archives named
+``{species_id}_{schema_id}_{last_modified}.zip``. While a schema
+is being compressed, its directory also contains the temporary
+``{species_id}_{schema_id}_temp`` directory and the
+``{species_id}_{schema_id}_{last_modified}`` directory.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import threading
+
+from flask import request, send_file
+
+
+# status of the compressed version of a schema
+READY = 'ready'
+WORKING = 'working'
+MISSING = 'missing'
+
+
+class ArchiveIndex(object):
+    """ Index of the files in the directory with compressed
+        schemas, grouped by species and schema identifiers.
+
+        The directory is only listed again when its modification
+        time changes (files are added, removed or renamed), so
+        each lookup takes constant time.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory with compressed schemas.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.mtime = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """ Lists the directory again if it has been modified. """
+
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self.mtime:
+            return
+
+        with self.lock:
+            # get the modification time before listing so that
+            # changes made during listing trigger a new listing
+            mtime = os.stat(self.directory).st_mtime_ns
+            entries = {}
+            for name in os.listdir(self.directory):
+                parts = name.split('_')
+                if len(parts) < 3:
+                    continue
+                entries.setdefault('{0}_{1}'.format(parts[0], parts[1]), []).append(name)
+
+            self.entries = entries
+            self.mtime = mtime
+
+    def lookup(self, species_id, schema_id):
+        """ Gets the files of a schema.
+
+            Parameters
+            ----------
+            species_id : int
+                Identifier of the species in the Chewie-NS.
+            schema_id : int
+                Identifier of the schema in the Chewie-NS.
+
+            Returns
+            -------
+            list
+                A list with the status of the compressed version
+                (READY, WORKING or MISSING) and the filename of the
+                current ZIP archive (None if there is no archive).
+                A schema can have an outdated archive while a new
+                compressed version is being created.
+        """
+
+        self.refresh()
+        files = self.entries.get('{0}_{1}'.format(species_id, schema_id), [])
+        zips = [f for f in files if f.endswith('.zip')]
+        zip_name = zips[0] if len(zips) == 1 else None
+
+        if len(files) == 0:
+            return [MISSING, None]
+        elif len(files) == 1 and zip_name is not None:
+            return [READY, zip_name]
+        else:
+            return [WORKING, zip_name]
+
+
+_indexes = {}
+
+
+def get_index(directory):
+    """ Returns the index for a directory (one per process). """
+
+    directory = os.path.abspath(directory)
+    if directory not in _indexes:
+        _indexes[directory] = ArchiveIndex(directory)
+
+    return _indexes[directory]
+
+
+def archive_date(zip_name):
+    """ Gets the last modification date of the schema that was
+        used to create a compressed version.
+
+        Parameters
+        ----------
+        zip_name : str
+            Filename of the ZIP archive.
+
+        Returns
+        -------
+        str
+            Schema last modification date, in the format
+            YYYY-MM-DDTHH:MM:SS.f.
+    """
+
+    return zip_name.split('_')[-1][:-len('.zip')]
+
+
+def archive_etag(zip_name):
+    """ Creates a strong entity tag for a compressed version.
+        The tag only changes when a new compressed version is
+        created for a more recent version of the schema.
+    """
+
+    return zip_name[:-len('.zip')]
+
+
+def send_archive(directory, zip_name):
+    """ Sends a compressed schema with support for conditional
+        and byte range requests (Range, If-Range, If-None-Match
+        and If-Modified-Since).
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory with compressed schemas.
+        zip_name : str
+            Filename of the ZIP archive.
+
+        Returns
+        -------
+        response : flask.Response
+            A 200, 206, 304 or 416 response.
+    """
+
+    file_path = os.path.join(directory, zip_name)
+    response = send_file(file_path, mimetype='application/zip',
+                         as_attachment=True, attachment_filename=zip_name,
+                         conditional=False, add_etags=False)
+
+    response.set_etag(archive_etag(zip_name))
+    # advertise support for Range requests in full responses
+    response.headers['Accept-Ranges'] = 'bytes'
+    # evaluates the conditional headers against the strong ETag
+    # and returns only the requested part of the file
+    response = response.make_conditional(request, accept_ranges=True,
+                                         complete_length=os.path.getsize(file_path))
+
+    return response
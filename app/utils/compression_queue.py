@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module keeps track of the schemas that are waiting to be
+compressed or being compressed by the Celery workers that consume
+the compression queue. Only one compression task is queued per
+schema, new requests for a schema that is already queued or being
+compressed are coalesced with the existing task.
+
+Each task that is queued receives a token and only the task that
+holds the token of a schema can change or remove the state of the
+schema. Requests that arrive while a schema is being compressed
+mark the schema so that it is compressed again when the running
+task finishes, because that task may have started from older data.
+
+The state of each schema is stored in Redis with an expiration
+time, so that a worker that dies does not block new requests for
+the schema indefinitely. Running tasks refresh the expiration time
+while the schema is being compressed.
+
+Code documentation
+------------------
+"""
+
+
+import uuid
+
+import redis
+
+from config import Config
+
+
+KEY_PREFIX = 'chewiens_compression_state:'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+
+# the state of a queued schema expires if it is not compressed
+# within this period (seconds)
+QUEUED_TTL = 6 * 3600
+# the state of a schema that is being compressed expires if it is
+# not refreshed within this period (seconds)
+RUNNING_TTL = 600
+# interval (seconds) between refreshes of the state of a schema
+# that is being compressed
+HEARTBEAT = 60
+
+# KEYS[1]: state key, ARGV[1]: new token, ARGV[2]: TTL
+# returns 1 if the caller should queue a task
+REQUEST_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state then
+    redis.call('HMSET', KEYS[1], 'state', 'queued', 'token', ARGV[1], 'dirty', '0')
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if state == 'running' then
+    redis.call('HSET', KEYS[1], 'dirty', '1')
+end
+return 0
+"""
+
+# KEYS[1]: state key, ARGV[1]: token, ARGV[2]: TTL
+# returns 1 if the caller owns the schema and should compress it
+RUNNING_SCRIPT = """
+local token = redis.call('HGET', KEYS[1], 'token')
+if not token then
+    redis.call('HMSET', KEYS[1], 'state', 'running', 'token', ARGV[1], 'dirty', '0')
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if token ~= ARGV[1] then
+    if redis.call('HGET', KEYS[1], 'state') == 'running' then
+        redis.call('HSET', KEYS[1], 'dirty', '1')
+    end
+    return 0
+end
+redis.call('HMSET', KEYS[1], 'state', 'running', 'dirty', '0')
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS[1]: state key, ARGV[1]: token, ARGV[2]: TTL
+REFRESH_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1]: state key, ARGV[1]: token, ARGV[2]: TTL
+# returns 1 if the schema was requested while it was being
+# compressed and the caller should queue the task again
+RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') ~= ARGV[1] then
+    return 0
+end
+if redis.call('HGET', KEYS[1], 'dirty') == '1' then
+    redis.call('HMSET', KEYS[1], 'state', 'queued', 'dirty', '0')
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return 0
+"""
+
+
+def get_client():
+    """ Creates a Redis client for the Celery broker database. """
+
+    return redis.Redis.from_url(Config.CELERY_BROKER_URL)
+
+
+def state_key(species_id, schema_id):
+    """ Creates the Redis key that stores the state of a schema. """
+
+    return '{0}{1}_{2}'.format(KEY_PREFIX, species_id, schema_id)
+
+
+def run_script(script, species_id, schema_id, args, client=None):
+    """ Runs a Lua script that changes the state of a schema. """
+
+    client = client or get_client()
+    result = client.register_script(script)(keys=[state_key(species_id, schema_id)],
+                                            args=args)
+
+    return result == 1
+
+
+def request_compression(species_id, schema_id, client=None):
+    """ Marks a schema as queued for compression if it is not
+        already queued or being compressed.
+
+        Parameters
+        ----------
+        species_id : str
+            Identifier of the species in the Chewie-NS.
+        schema_id : str
+            Identifier of the schema in the Chewie-NS.
+
+        Returns
+        -------
+        token : str
+            Token that the caller passes to the compression
+            task it queues. None if the request was coalesced
+            with an existing task (schemas that are being
+            compressed are compressed again when the running
+            task finishes).
+    """
+
+    token = uuid.uuid4().hex
+    queue = run_script(REQUEST_SCRIPT, species_id, schema_id,
+                       [token, QUEUED_TTL], client)
+
+    return token if queue is True else None
+
+
+def mark_running(species_id, schema_id, token, client=None):
+    """ Marks a schema as being compressed by the task that
+        holds the token.
+
+        Returns
+        -------
+        bool
+            True if the task should compress the schema, False
+            if another task holds the schema (the other task
+            compresses the schema again if it is running).
+    """
+
+    return run_script(RUNNING_SCRIPT, species_id, schema_id,
+                      [token, RUNNING_TTL], client)
+
+
+def refresh(species_id, schema_id, token, client=None):
+    """ Extends the expiration time of the state of a schema
+        that is being compressed by the task that holds the
+        token.
+    """
+
+    return run_script(REFRESH_SCRIPT, species_id, schema_id,
+                      [token, RUNNING_TTL], client)
+
+
+def release(species_id, schema_id, token, client=None):
+    """ Removes the state of a schema after its compression
+        task finishes, so that new requests are queued. The
+        state is only changed if the task holds the token.
+
+        Returns
+        -------
+        bool
+            True if the schema was requested while it was
+            being compressed. The schema stays queued and the
+            caller queues the task again with the same token.
+    """
+
+    return run_script(RELEASE_SCRIPT, species_id, schema_id,
+                      [token, QUEUED_TTL], client)
+
+
+def get_state(species_id, schema_id, client=None):
+    """ Gets the compression state of a schema.
+
+        Returns
+        -------
+        str
+            QUEUED, RUNNING or None if the schema is not
+            queued or being compressed.
+    """
+
+    try:
+        client = client or get_client()
+        state = client.hget(state_key(species_id, schema_id), 'state')
+    except redis.RedisError:
+        # the state is only informative
+        return None
+
+    return state.decode('utf-8') if state is not None else None
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions used to hand over file downloads
+to nginx with the X-Accel-Redirect header. Flask only checks if
+the user can get the file and if the file exists. nginx serves
+the file from an internal location (including Range requests),
+so Flask workers are not kept busy during slow downloads.
+
+nginx does not forward the ETag header of the redirect response.
+It creates the ETag of the file served from the internal location
+and answers the conditional requests (If-None-Match, If-Range and
+If-Modified-Since) itself.
+
+Code documentation
+------------------
+"""
+
+
+from flask import make_response
+
+
+# files whose name is the hash of their content never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def accel_redirect(internal_uri, filename, mimetype,
+                   cache_control='no-cache'):
+    """ Creates a response that tells nginx to serve a file.
+
+        Parameters
+        ----------
+        internal_uri : str
+            URI of the file in the nginx internal location.
+        filename : str
+            Name of the file suggested to the client.
+        mimetype : str
+            Content type of the file.
+        cache_control : str
+            Value of the Cache-Control header.
+
+        Returns
+        -------
+        response : flask.Response
+            Response with an empty body and the headers used
+            by nginx to serve the file.
+    """
+
+    response = make_response('')
+
+    response.headers['Content-Description'] = 'File Transfer'
+    response.headers['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['X-Accel-Redirect'] = internal_uri
+
+    return response
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the function used by the insertion processes
+to create the SPARQL queries that insert alleles into the Chewie-NS.
+Alleles are packed into multi-insert queries by the size of their
+payload, so that each request sent to Virtuoso has a similar size
+regardless of the length of the alleles.
+
+Code documentation
+------------------
+"""
+
+
+import datetime as dt
+
+from config import Config
+from app.utils import sparql_queries as sq
+
+
+def multiple_insert(alleles, hashes, species, locus_uri, user_uri,
+                    start_id, base_url, virtuoso_graph):
+    """ Creates SPARQL queries that insert multiple alleles.
+
+        Alleles are grouped into multi-insert queries that are not
+        larger than the MAX_INSERT_QUERY_SIZE configuration value.
+        Alleles longer than MAX_MULTI_INSERT_LENGTH are inserted
+        with single-insert queries (multi-insert queries that
+        contain alleles with more than ~8000 bps might not be
+        inserted).
+
+        Parameters
+        ----------
+        alleles : list
+            DNA sequences of the alleles.
+        hashes : list
+            SHA-256 hashes of the alleles.
+        species : str
+            Scientific name of the species the alleles
+            were identified in.
+        locus_uri : str
+            URI of the locus in the Chewie-NS.
+        user_uri : str
+            URI of the user that sent the data to the Chewie-NS.
+        start_id : int
+            Identifier of the first allele.
+        base_url : str
+            Base URL of the Chewie-NS.
+        virtuoso_graph : str
+            Name of the graph in Virtuoso.
+
+        Yields
+        ------
+        tup
+            A query to insert alleles and a list with the
+            identifiers of the alleles in the query.
+    """
+
+    allele_id = start_id
+    allele_set = []
+    set_ids = []
+    # size of the query without alleles
+    query_size = len(sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ''))
+    set_size = query_size
+    for sequence, sequence_hash in zip(alleles, hashes):
+        seq_uri = '{0}sequences/{1}'.format(base_url, sequence_hash)
+
+        allele_uri = '{0}/alleles/{1}'.format(locus_uri, allele_id)
+
+        insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
+
+        if len(sequence) >= Config.MAX_MULTI_INSERT_LENGTH:
+            yield (sq.INSERT_ALLELE_NEW_SEQUENCE.format(virtuoso_graph, seq_uri,
+                                                        sequence, allele_uri,
+                                                        species, user_uri,
+                                                        locus_uri, insert_date,
+                                                        allele_id), [allele_id])
+            allele_id += 1
+            continue
+
+        values = ('({0} {1} {2} {3}'
+                  ' {4} {5} {6} {7})'.format('<{0}>'.format(seq_uri),
+                                             '"{0}"^^xsd:string'.format(sequence),
+                                             '<{0}>'.format(allele_uri),
+                                             '"{0}"^^xsd:string'.format(species),
+                                             '<{0}>'.format(user_uri),
+                                             '<{0}>'.format(locus_uri),
+                                             '"{0}"^^xsd:dateTime'.format(insert_date),
+                                             '"{0}"^^xsd:integer'.format(allele_id)))
+
+        values_size = len(values.encode('utf-8')) + 1
+        if len(allele_set) > 0 and set_size + values_size > Config.MAX_INSERT_QUERY_SIZE:
+            yield (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)),
+                   set_ids)
+            allele_set = []
+            set_ids = []
+            set_size = query_size
+
+        allele_set.append(values)
+        set_ids.append(allele_id)
+        set_size += values_size
+
+        allele_id += 1
+
+    if len(allele_set) > 0:
+        yield (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)),
+               set_ids)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the progress journal of the processes that
+insert alleles into the Chewie-NS. The journal is an append-only
+file in the temporary directory of each upload. It records the
+batches of alleles that were committed by Virtuoso, so that a job
+that is run again after a failure skips the batches that were
+already inserted.
+
+Each line has a key and an optional value separated by a tab.
+Lines are flushed to disk before a batch is considered committed.
+A line that was not fully written when a process crashed is
+ignored.
+
+Only one process inserts the data of an upload at a time. The
+processes hold an exclusive lock on a file in the temporary
+directory and a process that cannot get the lock exits with the
+ALREADY_RUNNING status (e.g.: a job delivered again by the broker
+while the first run of the job is still inserting data).
+
+Code documentation
+------------------
+"""
+
+
+import os
+import fcntl
+import threading
+
+
+JOURNAL_FILE = 'insertion_journal'
+LOCK_FILE = '.insertion_lock'
+# marker of directories whose data was queued for insertion
+RUN_FILE = 'insertion_queued'
+
+# exit status of the insertion processes that find another
+# process inserting the data of the same upload
+ALREADY_RUNNING = 75
+
+
+def lock_upload(temp_dir):
+    """ Gets the exclusive lock of the upload in a temporary
+        directory without waiting.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+
+        Returns
+        -------
+        lock_fd : int
+            File descriptor that holds the lock until the
+            process exits. None if another process holds
+            the lock.
+    """
+
+    lock_fd = os.open(os.path.join(temp_dir, LOCK_FILE),
+                      os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        return None
+
+    return lock_fd
+
+
+def mark_run(temp_dir):
+    """ Marks the data in a temporary directory as queued for
+        insertion. Retries of the insertion task keep using the
+        journal, new uploads to the directory remove it (see
+        `clear_run`).
+    """
+
+    with open(os.path.join(temp_dir, RUN_FILE), 'w'):
+        pass
+
+
+def clear_run(temp_dir):
+    """ Removes the data, the journal and the results of a
+        previous insertion from a temporary directory, so that
+        a new upload to the directory does not reuse them.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+
+        Returns
+        -------
+        bool
+            False if the previous insertion is still running,
+            True otherwise.
+    """
+
+    if os.path.isfile(os.path.join(temp_dir, RUN_FILE)) is False:
+        return True
+
+    lock_fd = lock_upload(temp_dir)
+    if lock_fd is None:
+        return False
+
+    try:
+        for file in os.listdir(temp_dir):
+            path = os.path.join(temp_dir, file)
+            if file == LOCK_FILE or os.path.isfile(path) is False:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(lock_fd)
+
+    return True
+
+
+def batch_key(locus, batch):
+    """ Creates the key of a batch of alleles of a locus. """
+
+    return 'batch {0} {1}'.format(locus, batch)
+
+
+def locus_key(locus):
+    """ Creates the key of a locus that was fully inserted. """
+
+    return 'locus {0}'.format(locus)
+
+
+class Journal(object):
+    """ Progress journal of an upload.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+    """
+
+    def __init__(self, temp_dir):
+        self.path = os.path.join(temp_dir, JOURNAL_FILE)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.isfile(self.path) is True:
+            size = 0
+            with open(self.path, 'rb') as infile:
+                for line in infile:
+                    if line.endswith(b'\n') is False:
+                        break
+                    key, value = line.decode('utf-8').rstrip('\n').split('\t', 1)
+                    self.entries[key] = value
+                    size += len(line)
+            # remove the incomplete line
+            os.truncate(self.path, size)
+
+        self.handle = open(self.path, 'a')
+
+    def __contains__(self, key):
+
+        return key in self.entries
+
+    def __len__(self):
+
+        return len(self.entries)
+
+    def get(self, key):
+        """ Gets the value recorded for a key (None if the
+            key was not recorded).
+        """
+
+        return self.entries.get(key)
+
+    def record(self, key, value=''):
+        """ Records a key and waits until it is written to disk.
+
+            Parameters
+            ----------
+            key : str
+                Key of the batch, locus or value to record.
+            value : str
+                Value associated with the key.
+        """
+
+        with self.lock:
+            self.handle.write('{0}\t{1}\n'.format(key, value))
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.entries[key] = str(value)
+
+    def close(self):
+
+        self.handle.close()
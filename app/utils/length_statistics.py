@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the functions used to compute the statistics
+of the alleles lengths of all loci of a schema (number of alleles,
+minimum, maximum, mean, median, mode, quartiles and standard
+deviation). The statistics are computed with NumPy array operations
+over the lengths of all loci, stored contiguously for each locus
+and delimited by offsets (the layout of the columnar lengths files,
+see app/utils/allele_lengths.py), instead of one Python loop per
+locus.
+
+The values are the same as the values computed by the previous
+functions: the mode is the most common length with ties resolved
+by the order of the alleles, the quartiles are the medians of the
+lower and upper halves of the sorted lengths and the standard
+deviation is the sample standard deviation.
+
+Code documentation
+------------------
+"""
+
+
+import numpy as np
+
+
+def from_lists(loci_data):
+    """ Creates the arrays used to compute statistics from lists
+        of lengths.
+
+        Parameters
+        ----------
+        loci_data : dict
+            Loci identifiers as keys and lists with the alleles
+            lengths as values.
+
+        Returns
+        -------
+        loci : list
+            Loci identifiers, in the order of the offsets.
+        offsets : numpy.ndarray
+            Position of the first allele of each locus,
+            followed by the total number of alleles.
+        lengths : numpy.ndarray
+            Lengths of the alleles of all loci.
+    """
+
+    loci = list(loci_data)
+    counts = np.array([len(loci_data[l]) for l in loci], dtype=np.int64)
+    offsets = np.zeros(len(loci)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    lengths = np.fromiter((v for l in loci for v in loci_data[l]),
+                          dtype=np.int64, count=int(offsets[-1]))
+
+    return [loci, offsets, lengths]
+
+
+def segment_median(values, starts, sizes):
+    """ Computes the median of segments of sorted values (0 for
+        empty segments).
+    """
+
+    last = len(values) - 1
+    low = values[np.minimum(starts + np.maximum(sizes - 1, 0) // 2, last)]
+    high = values[np.minimum(starts + sizes // 2, last)]
+
+    return np.where(sizes > 0, (low + high) / 2, 0)
+
+
+def loci_statistics(offsets, lengths):
+    """ Computes the alleles lengths statistics of a set of loci.
+
+        Parameters
+        ----------
+        offsets : numpy.ndarray
+            Position of the first allele of each locus in
+            `lengths`, followed by the total number of alleles.
+        lengths : numpy.ndarray
+            Lengths of the alleles of all loci.
+
+        Returns
+        -------
+        stats : dict
+            Arrays with one value per locus for the keys
+            'count', 'min', 'max', 'mean', 'median', 'mode',
+            'modes' (number of lengths that are modes), 'q1',
+            'q3' and 'sd'. Loci without alleles have 0 values.
+    """
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    nr_loci = len(offsets) - 1
+    starts = offsets[:-1]
+    counts = np.diff(offsets)
+    if len(lengths) == 0:
+        zeros = np.zeros(nr_loci, dtype=np.int64)
+        return {k: zeros for k in ['count', 'min', 'max', 'mean', 'median',
+                                   'mode', 'modes', 'q1', 'q3', 'sd']}
+
+    nonempty = counts > 0
+    locus_ids = np.repeat(np.arange(nr_loci), counts)
+
+    # sort the lengths of each locus, keeping the order of equal
+    # lengths (the first allele of a group has the lowest position)
+    order = np.lexsort((lengths, locus_ids))
+    sorted_lengths = lengths[order]
+
+    minimum = np.where(nonempty, sorted_lengths[np.minimum(starts, len(lengths) - 1)], 0)
+    maximum = np.where(nonempty, sorted_lengths[np.maximum(offsets[1:] - 1, 0)], 0)
+
+    sums = np.bincount(locus_ids, weights=lengths, minlength=nr_loci)
+    mean = np.divide(sums, counts, out=np.zeros(nr_loci), where=nonempty)
+
+    # sample standard deviation, from the deviations to the mean
+    deviations = lengths - mean[locus_ids]
+    squares = np.bincount(locus_ids, weights=deviations * deviations, minlength=nr_loci)
+    sd = np.sqrt(np.divide(squares, counts - 1, out=np.zeros(nr_loci), where=counts > 1))
+
+    median = segment_median(sorted_lengths, starts, counts)
+    half = counts // 2
+    q1 = np.where(counts > 1, segment_median(sorted_lengths, starts, half), minimum)
+    q3 = np.where(counts > 1, segment_median(sorted_lengths, offsets[1:] - half, half), minimum)
+
+    # groups of equal lengths of each locus
+    group_starts = np.flatnonzero(np.r_[True, (np.diff(sorted_lengths) != 0)
+                                        | (np.diff(locus_ids) != 0)])
+    group_sizes = np.diff(np.r_[group_starts, len(lengths)])
+    group_loci = locus_ids[group_starts]
+    group_first = order[group_starts]
+
+    # the mode is the largest group, ties are resolved by the
+    # position of the first allele of each group
+    best = np.lexsort((group_first, -group_sizes, group_loci))
+    first_groups = best[np.r_[True, np.diff(group_loci[best]) != 0]]
+    mode = np.zeros(nr_loci, dtype=np.int64)
+    mode[group_loci[first_groups]] = sorted_lengths[group_starts[first_groups]]
+
+    largest = np.zeros(nr_loci, dtype=np.int64)
+    np.maximum.at(largest, group_loci, group_sizes)
+    modes = np.bincount(group_loci[group_sizes == largest[group_loci]], minlength=nr_loci)
+
+    return {'count': counts,
+            'min': minimum,
+            'max': maximum,
+            'mean': mean,
+            'median': median,
+            'mode': mode,
+            'modes': modes,
+            'q1': q1,
+            'q3': q3,
+            'sd': sd}
+
+
+def quartile_value(value, size):
+    """ Converts a quartile to the type returned by
+        `statistics.median` (int for an odd number of values).
+    """
+
+    return int(value) if size % 2 == 1 else float(value)
+
+
+def loci_summaries(offsets, lengths):
+    """ Computes the alleles lengths statistics of a set of loci
+        with the values used in the pre-computed files.
+
+        Returns
+        -------
+        summaries : list
+            A dictionary per locus with the 'nr_alleles',
+            'mode', 'mean' and 'median' (rounded), 'min',
+            'max', 'q1', 'q3' and 'sd' (Python types). None
+            for loci without alleles.
+    """
+
+    stats = loci_statistics(offsets, lengths)
+    columns = {k: v.tolist() for k, v in stats.items()}
+
+    summaries = []
+    for i, count in enumerate(columns['count']):
+        if count == 0:
+            summaries.append(None)
+            continue
+
+        half = count // 2
+        summaries.append({'nr_alleles': count,
+                          'mode': columns['mode'][i],
+                          'mean': round(columns['mean'][i]),
+                          'median': round(columns['median'][i]),
+                          'min': columns['min'][i],
+                          'max': columns['max'][i],
+                          'q1': quartile_value(columns['q1'][i], half) if count > 1 else columns['min'][i],
+                          'q3': quartile_value(columns['q3'][i], half) if count > 1 else columns['min'][i],
+                          'sd': columns['sd'][i]})
+
+    return summaries
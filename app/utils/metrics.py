@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module collects service metrics and exports them in the
+Prometheus text exposition format.
+
+Metric values are stored in Redis so that the values recorded by
+all Gunicorn workers, Celery workers and the scripts that are
+executed as subprocesses (schema compression and pre-computation
+of Frontend statistics) are aggregated in a single place. Celery
+queue lengths are read from the broker when metrics are exported.
+
+Each process aggregates the values it records in memory and writes
+them to Redis in a single round trip when the flush interval has
+passed (``METRICS_FLUSH_INTERVAL``), when metrics are exported and
+when the process exits, so that requests and SPARQL queries do not
+wait for Redis.
+
+Recording metrics never interrupts the caller. If Redis cannot be
+reached, recording is suspended for a short period of time and
+the values are discarded.
+
+The number of requests in flight is kept by each process and stored
+in a key per process that expires if the process stops updating it,
+so that requests interrupted by a worker that dies are not counted
+indefinitely.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import time
+import atexit
+import socket
+import logging
+import threading
+import contextlib
+from functools import wraps
+
+import redis
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+# prefix for the Redis keys that store metric values
+KEY_PREFIX = 'chewiens_metrics:'
+
+# seconds during which recording is suspended after a Redis error
+RETRY_INTERVAL = 30
+
+# key with the number of requests in flight of a process and
+# seconds after which the key expires if it is not updated
+IN_FLIGHT_KEY = KEY_PREFIX + 'in_flight:{0}:{1}'
+IN_FLIGHT_TTL = 300
+
+# values are written before the interval passes if
+# this number of time series have pending values
+MAX_PENDING = 1000
+
+# upper bounds of histogram buckets, in seconds
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 21600)
+
+# Celery queues used by the API, workers and periodic jobs
+CELERY_QUEUES = ('loci_queue', 'alleles_queue', 'sync_queue',
+                 'compress_queue', 'precompute_queue', 'periodic_queue')
+
+# name: (type, help, buckets)
+METRICS = {
+    'chewiens_http_requests_total': ('counter',
+                                     'Number of API requests per resource, method and status code.',
+                                     None),
+    'chewiens_http_request_duration_seconds': ('histogram',
+                                               'Duration of API requests per resource and method.',
+                                               REQUEST_BUCKETS),
+    'chewiens_http_requests_in_flight': ('gauge',
+                                         'Number of API requests being processed.',
+                                         None),
+    'chewiens_sparql_requests_total': ('counter',
+                                       'Number of requests to the SPARQL endpoint per operation and outcome.',
+                                       None),
+    'chewiens_sparql_request_duration_seconds': ('histogram',
+                                                 'Duration of requests to the SPARQL endpoint, including retries.',
+                                                 REQUEST_BUCKETS),
+    'chewiens_cache_requests_total': ('counter',
+                                      'Number of cache lookups per cache and result (hit or miss).',
+                                      None),
+    'chewiens_job_runs_total': ('counter',
+                                'Number of compression and pre-computation jobs per job and outcome.',
+                                None),
+    'chewiens_job_duration_seconds': ('histogram',
+                                      'Duration of compression and pre-computation jobs.',
+                                      JOB_BUCKETS),
+}
+
+_state = {'client': None, 'suspended_until': 0, 'in_flight': 0,
+          'in_flight_changed': False, 'last_flush': time.time()}
+# (metric name, field) as keys and increments as values
+_pending = {}
+_lock = threading.Lock()
+
+
+def get_client():
+    """ Returns the Redis client used to store metrics or
+        None if recording is suspended.
+    """
+
+    if time.time() < _state['suspended_until']:
+        return None
+
+    if _state['client'] is None:
+        with _lock:
+            if _state['client'] is None:
+                _state['client'] = redis.Redis.from_url(Config.METRICS_REDIS_URL,
+                                                        socket_timeout=0.5,
+                                                        socket_connect_timeout=0.5)
+
+    return _state['client']
+
+
+def suspend(error):
+    """ Suspends recording after a Redis error. """
+
+    _state['suspended_until'] = time.time() + RETRY_INTERVAL
+    logger.warning('Could not record metrics, suspending for '
+                   '{0}s. Error: {1}'.format(RETRY_INTERVAL, error))
+
+
+def label_str(labels):
+    """ Creates the Prometheus representation of a set of labels.
+
+        Parameters
+        ----------
+        labels : dict
+            Label names as keys and label values as values.
+
+        Returns
+        -------
+        str
+            Labels in the format 'name="value",...'.
+    """
+
+    values = []
+    for k in sorted(labels):
+        v = str(labels[k]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        values.append('{0}="{1}"'.format(k, v))
+
+    return ','.join(values)
+
+
+def flush():
+    """ Writes the values recorded by the current process to
+        Redis in a single round trip.
+    """
+
+    with _lock:
+        commands = list(_pending.items())
+        _pending.clear()
+        in_flight = _state['in_flight'] if _state['in_flight_changed'] else None
+        _state['in_flight_changed'] = False
+        _state['last_flush'] = time.time()
+
+    if len(commands) == 0 and in_flight is None:
+        return
+
+    client = get_client()
+    if client is None:
+        return
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        for (name, field), amount in commands:
+            pipe.hincrbyfloat(KEY_PREFIX + name, field, amount)
+        if in_flight is not None:
+            pipe.set(IN_FLIGHT_KEY.format(socket.gethostname(), os.getpid()),
+                     in_flight, ex=IN_FLIGHT_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        suspend(e)
+
+
+def _write(commands, in_flight=None):
+    """ Adds a set of increments to the values that the current
+        process writes to Redis and writes them if the flush
+        interval has passed.
+
+        Parameters
+        ----------
+        commands : list of tup
+            Tuples with the metric name, the field and the
+            increment.
+        in_flight : int
+            Number of requests in flight of the current
+            process (None to not update it).
+    """
+
+    with _lock:
+        for name, field, amount in commands:
+            key = (name, field)
+            _pending[key] = _pending.get(key, 0) + amount
+        if in_flight is not None:
+            _state['in_flight_changed'] = True
+        due = (time.time() - _state['last_flush'] >= Config.METRICS_FLUSH_INTERVAL
+               or len(_pending) >= MAX_PENDING)
+
+    if due is True:
+        flush()
+
+
+def _reset_after_fork():
+    """ Discards the values and the client inherited by a child
+        process (the parent writes its own values).
+    """
+
+    _pending.clear()
+    _state.update({'client': None, 'in_flight': 0, 'in_flight_changed': False,
+                   'last_flush': time.time()})
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
+
+def _histogram_commands(name, labels, value):
+    """ Creates the commands to add an observation to a histogram.
+        Buckets are stored without accumulation and accumulated
+        when metrics are exported.
+    """
+
+    buckets = METRICS[name][2]
+    labels_text = label_str(labels)
+    bucket = next((str(b) for b in buckets if value <= b), '+Inf')
+
+    return [(name, '{0}\tbucket\t{1}'.format(labels_text, bucket), 1),
+            (name, '{0}\tsum'.format(labels_text), value),
+            (name, '{0}\tcount'.format(labels_text), 1)]
+
+
+def inc(name, labels, amount=1):
+    """ Increments a counter or gauge.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric.
+        labels : dict
+            Labels of the time series.
+        amount : float
+            Increment (negative values decrement gauges).
+    """
+
+    _write([(name, label_str(labels), amount)])
+
+
+def observe(name, labels, value):
+    """ Adds an observation to a histogram.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric.
+        labels : dict
+            Labels of the time series.
+        value : float
+            Observed value.
+    """
+
+    _write(_histogram_commands(name, labels, value))
+
+
+def change_in_flight(amount):
+    """ Changes the number of requests in flight of the
+        current process and returns the new value.
+    """
+
+    with _lock:
+        _state['in_flight'] += amount
+        _state['in_flight_changed'] = True
+        return _state['in_flight']
+
+
+def request_started():
+    """ Records a request that started. """
+
+    _write([], in_flight=change_in_flight(1))
+
+
+def request_finished(endpoint, method, status, elapsed):
+    """ Records a finished API request and decrements the
+        number of requests in flight in a single round trip.
+    """
+
+    commands = [('chewiens_http_requests_total',
+                 label_str({'endpoint': endpoint, 'method': method, 'status': status}), 1)]
+    commands.extend(_histogram_commands('chewiens_http_request_duration_seconds',
+                                        {'endpoint': endpoint, 'method': method},
+                                        elapsed))
+    _write(commands, in_flight=change_in_flight(-1))
+
+
+def init_app(app):
+    """ Registers request hooks that record the number, duration
+        and status of requests to each API resource.
+
+        Parameters
+        ----------
+        app : flask.Flask
+            The Flask application.
+    """
+
+    from flask import g, request
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.time()
+        request_started()
+
+    @app.after_request
+    def status_request_metrics(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        start = g.get('metrics_start')
+        if start is None:
+            return
+
+        request_finished(request.endpoint or 'not_found',
+                         request.method,
+                         g.get('metrics_status', 500),
+                         time.time() - start)
+
+
+def cache_lookup(cache, hit):
+    """ Records a cache lookup.
+
+        Parameters
+        ----------
+        cache : str
+            Name of the cache.
+        hit : bool
+            True if the cache answered the lookup (the
+            value did not have to be computed or queried).
+    """
+
+    inc('chewiens_cache_requests_total',
+        {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def sparql_timed(operation):
+    """ Decorator that records the number of requests, errors
+        and duration of the functions that send requests to
+        the SPARQL endpoint.
+
+        Parameters
+        ----------
+        operation : str
+            'get' for queries or 'send' for updates.
+    """
+
+    def decorated(fn):
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = fn(*args, **kwargs)
+            elapsed = time.time() - start
+
+            # get_data returns the exception if all tries fail
+            # send_data returns the last response
+            if isinstance(result, Exception) or getattr(result, 'status_code', 200) > 201:
+                outcome = 'error'
+            else:
+                outcome = 'success'
+
+            commands = [('chewiens_sparql_requests_total',
+                         label_str({'operation': operation, 'outcome': outcome}), 1)]
+            commands.extend(_histogram_commands('chewiens_sparql_request_duration_seconds',
+                                                {'operation': operation},
+                                                elapsed))
+            _write(commands)
+
+            return result
+
+        return wrapper
+
+    return decorated
+
+
+@contextlib.contextmanager
+def job_timer(job):
+    """ Context manager that records the duration and outcome
+        of a compression or pre-computation job.
+
+        Jobs that report errors through return values instead
+        of exceptions set the 'outcome' key of the yielded
+        dictionary to 'error'.
+
+        Parameters
+        ----------
+        job : str
+            Name of the job.
+    """
+
+    start = time.time()
+    outcome = 'error'
+    status = {'outcome': 'success'}
+    try:
+        yield status
+        outcome = status['outcome']
+    except SystemExit as e:
+        outcome = 'success' if e.code in [0, None] else 'error'
+        raise
+    finally:
+        commands = [('chewiens_job_runs_total',
+                     label_str({'job': job, 'outcome': outcome}), 1)]
+        commands.extend(_histogram_commands('chewiens_job_duration_seconds',
+                                            {'job': job},
+                                            time.time() - start))
+        _write(commands)
+        # jobs are rare and might run in processes that are killed
+        flush()
+
+
+def queue_lengths():
+    """ Gets the number of tasks waiting in each Celery queue.
+
+        Returns
+        -------
+        lengths : dict
+            Queue names as keys and number of tasks as values.
+            Empty if the broker cannot be reached.
+    """
+
+    lengths = {}
+    try:
+        broker = redis.Redis.from_url(Config.CELERY_BROKER_URL,
+                                      socket_timeout=0.5,
+                                      socket_connect_timeout=0.5)
+        pipe = broker.pipeline(transaction=False)
+        for queue in CELERY_QUEUES:
+            pipe.llen(queue)
+        lengths = dict(zip(CELERY_QUEUES, pipe.execute()))
+    except redis.RedisError as e:
+        logger.warning('Could not get Celery queue lengths: {0}'.format(e))
+
+    return lengths
+
+
+def _format_value(value):
+    """ Formats a sample value, integers without decimal part. """
+
+    value = float(value)
+
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _sample(name, labels_text, value):
+    """ Creates the line of a sample. """
+
+    if labels_text == '':
+        return '{0} {1}'.format(name, _format_value(value))
+
+    return '{0}{{{1}}} {2}'.format(name, labels_text, _format_value(value))
+
+
+def render():
+    """ Exports all metrics in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Metrics in the Prometheus text exposition format.
+    """
+
+    # include the values recorded by this process
+    flush()
+
+    client = get_client()
+    values = {}
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for name in METRICS:
+                pipe.hgetall(KEY_PREFIX + name)
+            for name, data in zip(METRICS, pipe.execute()):
+                values[name] = {k.decode('utf-8'): float(v) for k, v in data.items()}
+
+            # sum the requests in flight of the processes that are running
+            keys = list(client.scan_iter(match=IN_FLIGHT_KEY.format('*', '*')))
+            in_flight = client.mget(keys) if len(keys) > 0 else []
+            values['chewiens_http_requests_in_flight'] = {'': sum([float(v) for v in in_flight
+                                                                   if v is not None])}
+        except redis.RedisError as e:
+            suspend(e)
+
+    lines = []
+    for name, (metric_type, description, buckets) in METRICS.items():
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+        data = values.get(name, {})
+        if metric_type != 'histogram':
+            for labels_text in sorted(data):
+                lines.append(_sample(name, labels_text, data[labels_text]))
+            continue
+
+        series = sorted(set(k.split('\t')[0] for k in data))
+        for labels_text in series:
+            cumulative = 0
+            for bound in [str(b) for b in buckets] + ['+Inf']:
+                cumulative += data.get('{0}\tbucket\t{1}'.format(labels_text, bound), 0)
+                bucket_labels = ','.join([l for l in (labels_text, 'le="{0}"'.format(bound)) if l != ''])
+                lines.append(_sample(name + '_bucket', bucket_labels, cumulative))
+            lines.append(_sample(name + '_sum', labels_text,
+                                 data.get('{0}\tsum'.format(labels_text), 0)))
+            lines.append(_sample(name + '_count', labels_text,
+                                 data.get('{0}\tcount'.format(labels_text), 0)))
+
+    lines.append('# HELP chewiens_celery_queue_length Number of tasks waiting in each Celery queue.')
+    lines.append('# TYPE chewiens_celery_queue_length gauge')
+    for queue, length in sorted(queue_lengths().items()):
+        lines.append(_sample('chewiens_celery_queue_length', label_str({'queue': queue}), length))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions used to maintain materialized
+counts of the data in the Chewie-NS (species, schemas, loci,
+alleles, sequences, users and isolates). The counts are stored in
+a Redis hash shared by the Flask workers and the processes that
+insert and delete data, so that the statistics routes do not need
+to count all items in the Virtuoso graph.
+
+The processes that change the data increment or decrement the
+counts. The counts are periodically replaced with the values
+counted by Virtuoso (reconciliation) to correct any drift. Counts
+are only served after the first reconciliation.
+
+Code documentation
+------------------
+"""
+
+
+import time
+import logging
+
+import redis
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+KEY = 'chewiens_counters'
+# field with the time of the last reconciliation
+RECONCILED = 'reconciled'
+
+# same names as the variables in the NS_STATS query
+COUNTERS = ('sequences', 'species', 'loci', 'users',
+            'schemas', 'isolates', 'alleles')
+
+XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
+
+
+def get_client():
+    """ Creates a Redis client for the Celery broker database. """
+
+    return redis.Redis.from_url(Config.CELERY_BROKER_URL)
+
+
+def get_counts(client=None):
+    """ Gets the materialized counts.
+
+        Returns
+        -------
+        counts : dict
+            Counter names as keys and counts as values. None
+            if the counts have not been reconciled or cannot
+            be read.
+    """
+
+    try:
+        client = client or get_client()
+        values = client.hgetall(KEY)
+    except redis.RedisError as e:
+        logger.warning('Could not read NS counters: {0}'.format(e))
+        return None
+
+    values = {k.decode('utf-8'): v.decode('utf-8') for k, v in values.items()}
+    if RECONCILED not in values:
+        return None
+
+    counts = {c: max(0, int(values.get(c, 0))) for c in COUNTERS}
+
+    return counts
+
+
+def increment(changes, client=None):
+    """ Changes the counts after data is inserted or deleted.
+        Does nothing if the counts have not been reconciled.
+
+        Parameters
+        ----------
+        changes : dict
+            Counter names as keys and the number of items that
+            were added (positive) or removed (negative) as values.
+    """
+
+    changes = {k: int(v) for k, v in changes.items() if k in COUNTERS and int(v) != 0}
+    if len(changes) == 0:
+        return
+
+    try:
+        client = client or get_client()
+        if client.hexists(KEY, RECONCILED) is False:
+            return
+        pipe = client.pipeline(transaction=True)
+        for k, v in changes.items():
+            pipe.hincrby(KEY, k, v)
+        pipe.execute()
+    except redis.RedisError as e:
+        # the next reconciliation corrects the counts
+        logger.warning('Could not update NS counters: {0}'.format(e))
+
+
+def alleles_added(records, new_sequences):
+    """ Changes the counts after alleles are inserted.
+
+        Parameters
+        ----------
+        records : list
+            Sequence index records of the alleles that were
+            inserted (the first element is the sequence hash).
+        new_sequences : int
+            Number of sequences that were not in the sequence
+            index (None to count each distinct sequence as new).
+    """
+
+    if new_sequences is None:
+        new_sequences = len(set([r[0] for r in records]))
+
+    increment({'alleles': len(records), 'sequences': new_sequences})
+
+
+def reconcile(counts, client=None):
+    """ Replaces the counts with the values counted by Virtuoso.
+
+        Parameters
+        ----------
+        counts : dict
+            Counter names as keys and counts as values.
+    """
+
+    values = {c: int(counts[c]) for c in COUNTERS if c in counts}
+    values[RECONCILED] = int(time.time())
+
+    try:
+        client = client or get_client()
+        client.hmset(KEY, values)
+    except redis.RedisError as e:
+        logger.warning('Could not reconcile NS counters: {0}'.format(e))
+
+
+def from_bindings(bindings):
+    """ Gets the counts from the result of the NS_STATS query. """
+
+    return {c: int(bindings[0][c]['value']) for c in COUNTERS if c in bindings[0]}
+
+
+def to_bindings(counts):
+    """ Formats the counts like the result of the NS_STATS query. """
+
+    return [{c: {'type': 'typed-literal',
+                 'datatype': XSD_INTEGER,
+                 'value': str(counts[c])}
+             for c in COUNTERS}]
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the engine that creates the pre-computed files
+used by the frontend to display schema statistics. The data of a
+schema (alleles lengths and loci annotations) is loaded once and the
+statistics of all loci are computed with array operations (see
+app/utils/length_statistics.py) to create the five files that were
+created by separate scripts:
+
+- ``totals_<species>.json``: number of loci and alleles per schema
+  (schema_totals.py);
+- ``loci_<species>.json``: number of alleles per locus (loci_totals.py);
+- ``mode_<species>_<schema>.json``: length modes and scatter plot data
+  (loci_mode.py);
+- ``annotations_<species>_<schema>.json``: loci annotations and length
+  statistics (annotations.py);
+- ``boxplot_<species>_<schema>.json``: boxplot data (loci_boxplot.py).
+
+The alleles lengths are read from the columnar file in the schema's
+lengths directory or, if the directory does not exist, queried from
+Virtuoso.
+Files that already have the last modification date of the schema
+are not changed.
+
+The engine can be called in-process or by a daemon that processes
+the schemas added to a Redis queue (precompute_engine.py). Requests
+for a schema that is already in the queue are coalesced.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import json
+import logging
+
+import redis
+from SPARQLWrapper import SPARQLWrapper
+
+from config import Config
+from app.utils import metrics
+from app.utils import allele_lengths as al
+from app.utils import length_statistics as ls
+from app.utils import sparql_queries as sq
+from app.utils import auxiliary_functions as aux
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'chewiens_precompute:queue'
+PENDING_KEY = 'chewiens_precompute:pending'
+
+# number of alleles lengths per query when there are no lengths files
+LENGTHS_LIMIT = 10000
+
+
+def precomputed_files(species_id, schema_id):
+    """ Gets the paths to the pre-computed files of a schema.
+
+        Returns
+        -------
+        dict
+            Artifact names as keys and paths as values.
+    """
+
+    computed_dir = Config.PRE_COMPUTE
+    files = {'totals': 'totals_{0}.json'.format(species_id),
+             'loci': 'loci_{0}.json'.format(species_id),
+             'mode': 'mode_{0}_{1}.json'.format(species_id, schema_id),
+             'annotations': 'annotations_{0}_{1}.json'.format(species_id, schema_id),
+             'boxplot': 'boxplot_{0}_{1}.json'.format(species_id, schema_id)}
+
+    return {k: os.path.join(computed_dir, v) for k, v in files.items()}
+
+
+def read_json(filename, default):
+    """ Reads a JSON file (returns `default` if the file does not exist). """
+
+    if os.path.isfile(filename) is False:
+        return default
+
+    with open(filename, 'r') as json_file:
+        return json.load(json_file)
+
+
+def write_json(filename, data):
+    """ Writes a JSON file. The data is written to a temporary file
+        that replaces the previous file, so that the API never reads
+        a partially written file.
+    """
+
+    temp_file = '{0}.tmp'.format(filename)
+    with open(temp_file, 'w') as json_outfile:
+        json.dump(data, json_outfile)
+    os.replace(temp_file, filename)
+
+
+def schema_index(entries, schema_uri, key):
+    """ Gets the index of the entry of a schema in a species file. """
+
+    schema_id = int(schema_uri.split('/')[-1])
+    for i, entry in enumerate(entries):
+        if int(entry[key].split('/')[-1]) == schema_id:
+            return i
+
+    return None
+
+
+def outdated_files(files, schema_uri, last_modified):
+    """ Determines the pre-computed files that do not have the
+        last modification date of a schema.
+
+        Returns
+        -------
+        list
+            Names of the artifacts that must be created.
+    """
+
+    outdated = []
+    for name, key in [('totals', 'uri'), ('loci', 'schema')]:
+        entries = read_json(files[name], {'message': []})['message']
+        index = schema_index(entries, schema_uri, key)
+        if index is None or entries[index]['last_modified'] != last_modified:
+            outdated.append(name)
+
+    for name in ['mode', 'annotations', 'boxplot']:
+        data = read_json(files[name], {})
+        if data.get('last_modified') != last_modified:
+            outdated.append(name)
+
+    return outdated
+
+
+def schema_properties(species_id, schema_id, virtuoso_graph, local_sparql, base_url):
+    """ Gets the URI and properties of a schema.
+
+        Returns
+        -------
+        list
+            The schema URI and a dictionary with the schema
+            properties (None if the species or schema do not
+            exist).
+    """
+
+    species_uri = '{0}species/{1}'.format(base_url, species_id)
+    species_result = aux.get_data(SPARQLWrapper(local_sparql),
+                                  sq.SELECT_SINGLE_SPECIES.format(virtuoso_graph, species_uri))
+    if len(species_result['results']['bindings']) == 0:
+        logger.warning('Could not find species with identifier {0}.'.format(species_id))
+        return [None, None]
+
+    schema_uri = '{0}/schemas/{1}'.format(species_uri, schema_id)
+    schema_info = aux.get_data(SPARQLWrapper(local_sparql),
+                               sq.SELECT_SPECIES_SCHEMA.format(virtuoso_graph, schema_uri))
+    properties = schema_info['results']['bindings']
+    if len(properties) == 0:
+        logger.warning('Could not find properties values for schema with '
+                       'identifier {0}.'.format(schema_id))
+        return [schema_uri, None]
+
+    properties = {k: v['value'] for k, v in properties[0].items()}
+
+    return [schema_uri, properties]
+
+
+def read_lengths(lengths_dir):
+    """ Reads the alleles lengths in the columnar file of a
+        schema's lengths directory.
+
+        Returns
+        -------
+        list
+            Loci URIs, offsets of the alleles of each locus
+            and the alleles lengths of all loci.
+    """
+
+    schema_lengths = al.load(lengths_dir)
+
+    return [schema_lengths.loci, schema_lengths.offsets, schema_lengths.lengths]
+
+
+def query_lengths(schema_uri, virtuoso_graph, local_sparql):
+    """ Gets the alleles lengths of a schema from Virtuoso.
+
+        Returns
+        -------
+        loci_lengths : dict
+            Loci URIs as keys and lists with the alleles
+            lengths as values.
+    """
+
+    loci_lengths = {}
+    offset = 0
+    while True:
+        result = aux.get_data(SPARQLWrapper(local_sparql),
+                              sq.SELECT_ALLELES_LENGTH.format(virtuoso_graph, schema_uri,
+                                                              offset, LENGTHS_LIMIT))
+        alleles = result['results']['bindings']
+        for a in alleles:
+            loci_lengths.setdefault(a['locus']['value'], []).append(int(a['nucSeqLen']['value']))
+
+        if len(alleles) < LENGTHS_LIMIT:
+            break
+        offset += LENGTHS_LIMIT
+
+    return loci_lengths
+
+
+def loci_annotations(schema_uri, virtuoso_graph, local_sparql, max_tries=5):
+    """ Gets the annotations of the loci of a schema.
+
+        Returns
+        -------
+        list
+            A dictionary per locus with the locus URI, name and
+            annotations.
+    """
+
+    tries = 0
+    while True:
+        result = aux.get_data(SPARQLWrapper(local_sparql),
+                              sq.SELECT_SCHEMA_LOCI_ANNOTATIONS.format(virtuoso_graph, schema_uri))
+        try:
+            annotations = result['results']['bindings']
+            break
+        except (TypeError, KeyError):
+            tries += 1
+            logger.warning('Could not get annotations for schema {0} ({1}/{2}):'
+                           '\n{3}'.format(schema_uri, tries, max_tries, result))
+            if tries == max_tries:
+                raise Exception('Could not get annotations for schema {0}.'.format(schema_uri))
+
+    return [{'locus': l['locus']['value'],
+             'name': l['name']['value'],
+             'UniprotName': l['UniprotName']['value'],
+             'UniprotURI': l['UniprotURI']['value'],
+             'UserAnnotation': l['UserAnnotation']['value'],
+             'CustomAnnotation': l['CustomAnnotation']['value']} for l in annotations]
+
+
+def loci_stats(loci_uris, offsets, lengths, loci_names):
+    """ Computes the length statistics of the loci of a schema.
+
+        Returns
+        -------
+        loci : list
+            Statistics used by the pre-computed files for
+            each locus of the schema with alleles.
+    """
+
+    loci = []
+    for uri, stats in zip(loci_uris, ls.loci_summaries(offsets, lengths)):
+        if uri not in loci_names or stats is None:
+            continue
+        stats['uri'] = uri
+        stats['name'] = loci_names[uri]
+        stats['id'] = loci_names[uri].split('-')[-1]
+        loci.append(stats)
+
+    return loci
+
+
+def update_totals(filename, schema_uri, properties, loci,
+                  virtuoso_graph, local_sparql):
+    """ Updates the number of loci and alleles of a schema in the
+        species totals file.
+    """
+
+    json_data = read_json(filename, {'message': []})
+    entries = json_data['message']
+    index = schema_index(entries, schema_uri, 'uri')
+
+    nr_alleles = sum([l['nr_alleles'] for l in loci])
+    if index is not None:
+        current_schema = entries[index]
+        current_schema['last_modified'] = properties['last_modified']
+    else:
+        # determine user that uploaded the schema
+        admin = aux.get_data(SPARQLWrapper(local_sparql),
+                             sq.SELECT_SCHEMA_ADMIN.format(virtuoso_graph, schema_uri))
+        current_schema = {k: v for k, v in properties.items() if k != 'Schema_lock'}
+        current_schema['user'] = admin['results']['bindings'][0]['admin']['value']
+        current_schema['uri'] = schema_uri
+        entries.append(current_schema)
+
+    current_schema['nr_loci'] = str(len(loci))
+    current_schema['nr_alleles'] = str(nr_alleles)
+
+    write_json(filename, json_data)
+
+
+def update_loci_totals(filename, schema_uri, last_modified, loci):
+    """ Updates the number of alleles per locus of a schema in
+        the species loci file.
+    """
+
+    json_data = read_json(filename, {'message': []})
+    entries = json_data['message']
+    index = schema_index(entries, schema_uri, 'schema')
+
+    proc_data = {'schema': schema_uri,
+                 'last_modified': last_modified,
+                 'loci': [{'locus': l['uri'], 'nr_alleles': l['nr_alleles']}
+                          for l in loci]}
+    if index is not None:
+        entries[index] = proc_data
+    else:
+        entries.append(proc_data)
+
+    write_json(filename, json_data)
+
+
+def mode_data(schema_uri, last_modified, loci):
+    """ Creates the data of the loci modes file. """
+
+    return {'schema': schema_uri,
+            'last_modified': last_modified,
+            'mode': [{'locus_name': l['name'],
+                      'alleles_mode': l['mode']} for l in loci],
+            'total_alleles': [{'locus_name': l['name'],
+                               'nr_alleles': l['nr_alleles']} for l in loci],
+            'scatter_data': [{'locus_name': l['name'],
+                              'locus_id': l['id'],
+                              'nr_alleles': l['nr_alleles'],
+                              'alleles_mean': l['mean'],
+                              'alleles_median': l['median'],
+                              'alleles_min': l['min'],
+                              'alleles_max': l['max'],
+                              'alleles_mode': l['mode']} for l in loci]}
+
+
+def annotations_data(schema_uri, last_modified, loci, annotations):
+    """ Creates the data of the loci annotations file. """
+
+    stats = {l['name']: l for l in loci}
+    message = []
+    for a in annotations:
+        locus = stats.get(a['name'])
+        # loci without alleles have no length statistics
+        if locus is None:
+            continue
+        a['mode'] = locus['mode']
+        a['nr_alleles'] = locus['nr_alleles']
+        a['min'] = locus['min']
+        a['max'] = locus['max']
+        message.append(a)
+
+    return {'schema': schema_uri,
+            'last_modified': last_modified,
+            'message': message}
+
+
+def boxplot_data(schema_uri, last_modified, loci):
+    """ Creates the data of the boxplot file. """
+
+    data = {'schema': schema_uri,
+            'last_modified': last_modified,
+            'loci': [l['name'] for l in loci]}
+    for k in ['min', 'q1', 'median', 'q3', 'max', 'mean', 'sd', 'nr_alleles']:
+        data[k] = [l[k] for l in loci]
+
+    return data
+
+
+def update_schema(species_id, schema_id, virtuoso_graph, local_sparql, base_url):
+    """ Creates the pre-computed files of a schema that do not have
+        the schema's last modification date.
+
+        Parameters
+        ----------
+        species_id : str
+            Identifier of the species in the Chewie-NS.
+        schema_id : str
+            Identifier of the schema in the Chewie-NS.
+        virtuoso_graph : str
+            URI of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        base_url : str
+            Base URL of the Chewie-NS.
+
+        Returns
+        -------
+        list
+            Names of the artifacts that were updated.
+    """
+
+    schema_uri, properties = schema_properties(species_id, schema_id, virtuoso_graph,
+                                               local_sparql, base_url)
+    if properties is None:
+        return []
+
+    last_modified = properties['last_modified']
+    files = precomputed_files(species_id, schema_id)
+    outdated = outdated_files(files, schema_uri, last_modified)
+    if len(outdated) == 0:
+        logger.info('Pre-computed files for schema {0} are up-to-date.'.format(schema_uri))
+        return []
+
+    # load the schema data once for all files
+    lengths_dir = os.path.join(Config.PRE_COMPUTE,
+                               '{0}_{1}_lengths'.format(species_id, schema_id))
+    if os.path.isdir(lengths_dir) is True:
+        loci_uris, offsets, lengths = read_lengths(lengths_dir)
+    else:
+        loci_uris, offsets, lengths = ls.from_lists(query_lengths(schema_uri, virtuoso_graph,
+                                                                  local_sparql))
+
+    loci = aux.get_data(SPARQLWrapper(local_sparql),
+                        sq.SELECT_SCHEMA_LOCI.format(virtuoso_graph, schema_uri))
+    loci_names = {l['locus']['value']: l['name']['value']
+                  for l in loci['results']['bindings']}
+
+    loci = loci_stats(loci_uris, offsets, lengths, loci_names)
+    # sort by locus id
+    loci.sort(key=lambda l: int(l['uri'].split('/')[-1]))
+
+    if 'totals' in outdated:
+        update_totals(files['totals'], schema_uri, properties, loci,
+                      virtuoso_graph, local_sparql)
+    if 'loci' in outdated:
+        update_loci_totals(files['loci'], schema_uri, last_modified, loci)
+    if 'mode' in outdated:
+        write_json(files['mode'], mode_data(schema_uri, last_modified, loci))
+    if 'annotations' in outdated:
+        annotations = loci_annotations(schema_uri, virtuoso_graph, local_sparql)
+        write_json(files['annotations'], annotations_data(schema_uri, last_modified,
+                                                          loci, annotations))
+    if 'boxplot' in outdated:
+        write_json(files['boxplot'], boxplot_data(schema_uri, last_modified, loci))
+
+    logger.info('Updated {0} for schema {1}.'.format(', '.join(outdated), schema_uri))
+
+    return outdated
+
+
+def get_client():
+    """ Creates a Redis client for the Celery broker database. """
+
+    return redis.Redis.from_url(Config.CELERY_BROKER_URL)
+
+
+def request_update(species_id, schema_id, client=None):
+    """ Adds a schema to the queue processed by the pre-computation
+        daemon if it is not already queued.
+
+        Returns
+        -------
+        bool
+            True if the schema was added to the queue, False if
+            the request was coalesced with a queued request.
+    """
+
+    client = client or get_client()
+    member = '{0}_{1}'.format(species_id, schema_id)
+    if client.sadd(PENDING_KEY, member) == 1:
+        client.rpush(QUEUE_KEY, member)
+        return True
+
+    return False
+
+
+def next_schema(client=None, timeout=0):
+    """ Waits for a schema in the queue.
+
+        Returns
+        -------
+        list
+            The species and schema identifiers (None if the
+            timeout was reached).
+    """
+
+    client = client or get_client()
+    item = client.blpop(QUEUE_KEY, timeout=timeout)
+    if item is None:
+        return None
+
+    member = item[1].decode('utf-8')
+    # changes made while the schema is processed queue it again
+    client.srem(PENDING_KEY, member)
+
+    return member.split('_')
+
+
+def schema_changed(species_id, schema_id, virtuoso_graph, local_sparql, base_url):
+    """ Updates the pre-computed files of a schema after it changes.
+        The schema is added to the queue of the pre-computation
+        daemon if PRECOMPUTE_DAEMON is set, otherwise the files are
+        created in-process. Errors are logged and do not interrupt
+        the caller.
+    """
+
+    try:
+        if Config.PRECOMPUTE_DAEMON is True:
+            request_update(species_id, schema_id)
+        else:
+            with metrics.job_timer('precompute'):
+                update_schema(species_id, schema_id, virtuoso_graph,
+                              local_sparql, base_url)
+    except Exception as e:
+        logger.exception('Could not update pre-computed files of schema '
+                         '{0} of species {1}: {2}'.format(schema_id, species_id, e))
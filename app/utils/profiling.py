@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains an opt-in WSGI middleware that profiles
+requests to the API. For each profiled request it records how
+much time was spent on SPARQL requests to Virtuoso, SQL queries
+to Postgres, JSON serialization and streaming the response body.
+Profiled requests can also have a cProfile dump written to disk
+(the ``.prof`` files can be opened with snakeviz or converted
+to flamegraphs with flameprof).
+
+Requests are profiled if they are selected based on the sampling
+rate or if they include the profiling header. Requests with the
+header are profiled at most once per interval in each worker and
+only the most recent cProfile dumps are kept, so that clients
+cannot fill the disk with dumps.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import time
+import random
+import logging
+import cProfile
+import threading
+from functools import wraps
+
+
+logger = logging.getLogger(__name__)
+
+# per-thread accumulator for the request that is being profiled
+_local = threading.local()
+
+
+def record(category, elapsed, amount=1):
+    """ Adds a timing to the breakdown of the request that
+        is being profiled in the current thread.
+
+        Parameters
+        ----------
+        category : str
+            Name of the category (e.g.: 'sparql_get').
+        elapsed : float
+            Time spent, in seconds.
+        amount : int
+            Value added to the counter of the category.
+    """
+
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        entry = stats.setdefault(category, [0, 0.0])
+        entry[0] += amount
+        entry[1] += elapsed
+
+
+def timed(category):
+    """ Decorator that records the number of calls and the
+        time spent in the decorated function if the current
+        request is being profiled.
+
+        Parameters
+        ----------
+        category : str
+            Name of the category the calls are added to.
+    """
+
+    def decorated(fn):
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'stats', None) is None:
+                return fn(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(category, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorated
+
+
+def install_sqlalchemy_hooks():
+    """ Registers SQLAlchemy event listeners that time
+        every SQL statement executed by any engine.
+    """
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(install_sqlalchemy_hooks, 'installed', False) is True:
+        return
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault('profiling_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters,
+                             context, executemany):
+        start = conn.info['profiling_start'].pop()
+        record('sql', time.perf_counter() - start)
+
+    install_sqlalchemy_hooks.installed = True
+
+
+def install_serialization_hook(api):
+    """ Times the JSON serialization of the responses of
+        a Flask-RESTPlus API.
+    """
+
+    from flask_restplus.representations import output_json
+
+    api.representation('application/json')(timed('serialize')(output_json))
+
+
+class ProfiledResponse(object):
+    """ Wraps a WSGI response iterable to count the bytes and
+        time spent streaming the response body. The request
+        breakdown is reported when the server closes the
+        response.
+    """
+
+    def __init__(self, iterable, middleware, request_data):
+        self.iterable = iterable
+        self.middleware = middleware
+        self.request_data = request_data
+
+    def __iter__(self):
+        stats = self.request_data['stats']
+        profiler = self.request_data['profiler']
+        # streamed bytes are counted instead of calls
+        stream = stats.setdefault('stream', [0, 0.0])
+        self.request_data['stream_start'] = time.perf_counter()
+        for chunk in self._chunks(stats, profiler):
+            stream[0] += len(chunk)
+            yield chunk
+
+    def _chunks(self, stats, profiler):
+        """ Iterates over the wrapped response with the request
+            breakdown and profiler active while each chunk is
+            being generated.
+        """
+
+        iterator = iter(self.iterable)
+        while True:
+            _local.stats = stats
+            if profiler is not None:
+                profiler.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                _local.stats = None
+
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            stream_start = self.request_data.get('stream_start')
+            if stream_start is not None:
+                self.request_data['stats']['stream'][1] = time.perf_counter() - stream_start
+            self.middleware.report(self.request_data)
+
+
+class ProfilerMiddleware(object):
+    """ WSGI middleware that profiles a sample of requests.
+
+        Parameters
+        ----------
+        app : callable
+            The WSGI application to wrap.
+        sample_rate : float
+            Fraction of requests that are profiled (0 to 1).
+        header : str
+            Name of the request header that forces profiling
+            (None to disable).
+        header_interval : float
+            Minimum time, in seconds, between two requests
+            profiled because they include the header.
+        profile_dir : str
+            Path to the directory where cProfile dumps are
+            written (None to only log the breakdown).
+        max_dumps : int
+            Maximum number of cProfile dumps kept in the
+            directory (the oldest dumps are removed).
+        logfile : str
+            Path to the file where the breakdown of each
+            profiled request is logged.
+    """
+
+    def __init__(self, app, sample_rate=0.0, header=None, header_interval=60,
+                 profile_dir=None, max_dumps=100, logfile=None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header_key = None
+        if header is not None:
+            self.header_key = 'HTTP_{0}'.format(header.upper().replace('-', '_'))
+        self.header_interval = header_interval
+        self.last_forced = None
+        self.forced_lock = threading.Lock()
+        self.profile_dir = profile_dir
+        self.max_dumps = max_dumps
+        if profile_dir is not None and os.path.isdir(profile_dir) is False:
+            os.makedirs(profile_dir)
+
+        if logfile is not None:
+            handler = logging.FileHandler(logfile)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s',
+                                                   datefmt='%Y-%m-%dT%H:%M:%S'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+    def selected(self, environ):
+        """ Determines if a request should be profiled. """
+
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+
+        if self.header_key is not None and self.header_key in environ:
+            # limit the requests that clients can force to be profiled
+            with self.forced_lock:
+                now = time.monotonic()
+                if self.last_forced is None or now - self.last_forced >= self.header_interval:
+                    self.last_forced = now
+                    return True
+
+        return False
+
+    def remove_old_dumps(self):
+        """ Removes the oldest cProfile dumps so that the directory
+            has room for a new dump.
+        """
+
+        dumps = [os.path.join(self.profile_dir, f)
+                 for f in os.listdir(self.profile_dir) if f.endswith('.prof')]
+        if len(dumps) < self.max_dumps:
+            return
+
+        dumps.sort(key=lambda f: os.path.basename(f))
+        for file in dumps[:len(dumps) - self.max_dumps + 1]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def report(self, request_data):
+        """ Logs the breakdown of a request and writes the
+            cProfile dump, if enabled.
+        """
+
+        total = time.perf_counter() - request_data['start']
+        stats = request_data['stats']
+
+        parts = []
+        for category in sorted(stats):
+            count, elapsed = stats[category]
+            parts.append('{0}={1}/{2:.4f}s'.format(category, count, elapsed))
+
+        logger.info('{0} {1} {2} total={3:.4f}s {4}'.format(request_data['method'],
+                                                             request_data['path'],
+                                                             request_data['status'],
+                                                             total,
+                                                             ' '.join(parts)))
+
+        profiler = request_data['profiler']
+        if profiler is not None:
+            filename = '{0}_{1}_{2}.prof'.format(int(time.time() * 1000),
+                                                 request_data['method'],
+                                                 request_data['path'].strip('/').replace('/', '.'))
+            self.remove_old_dumps()
+            profiler.dump_stats(os.path.join(self.profile_dir, filename))
+
+    def __call__(self, environ, start_response):
+        if self.selected(environ) is False:
+            return self.app(environ, start_response)
+
+        request_data = {'method': environ.get('REQUEST_METHOD', ''),
+                        'path': environ.get('PATH_INFO', ''),
+                        'status': None,
+                        'start': time.perf_counter(),
+                        'stats': {},
+                        'profiler': cProfile.Profile() if self.profile_dir is not None else None}
+
+        def profiled_start_response(status, headers, exc_info=None):
+            request_data['status'] = status.split(' ')[0]
+            # breakdown of the work done before the body is streamed
+            timings = ['{0};desc="{1} calls";dur={2:.1f}'.format(k, v[0], v[1]*1000)
+                       for k, v in request_data['stats'].items()]
+            if len(timings) > 0:
+                headers.append(('Server-Timing', ', '.join(timings)))
+
+            return start_response(status, headers, exc_info)
+
+        profiler = request_data['profiler']
+        _local.stats = request_data['stats']
+        if profiler is not None:
+            profiler.enable()
+        try:
+            iterable = self.app(environ, profiled_start_response)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _local.stats = None
+
+        return ProfiledResponse(iterable, self, request_data)
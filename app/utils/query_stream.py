@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a producer/consumer pipeline used by the
+insertion processes to send SPARQL queries to Virtuoso while the
+queries are still being created. The producer is an iterable that
+creates the queries lazily (e.g.: reading the data of each locus
+and building the queries for each batch of alleles) and a pool of
+threads sends them. The queue between the producer and the threads
+is bounded, so that only a few queries are kept in memory and the
+producer waits when Virtuoso is slower than query creation.
+
+Code documentation
+------------------
+"""
+
+
+import queue
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def stream(tasks, send, workers, args=(), queue_size=None):
+    """ Sends queries created by a producer with a pool of threads.
+
+        Parameters
+        ----------
+        tasks : iter
+            Iterable that yields tuples with a key (e.g.: the
+            locus URI) and a query.
+        send : func
+            Function that sends a query. It is called with the
+            key, the query and the elements in `args`.
+        workers : int
+            Number of threads that send queries.
+        args : tup
+            Additional arguments passed to `send`.
+        queue_size : int
+            Maximum number of queries waiting to be sent (defaults
+            to twice the number of threads).
+
+        Returns
+        -------
+        results : dict
+            Keys as keys and lists with the values returned by
+            `send` as values. The value is None for queries that
+            raised an exception.
+    """
+
+    tasks_queue = queue.Queue(maxsize=queue_size or workers * 2)
+    results = {}
+    lock = threading.Lock()
+
+    def consume():
+        while True:
+            task = tasks_queue.get()
+            if task is None:
+                break
+            key, query = task
+            try:
+                result = send(key, query, *args)
+            except Exception as e:
+                # keep consuming so that the producer is not blocked
+                logger.warning('Could not send query for {0}: {1}'.format(key, e))
+                result = None
+            with lock:
+                results.setdefault(key, []).append(result)
+
+    threads = [threading.Thread(target=consume, daemon=True)
+               for i in range(workers)]
+    for t in threads:
+        t.start()
+
+    try:
+        for task in tasks:
+            tasks_queue.put(task)
+    finally:
+        # one stop signal per thread after the queued tasks
+        for t in threads:
+            tasks_queue.put(None)
+        for t in threads:
+            t.join()
+
+    return results
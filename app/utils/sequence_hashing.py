@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the functions used by the insertion processes
+to determine the SHA-256 hashes of allele sequences. Hashing runs in
+the Python interpreter and holds the GIL for sequences of typical
+allele size, so large loci are hashed in chunks by a pool of worker
+processes. The pool is started by the main process before it starts
+threads (``start_pool``) and small loci are hashed in the calling
+process to avoid the cost of sending sequences to the workers.
+
+The data sent by clients can include the hash of each allele. The
+hashes are verified in the pool before they are used and any hash
+that does not match its sequence is replaced.
+
+Code documentation
+------------------
+"""
+
+
+import atexit
+import hashlib
+import logging
+import multiprocessing
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+_state = {'pool': None}
+
+
+def sequence_hash(sequence):
+    """ Determines the SHA-256 hash of a DNA sequence. """
+
+    return hashlib.sha256(sequence.encode('utf-8')).hexdigest()
+
+
+def hash_chunk(sequences):
+    """ Determines the hashes of a list of sequences. """
+
+    return [hashlib.sha256(s.encode('utf-8')).hexdigest() for s in sequences]
+
+
+def verify_chunk(chunk):
+    """ Determines the positions of the hashes that do not
+        match their sequences.
+
+        Parameters
+        ----------
+        chunk : tup
+            A list of sequences and a list with the hashes
+            of those sequences.
+
+        Returns
+        -------
+        list
+            Positions (in the chunk) of the invalid hashes.
+    """
+
+    sequences, hashes = chunk
+
+    return [i for i, (s, h) in enumerate(zip(sequences, hashes))
+            if hashlib.sha256(s.encode('utf-8')).hexdigest() != h]
+
+
+def start_pool(processes=None):
+    """ Starts the pool of processes used to hash large loci. The
+        pool is not started if only one process is available.
+    """
+
+    processes = processes or Config.HASH_PROCESSES
+    if _state['pool'] is None and processes > 1:
+        _state['pool'] = multiprocessing.Pool(processes=processes)
+        atexit.register(close_pool)
+
+
+def close_pool():
+    """ Stops the pool of processes used to hash large loci. """
+
+    pool = _state['pool']
+    if pool is not None:
+        _state['pool'] = None
+        pool.close()
+        pool.join()
+
+
+def split(values, size):
+
+    return [values[i:i+size] for i in range(0, len(values), size)]
+
+
+def hash_sequences(sequences):
+    """ Determines the hashes of a list of sequences, in
+        parallel if the pool was started and the list is
+        large.
+
+        Returns
+        -------
+        list
+            The hashes of the sequences, in the same order.
+    """
+
+    sequences = list(sequences)
+    pool = _state['pool']
+    if pool is None or len(sequences) < Config.HASH_POOL_MIN:
+        return hash_chunk(sequences)
+
+    hashes = []
+    for chunk_hashes in pool.map(hash_chunk, split(sequences, Config.HASH_CHUNK_SIZE)):
+        hashes.extend(chunk_hashes)
+
+    return hashes
+
+
+def verify_hashes(sequences, hashes):
+    """ Determines the positions of the hashes that do not
+        match their sequences, in parallel if the pool was
+        started and the list is large.
+
+        Returns
+        -------
+        invalid : list
+            Positions of the invalid hashes.
+    """
+
+    pool = _state['pool']
+    if pool is None or len(sequences) < Config.HASH_POOL_MIN:
+        return verify_chunk((sequences, hashes))
+
+    size = Config.HASH_CHUNK_SIZE
+    chunks = zip(split(sequences, size), split(hashes, size))
+    invalid = []
+    for i, chunk_invalid in enumerate(pool.map(verify_chunk, chunks)):
+        invalid.extend([i*size + p for p in chunk_invalid])
+
+    return invalid
+
+
+def locus_hashes(locus_data):
+    """ Gets the hashes of the alleles in the data of a locus.
+
+        Parameters
+        ----------
+        locus_data : list
+            The locus URI, species name, user URI, the alleles
+            and, optionally, the hashes of the alleles computed
+            by the client.
+
+        Returns
+        -------
+        hashes : list
+            The hashes of the alleles, in the same order.
+    """
+
+    alleles = list(locus_data[3])
+    client_hashes = locus_data[4] if len(locus_data) > 4 else None
+    if client_hashes is None or len(client_hashes) != len(alleles):
+        return hash_sequences(alleles)
+
+    hashes = list(client_hashes)
+    invalid = verify_hashes(alleles, hashes)
+    if len(invalid) > 0:
+        logger.warning('{0} hashes sent for locus {1} do not match the '
+                       'sequences.'.format(len(invalid), locus_data[0]))
+        for i in invalid:
+            hashes[i] = sequence_hash(alleles[i])
+
+    return hashes
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions used to read and update a local
+index of the sequences in the Chewie-NS. The index maps the SHA-256
+hash of each DNA sequence to the loci and alleles that have that
+sequence and stores the length of the sequence. It is used to
+answer sequence existence checks without querying Virtuoso.
+
+The index is a SQLite database in WAL mode, so that it can be read
+by the Flask workers while the insertion processes update it. The
+insertion and deletion processes update the index after changing
+the data in Virtuoso. The index is only used to answer queries
+after it has been fully built from the data in Virtuoso with the
+``sequence_index_builder.py`` script. Routes must fall back to
+Virtuoso if the functions that read the index return None.
+
+Sequences are kept in the index after their alleles are deleted,
+like in Virtuoso, where deleting an allele does not delete the
+sequence it points to. Alleles are removed by the deletion processes
+and rebuilding the index removes the alleles that are no longer in
+Virtuoso.
+
+The insertion processes add the alleles of each batch to the index
+as soon as Virtuoso inserts the batch, so that the index answers
+existence checks while large schemas are being inserted.
+
+A Bloom filter built from the index (``<index>.bloom``) answers
+most checks for sequences that are not in the Chewie-NS without
+reading the index.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from config import Config
+from app.utils import bloom_filter
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS sequences '
+          '(hash TEXT PRIMARY KEY, length INTEGER NOT NULL) WITHOUT ROWID;'
+          'CREATE TABLE IF NOT EXISTS alleles '
+          '(hash TEXT NOT NULL, locus INTEGER NOT NULL, allele INTEGER NOT NULL, '
+          'PRIMARY KEY (hash, locus, allele)) WITHOUT ROWID;'
+          'CREATE INDEX IF NOT EXISTS alleles_locus ON alleles (locus, allele);'
+          'CREATE TABLE IF NOT EXISTS info '
+          '(key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;'
+          'CREATE TABLE IF NOT EXISTS build_alleles '
+          '(hash TEXT NOT NULL, locus INTEGER NOT NULL, allele INTEGER NOT NULL, '
+          'PRIMARY KEY (hash, locus, allele)) WITHOUT ROWID;')
+
+# alleles added while the index is being built are also added to the
+# build_alleles table so that they are kept when the build finishes
+BUILD_ADD = ('INSERT OR IGNORE INTO build_alleles SELECT ?, ?, ? '
+             "WHERE EXISTS (SELECT 1 FROM info WHERE key = 'building')")
+
+# size of the memory map used to read the database (bytes)
+MMAP_SIZE = 1 << 30
+
+
+def get_connection(path=None):
+    """ Gets a connection to the index database (one per thread).
+
+        Parameters
+        ----------
+        path : str
+            Path to the database file (defaults to the
+            SEQUENCE_INDEX configuration value).
+
+        Returns
+        -------
+        connection : sqlite3.Connection
+            Connection to the database.
+    """
+
+    path = os.path.abspath(path or Config.SEQUENCE_INDEX)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    if path not in connections:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA mmap_size={0}'.format(MMAP_SIZE))
+        connection.executescript(SCHEMA)
+        connections[path] = connection
+
+    return connections[path]
+
+
+def bloom_path(path=None):
+    """ Gets the path to the Bloom filter file of an index. """
+
+    return '{0}.bloom'.format(os.path.abspath(path or Config.SEQUENCE_INDEX))
+
+
+def is_complete(path=None):
+    """ Determines if the index has been fully built. """
+
+    connection = get_connection(path)
+    row = connection.execute('SELECT value FROM info '
+                             "WHERE key = 'complete'").fetchone()
+
+    return row is not None and row[0] == '1'
+
+
+def sequence_exists(seq_hash, path=None):
+    """ Determines if a sequence is in the Chewie-NS.
+
+        Parameters
+        ----------
+        seq_hash : str
+            SHA-256 hash of the DNA sequence.
+
+        Returns
+        -------
+        bool
+            True if the sequence is in the Chewie-NS, False
+            otherwise. None if the index cannot answer and
+            Virtuoso must be queried.
+    """
+
+    try:
+        # the filter is only trusted while the index is complete,
+        # it might not have been removed when the index was
+        # invalidated
+        if is_complete(path) is False:
+            return None
+        # definite negatives do not need to read the index
+        if bloom_filter.get_filter(bloom_path(path)).might_contain(seq_hash) is False:
+            return False
+        row = get_connection(path).execute('SELECT 1 FROM sequences '
+                                           'WHERE hash = ?', (seq_hash,)).fetchone()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning('Could not read sequence index: {0}'.format(e))
+        return None
+
+    return row is not None
+
+
+def lookup(seq_hash, path=None):
+    """ Gets the alleles that have a sequence.
+
+        Parameters
+        ----------
+        seq_hash : str
+            SHA-256 hash of the DNA sequence.
+
+        Returns
+        -------
+        list
+            A list with a tuple (locus identifier, allele
+            identifier, sequence length) per allele. None if
+            the index cannot answer and Virtuoso must be queried.
+    """
+
+    try:
+        if is_complete(path) is False:
+            return None
+        rows = get_connection(path).execute('SELECT a.locus, a.allele, s.length '
+                                            'FROM alleles a JOIN sequences s '
+                                            'ON a.hash = s.hash WHERE a.hash = ? '
+                                            'ORDER BY a.locus, a.allele',
+                                            (seq_hash,)).fetchall()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning('Could not read sequence index: {0}'.format(e))
+        return None
+
+    return rows
+
+
+def allele_records(locus_uri, alleles, start_id=1, hashes=None):
+    """ Creates the index records for the alleles of a locus.
+
+        Parameters
+        ----------
+        locus_uri : str
+            URI of the locus in the Chewie-NS.
+        alleles : iter
+            DNA sequences of the alleles, ordered by allele
+            identifier.
+        start_id : int
+            Identifier of the first allele.
+        hashes : list
+            Hashes of the alleles (determined if not provided).
+
+        Returns
+        -------
+        records : list
+            A list with a tuple (sequence hash, locus identifier,
+            allele identifier, sequence length) per allele.
+    """
+
+    locus_id = int(locus_uri.split('/')[-1])
+    if hashes is None:
+        hashes = [hashlib.sha256(seq.encode('utf-8')).hexdigest() for seq in alleles]
+    records = [(seq_hash, locus_id, allele_id, len(seq))
+               for allele_id, (seq, seq_hash) in enumerate(zip(alleles, hashes), start=start_id)]
+
+    return records
+
+
+def _write(statements, path=None):
+    """ Executes a set of statements in a single transaction.
+        If the index cannot be updated it is marked as incomplete
+        so that it is no longer used until it is rebuilt.
+
+        Returns
+        -------
+        changes : list
+            Number of rows changed by each statement (None if
+            the index could not be updated).
+    """
+
+    try:
+        connection = get_connection(path)
+        changes = []
+        with connection:
+            for statement, rows in statements:
+                changes.append(connection.executemany(statement, rows).rowcount)
+        return changes
+    except (sqlite3.Error, OSError) as e:
+        logger.warning('Could not update sequence index: {0}'.format(e))
+        invalidate(path)
+        return None
+
+
+def add_alleles(records, path=None):
+    """ Adds alleles to the index.
+
+        Parameters
+        ----------
+        records : list
+            A list with a tuple (sequence hash, locus identifier,
+            allele identifier, sequence length) per allele.
+
+        Returns
+        -------
+        int
+            Number of sequences that were not in the index (None
+            if the index could not be updated).
+    """
+
+    if len(records) == 0:
+        return 0
+
+    changes = _write([('INSERT OR IGNORE INTO sequences VALUES (?, ?)',
+                     [(r[0], r[3]) for r in records]),
+                    ('INSERT OR IGNORE INTO alleles VALUES (?, ?, ?)',
+                     [(r[0], r[1], r[2]) for r in records]),
+                    (BUILD_ADD, [(r[0], r[1], r[2]) for r in records])], path)
+
+    if changes is None:
+        return None
+
+    filter_path = bloom_path(path)
+    try:
+        with bloom_filter.write_lock(filter_path):
+            bloom_filter.add(filter_path, [r[0] for r in records])
+    except (OSError, ValueError) as e:
+        logger.warning('Could not update sequence Bloom filter: {0}'.format(e))
+        invalidate(path)
+
+    return changes[0]
+
+
+def remove_alleles(locus_id, allele_ids, path=None):
+    """ Removes alleles of a locus from the index. """
+
+    changes = _write([('DELETE FROM alleles WHERE locus = ? AND allele = ?',
+                       [(int(locus_id), int(a)) for a in allele_ids])], path)
+
+    return changes is not None
+
+
+def remove_loci(loci_ids, path=None):
+    """ Removes all alleles of a set of loci from the index. """
+
+    changes = _write([('DELETE FROM alleles WHERE locus = ?',
+                       [(int(l),) for l in loci_ids])], path)
+
+    return changes is not None
+
+
+def invalidate(path=None):
+    """ Marks the index as incomplete and removes its Bloom filter. """
+
+    try:
+        bloom_filter.remove(bloom_path(path))
+    except OSError as e:
+        logger.warning('Could not remove sequence Bloom filter: {0}'.format(e))
+
+    try:
+        connection = get_connection(path)
+        with connection:
+            connection.execute("DELETE FROM info WHERE key = 'complete'")
+    except (sqlite3.Error, OSError) as e:
+        logger.warning('Could not invalidate sequence index: {0}'.format(e))
+
+
+def build(records, path=None, batch_size=10000, complete=None):
+    """ Adds all alleles in the Chewie-NS to the index, marks it
+        as complete and builds its Bloom filter.
+
+        The alleles are added in small transactions so that the
+        insertion processes can update the index while it is being
+        built. Alleles that are in the index but were not read from
+        the records or added by the insertion processes during the
+        build are removed when the build finishes (sequences are
+        never removed), unless `complete` determines that some
+        alleles were not read.
+
+        Parameters
+        ----------
+        records : iter
+            Iterable with a tuple (sequence hash, locus identifier,
+            allele identifier, sequence length) per allele in the
+            Chewie-NS.
+        batch_size : int
+            Number of alleles added per transaction.
+        complete : func
+            Function called after all records were read. Returns
+            True if the records had all alleles in the Chewie-NS
+            (alleles are removed if it is not provided).
+
+        Returns
+        -------
+        total : int
+            Number of alleles read from the records.
+    """
+
+    connection = get_connection(path)
+    # alleles inserted from now on are added to build_alleles
+    # (they might not be in the records read from Virtuoso)
+    with connection:
+        connection.execute('DELETE FROM build_alleles')
+        connection.execute("INSERT OR REPLACE INTO info VALUES ('building', '1')")
+
+    def add_batch(batch):
+        connection.executemany('INSERT OR IGNORE INTO sequences VALUES (?, ?)',
+                               [(b[0], b[3]) for b in batch])
+        connection.executemany('INSERT OR IGNORE INTO alleles VALUES (?, ?, ?)',
+                               [(b[0], b[1], b[2]) for b in batch])
+        connection.executemany('INSERT OR IGNORE INTO build_alleles VALUES (?, ?, ?)',
+                               [(b[0], b[1], b[2]) for b in batch])
+
+    total = 0
+    batch = []
+    for r in records:
+        batch.append(r)
+        if len(batch) == batch_size:
+            with connection:
+                add_batch(batch)
+            total += len(batch)
+            batch = []
+
+    with connection:
+        add_batch(batch)
+    total += len(batch)
+
+    prune = complete is None or complete() is True
+    with connection:
+        # remove the alleles that are no longer in the Chewie-NS
+        if prune is True:
+            connection.execute('DELETE FROM alleles WHERE NOT EXISTS '
+                               '(SELECT 1 FROM build_alleles b WHERE b.hash = alleles.hash '
+                               'AND b.locus = alleles.locus AND b.allele = alleles.allele)')
+        connection.execute('DELETE FROM build_alleles')
+        connection.execute("DELETE FROM info WHERE key = 'building'")
+        connection.execute("INSERT OR REPLACE INTO info VALUES ('complete', '1')")
+
+    # the lock makes insertion processes wait for the new filter
+    # file, sequences added to the index while the filter is built
+    # are added to the new file after it replaces the current one
+    filter_path = bloom_path(path)
+    with bloom_filter.write_lock(filter_path):
+        count = connection.execute('SELECT COUNT(*) FROM sequences').fetchone()[0]
+        hashes = (row[0] for row in connection.execute('SELECT hash FROM sequences'))
+        # leave room for the sequences added until the next build
+        bloom_filter.build(filter_path, hashes, count * 2)
+
+    return total
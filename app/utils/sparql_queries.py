@@ -636,6 +636,36 @@ SELECT_ALLELES_LENGTH = ('SELECT '
                            ' FILTER NOT EXISTS {{ ?part typon:deprecated "true"^^xsd:boolean }} }} '
                          ' OFFSET {2} LIMIT {3}')
 
+# used to build the local sequence index
+# pages are selected by the URI of the last allele of the previous
+# page, so alleles inserted or deleted while the pages are read do
+# not shift the following pages
+SELECT_ALLELES_HASHES = ('SELECT '
+                         '?allele '
+                         '?locus '
+                         '(str(?id) AS ?id) '
+                         '?sequence '
+                         '(strlen(?nucSeq) AS ?nucSeqLen) '
+                         'FROM <{0}> '
+                         'WHERE '
+                         '{{ ?allele a typon:Allele;'
+                           ' typon:isOfLocus ?locus;'
+                           ' typon:id ?id;'
+                           ' typon:hasSequence ?sequence .'
+                           ' ?sequence typon:nucleotideSequence ?nucSeq .'
+                           ' FILTER (str(?allele) > "{1}") }} '
+                         'ORDER BY str(?allele) '
+                         'LIMIT {2}')
+
+COUNT_INDEXED_ALLELES = ('SELECT (COUNT(?allele) AS ?count) '
+                         'FROM <{0}> '
+                         'WHERE '
+                         '{{ ?allele a typon:Allele;'
+                           ' typon:isOfLocus ?locus;'
+                           ' typon:id ?id;'
+                           ' typon:hasSequence ?sequence .'
+                           ' ?sequence typon:nucleotideSequence ?nucSeq .}}')
+
 SELECT_SCHEMA_LOCI_ANNOTATIONS = ('SELECT DISTINCT '
                                   '?locus '
                                   '?name '
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the lock that coordinates the processes that
+insert alleles of new schemas with the processes that synchronize
+(update) schemas. Insertion requests hold a shared lock while they
+are sent and synchronization processes hold an exclusive lock while
+they insert alleles, so that both never send data at the same time
+and synchronization processes run one at a time.
+
+The locks are ``flock`` locks on files in the directory of schema
+uploads, which is shared by all workers. Processes that wait for a
+lock are woken by the kernel as soon as it is released. A second
+file (gate) gives priority to synchronization processes: new
+insertion requests wait while a synchronization process waits for
+the requests that are being sent to finish.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import fcntl
+import threading
+import contextlib
+
+from config import Config
+
+
+LOCK_FILE = 'sync_lock'
+GATE_FILE = 'sync_gate'
+
+_local = threading.local()
+
+
+def lock_files():
+    """ Opens the lock files for the current thread. Each thread
+        needs its own file descriptors because flock locks are
+        shared by all users of a descriptor.
+
+        Returns
+        -------
+        list
+            The file objects of the gate and lock files.
+    """
+
+    files = getattr(_local, 'files', None)
+    if files is None:
+        os.makedirs(Config.SCHEMA_UP, exist_ok=True)
+        files = _local.files = [open(os.path.join(Config.SCHEMA_UP, GATE_FILE), 'a'),
+                                open(os.path.join(Config.SCHEMA_UP, LOCK_FILE), 'a')]
+
+    return files
+
+
+@contextlib.contextmanager
+def insertion():
+    """ Context manager that waits until no synchronization
+        process is running and holds a shared lock.
+    """
+
+    gate, lock = lock_files()
+    fcntl.flock(gate, fcntl.LOCK_SH)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+    finally:
+        fcntl.flock(gate, fcntl.LOCK_UN)
+
+    try:
+        yield
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def synchronization():
+    """ Context manager that waits until the insertion requests
+        and other synchronization processes finish and holds an
+        exclusive lock.
+    """
+
+    gate, lock = lock_files()
+    fcntl.flock(gate, fcntl.LOCK_EX)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    finally:
+        fcntl.flock(gate, fcntl.LOCK_UN)
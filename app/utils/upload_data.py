@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the functions used to read the ZIP archives
+sent by clients during schema uploads and synchronization. The data
+is read directly from the members of the archives, so archives are
+never extracted to the upload directory. Archives can be read from
+a path or from a file object, such as the stream of an uploaded
+file, which is read before it is written to disk.
+
+The member of each archive is a record container with the
+following layout (integers are unsigned and big-endian):
+
+- magic bytes ``CNSR`` and a version byte (1);
+- the length of the header (4 bytes) and the header, a JSON
+  object with the ``kind`` of data and its properties;
+- one record per item, each with its length (4 bytes) and
+  its content.
+
+There are two kinds of containers:
+
+- ``loci``: the header has the loci ``prefix`` and each record
+  is a JSON array with the data of a locus;
+- ``alleles``: the header has the ``locus`` URI, the ``species``
+  name, the ``user`` URI and ``hashes`` (true if each record
+  starts with the 64 characters of the SHA-256 hash of the
+  allele). Each record is the DNA sequence of an allele.
+
+Records are read one at a time and only data types are created
+from them. ``open_archive`` iterates over the records lazily and
+``read_archive`` collects them into the lists used by the routes
+and the insertion processes, which need all the data of a locus
+or of the loci of a schema at once. Archives created by older clients have pickled members,
+which are loaded with an unpickler that only accepts built-in
+data types.
+
+Code documentation
+------------------
+"""
+
+
+import io
+import json
+import pickle
+import struct
+import zipfile
+import contextlib
+
+
+MAGIC = b'CNSR'
+VERSION = 1
+LENGTH = struct.Struct('>I')
+
+LOCI = 'loci'
+ALLELES = 'alleles'
+
+# globals allowed in pickled data sent by older clients
+SAFE_GLOBALS = {('builtins', 'set'), ('builtins', 'frozenset'),
+                ('__builtin__', 'set'), ('__builtin__', 'frozenset')}
+
+
+class SafeUnpickler(pickle.Unpickler):
+    """ Unpickler that only creates built-in data types. """
+
+    def find_class(self, module, name):
+        if (module, name) in SAFE_GLOBALS:
+            return super().find_class(module, name)
+
+        raise pickle.UnpicklingError('Global {0}.{1} is not allowed in '
+                                     'uploaded data.'.format(module, name))
+
+
+def is_archive(source):
+    """ Determines if a file or file object is a ZIP archive. The
+        position of file objects is restored.
+    """
+
+    if hasattr(source, 'seek'):
+        position = source.tell()
+        try:
+            return zipfile.is_zipfile(source)
+        finally:
+            source.seek(position)
+
+    return zipfile.is_zipfile(source)
+
+
+def read_exactly(infile, size):
+    """ Reads a number of bytes from a file and raises an
+        error if the file ends before.
+    """
+
+    data = infile.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated record container.')
+
+    return data
+
+
+def write_container(outfile, header, records):
+    """ Writes a record container.
+
+        Parameters
+        ----------
+        outfile : file
+            File object opened in binary mode.
+        header : dict
+            Header of the container (must include the `kind`).
+        records : iter
+            Records of the container (bytes or str).
+    """
+
+    header = json.dumps(header).encode('utf-8')
+    outfile.write(MAGIC + bytes([VERSION]))
+    outfile.write(LENGTH.pack(len(header)) + header)
+    for record in records:
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        outfile.write(LENGTH.pack(len(record)) + record)
+
+
+def read_header(infile):
+    """ Reads the header of a record container whose magic
+        bytes were already read.
+
+        Returns
+        -------
+        header : dict
+            The header of the container.
+    """
+
+    version = read_exactly(infile, 1)[0]
+    if version != VERSION:
+        raise ValueError('Unsupported record container version '
+                         '{0}.'.format(version))
+
+    size = LENGTH.unpack(read_exactly(infile, LENGTH.size))[0]
+    header = json.loads(read_exactly(infile, size).decode('utf-8'))
+
+    return header
+
+
+def iter_records(infile):
+    """ Yields the records of a record container, one at a time,
+        until the end of the file.
+    """
+
+    while True:
+        prefix = infile.read(LENGTH.size)
+        if len(prefix) == 0:
+            return
+        if len(prefix) != LENGTH.size:
+            raise ValueError('Truncated record container.')
+
+        yield read_exactly(infile, LENGTH.unpack(prefix)[0])
+
+
+@contextlib.contextmanager
+def open_archive(source):
+    """ Context manager that opens the first member of a ZIP
+        archive and yields its header and an iterator over
+        its records. Members with pickled data are loaded and
+        yield a None header and the data.
+
+        Parameters
+        ----------
+        source : str or file
+            Path to the ZIP archive or a seekable file object.
+    """
+
+    with zipfile.ZipFile(source) as zf:
+        zipinfo = zf.infolist()
+        with zf.open(zipinfo[0]) as f:
+            infile = io.BufferedReader(f)
+            if infile.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+                read_exactly(infile, len(MAGIC))
+                yield (read_header(infile), iter_records(infile))
+            else:
+                yield (None, SafeUnpickler(infile).load())
+
+
+def read_archive(source):
+    """ Reads the data in the first member of a ZIP archive
+        without extracting it.
+
+        Parameters
+        ----------
+        source : str or file
+            Path to the ZIP archive or a seekable file object.
+
+        Returns
+        -------
+        data : list
+            For loci data, the loci prefix and a list with the
+            data of each locus. For alleles data, the locus URI,
+            the species name, the user URI, a tuple with the
+            alleles and a list with their hashes (None if the
+            hashes were not sent).
+    """
+
+    with open_archive(source) as (header, records):
+        if header is None:
+            return records
+
+        kind = header.get('kind')
+        if kind == LOCI:
+            data = [header['prefix'],
+                    [json.loads(r.decode('utf-8')) for r in records]]
+        elif kind == ALLELES:
+            alleles = []
+            hashes = [] if header.get('hashes') is True else None
+            for record in records:
+                record = record.decode('ascii')
+                if hashes is not None:
+                    hashes.append(record[:64])
+                    record = record[64:]
+                alleles.append(record)
+            data = [header['locus'], header['species'], header['user'],
+                    tuple(alleles), hashes]
+        else:
+            raise ValueError('Unknown record container kind {0}.'.format(kind))
+
+    return data
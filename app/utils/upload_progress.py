@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the functions used to report the progress of
+schema uploads and synchronizations. The processes that insert data
+publish progress events in a Redis channel per schema and keep the
+latest values of the progress in a Redis hash. Clients receive the
+events through a Server-Sent Events stream and the routes that report
+the status of uploads read the latest values instead of counting the
+data in Virtuoso on every request.
+
+Publishing events never interrupts the caller. If Redis cannot be
+reached the event is discarded and the routes that read the progress
+count the data in Virtuoso.
+
+Code documentation
+------------------
+"""
+
+
+import json
+import time
+import logging
+
+import redis
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+# key of the hash with the latest progress values
+# and name of the channel with the progress events
+KEY = 'chewiens_progress:{0}:{1}'
+
+# events published when a process finishes
+COMPLETE = 'complete'
+FAILED = 'failed'
+TERMINAL_EVENTS = (COMPLETE, FAILED)
+
+# interval, in seconds, between comments sent to keep streams open
+KEEPALIVE = 15
+
+# the identifier of the event, the latest values and the published
+# event are changed atomically, so that the values always match the
+# identifier clients use to resume streams
+# KEYS[1]: progress key, ARGV[1]: TTL, ARGV[2]: event (JSON),
+# ARGV[3]: data (JSON), ARGV[4..]: fields and values to set
+PUBLISH_SCRIPT = """
+local event_id = redis.call('HINCRBY', KEYS[1], 'id', 1)
+redis.call('HMSET', KEYS[1], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('PUBLISH', KEYS[1], '{"id": ' .. event_id .. ', "event": ' ..
+           ARGV[2] .. ', "data": ' .. ARGV[3] .. '}')
+return event_id
+"""
+
+
+def get_client():
+    """ Creates a Redis client for the Celery broker database. """
+
+    return redis.Redis.from_url(Config.CELERY_BROKER_URL)
+
+
+def publish(species_id, schema_id, event, data=None, client=None):
+    """ Publishes a progress event and updates the latest progress
+        values of a schema.
+
+        Parameters
+        ----------
+        species_id : str
+            Identifier of the species in the Chewie-NS.
+        schema_id : str
+            Identifier of the schema in the Chewie-NS.
+        event : str
+            Name of the event.
+        data : dict
+            Progress values (must be JSON serializable).
+
+        Returns
+        -------
+        event_id : int
+            Identifier of the event (None if the event
+            could not be published).
+    """
+
+    key = KEY.format(species_id, schema_id)
+    data = data or {}
+    try:
+        client = client or get_client()
+        values = {k: json.dumps(v) for k, v in data.items()}
+        values['event'] = json.dumps(event)
+        args = [Config.PROGRESS_TTL, json.dumps(event), json.dumps(data)]
+        for field, value in values.items():
+            args.extend([field, value])
+        event_id = client.register_script(PUBLISH_SCRIPT)(keys=[key], args=args)
+    except redis.RedisError as e:
+        logger.warning('Could not publish progress of schema {0} of species '
+                       '{1}: {2}'.format(schema_id, species_id, e))
+        return None
+
+    return event_id
+
+
+def get_progress(species_id, schema_id, client=None):
+    """ Gets the latest progress values of a schema.
+
+        Returns
+        -------
+        progress : dict
+            Progress values, with the identifier and name of
+            the last event (None if no event was published or
+            the values cannot be read).
+    """
+
+    try:
+        client = client or get_client()
+        values = client.hgetall(KEY.format(species_id, schema_id))
+    except redis.RedisError as e:
+        logger.warning('Could not read progress of schema {0} of species '
+                       '{1}: {2}'.format(schema_id, species_id, e))
+        return None
+
+    if len(values) == 0:
+        return None
+
+    progress = {k.decode('utf-8'): json.loads(v.decode('utf-8'))
+                for k, v in values.items()}
+
+    return progress
+
+
+def format_event(event_id, event, data):
+    """ Formats an event for a Server-Sent Events stream. """
+
+    lines = ['id: {0}'.format(event_id)] if event_id is not None else []
+    lines.append('event: {0}'.format(event))
+    lines.append('data: {0}'.format(json.dumps(data)))
+
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(species_id, schema_id, last_id=None, timeout=None):
+    """ Yields the progress events of a schema formatted for a
+        Server-Sent Events stream.
+
+        The stream starts with the latest progress values (if
+        the client did not receive them) and ends when the
+        process finishes or after `timeout` seconds. Clients
+        reconnect with the identifier of the last event they
+        received.
+
+        Parameters
+        ----------
+        species_id : str
+            Identifier of the species in the Chewie-NS.
+        schema_id : str
+            Identifier of the schema in the Chewie-NS.
+        last_id : int
+            Identifier of the last event received by the client.
+        timeout : int
+            Maximum duration of the stream, in seconds.
+    """
+
+    timeout = timeout or Config.PROGRESS_STREAM_TIMEOUT
+    key = KEY.format(species_id, schema_id)
+    yield 'retry: {0}\n\n'.format(Config.PROGRESS_RETRY)
+
+    try:
+        client = get_client()
+        # subscribe before reading the latest values
+        # to not miss events published in between
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(key)
+    except redis.RedisError as e:
+        logger.warning('Could not subscribe to progress of schema {0} of '
+                       'species {1}: {2}'.format(schema_id, species_id, e))
+        yield format_event(None, 'error', {'message': 'Progress is not available.'})
+        return
+
+    try:
+        progress = get_progress(species_id, schema_id, client) or {}
+        current_id = progress.get('id', 0)
+        if current_id > (last_id or 0):
+            yield format_event(current_id, 'progress', progress)
+        # the process finished, the client received the
+        # last event now or before it reconnected
+        if progress.get('event') in TERMINAL_EVENTS:
+            return
+
+        deadline = time.time() + timeout
+        keepalive = time.time() + KEEPALIVE
+        while time.time() < deadline:
+            message = pubsub.get_message(timeout=1)
+            if message is not None and message['type'] == 'message':
+                event = json.loads(message['data'].decode('utf-8'))
+                if event['id'] <= current_id:
+                    continue
+                current_id = event['id']
+                yield format_event(event['id'], event['event'], event['data'])
+                if event['event'] in TERMINAL_EVENTS:
+                    return
+            elif time.time() >= keepalive:
+                keepalive = time.time() + KEEPALIVE
+                yield ': keepalive\n\n'
+    except redis.RedisError as e:
+        logger.warning('Lost progress of schema {0} of species '
+                       '{1}: {2}'.format(schema_id, species_id, e))
+    finally:
+        try:
+            pubsub.close()
+        except redis.RedisError:
+            pass
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the status log of schema uploads. The log is
+an append-only file in the temporary directory of each upload with
+one line per state transition of a locus:
+
+- ``locus``: the locus is part of the schema;
+- ``alleles``: the file with the alleles of the locus was received;
+- ``inserted``: the locus was inserted (the value is its URI);
+- ``species``: the locus was linked to the species;
+- ``schema``: the locus was linked to the schema.
+
+The API and the insertion processes append the transitions they
+perform, so an update only writes the loci that changed. Each
+process keeps the status of the uploads it accessed in memory and
+only reads the lines appended since its last access, along with
+counters that answer progress queries without iterating the loci.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import pickle
+import threading
+
+
+STATUS_FILE = '{0}_{1}_status'
+# file with the status of uploads started before the status log
+LEGACY_FILE = '{0}_{1}_hashes'
+
+LOCUS = 'locus'
+ALLELES = 'alleles'
+INSERTED = 'inserted'
+SPECIES = 'species'
+SCHEMA = 'schema'
+
+# marker of uploads whose alleles insertion was started
+PIPELINE = 'upload_pipeline'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def upload_ids(temp_dir):
+    """ Gets the species and schema identifiers of an upload. """
+
+    return os.path.basename(os.path.normpath(temp_dir)).split('_')[:2]
+
+
+def status_file(temp_dir):
+
+    return os.path.join(temp_dir, STATUS_FILE.format(*upload_ids(temp_dir)))
+
+
+def status_lines(entries):
+    """ Creates the log lines for a list of (locus hash, transition,
+        value) tuples.
+    """
+
+    return ''.join(['{0}\t{1}\t{2}\n'.format(h, t, v if v is not None else '')
+                    for h, t, v in entries])
+
+
+def write_lines(path, lines):
+    """ Appends lines to a log with a single write. A line left
+        incomplete by a process that was interrupted is ended
+        before the new lines.
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        if size > 0 and os.pread(fd, 1, size - 1) != b'\n':
+            lines = '\n' + lines
+        os.write(fd, lines.encode('utf-8'))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class UploadStatus(object):
+    """ Status of the loci of a schema upload.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+
+        Attributes
+        ----------
+        loci : dict
+            Loci hashes as keys and lists as values. Each list
+            has two elements: a bool that indicates if the
+            alleles of the locus were received and a sublist
+            with the locus URI (False if the locus was not
+            inserted) and two bool elements that indicate if
+            the locus was linked to the species and to the
+            schema.
+    """
+
+    def __init__(self, temp_dir):
+        self.temp_dir = temp_dir
+        self.path = status_file(temp_dir)
+        self.lock = threading.Lock()
+        self.loci = {}
+        self.reset()
+
+    def reset(self):
+        # cleared in place, callers can keep references to the dict
+        self.loci.clear()
+        self.offset = 0
+        self.inode = None
+        self.received = 0
+        self.incomplete = 0
+        self.inserted = 0
+        self.species_links = 0
+        self.schema_links = 0
+
+    def apply(self, locus, transition, value):
+        """ Applies a transition to the status of a locus. """
+
+        if transition == LOCUS:
+            if locus not in self.loci:
+                self.loci[locus] = [False, [False, False, False]]
+                self.incomplete += 1
+            return
+
+        status = self.loci.get(locus)
+        if status is None:
+            return
+
+        if transition == ALLELES:
+            if status[0] is False:
+                self.received += 1
+            status[0] = True
+            return
+
+        was_complete = False not in status[1]
+        if transition == INSERTED:
+            if status[1][0] is False:
+                self.inserted += 1
+            status[1][0] = value
+        elif transition == SPECIES:
+            if status[1][1] is False:
+                self.species_links += 1
+            status[1][1] = True
+        elif transition == SCHEMA:
+            if status[1][2] is False:
+                self.schema_links += 1
+            status[1][2] = True
+
+        if was_complete is False and False not in status[1]:
+            self.incomplete -= 1
+
+    def refresh(self):
+        """ Reads the lines appended to the log since the last
+            refresh. Incomplete lines are read by the next refresh.
+        """
+
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self.reset()
+                return self
+
+            # the log was created again
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.reset()
+                self.inode = stat.st_ino
+
+            if stat.st_size > self.offset:
+                with open(self.path, 'rb') as infile:
+                    infile.seek(self.offset)
+                    data = infile.read(stat.st_size - self.offset)
+                complete = data.rfind(b'\n') + 1
+                for line in data[:complete].decode('utf-8').splitlines():
+                    fields = line.split('\t')
+                    # skip lines left incomplete by interrupted processes
+                    if len(fields) == 3:
+                        self.apply(*fields)
+                self.offset += complete
+
+        return self
+
+    def record(self, entries):
+        """ Appends transitions to the log.
+
+            Parameters
+            ----------
+            entries : list
+                A list of (locus hash, transition, value) tuples.
+        """
+
+        if len(entries) > 0:
+            write_lines(self.path, status_lines(entries))
+
+        return self.refresh()
+
+    def all_received(self):
+        """ True if the alleles of all loci were received. """
+
+        return self.received == len(self.loci)
+
+    def all_inserted(self):
+        """ True if all loci were inserted and linked to the
+            species and to the schema.
+        """
+
+        return self.incomplete == 0
+
+    def summary(self):
+        """ Counts the loci in each state of the upload. """
+
+        return {'loci': len(self.loci),
+                'received': self.received,
+                'inserted': self.inserted,
+                'species_links': self.species_links,
+                'schema_links': self.schema_links}
+
+    def incomplete_loci(self):
+        """ Gets the status of the loci that were not inserted or
+            linked to the species or to the schema.
+        """
+
+        return {k: v for k, v in self.loci.items() if False in v[1]}
+
+    def claim(self, name):
+        """ Creates a marker in the upload directory if it does not
+            exist. Used to perform an action only once when several
+            processes update the status at the same time.
+
+            Returns
+            -------
+            bool
+                True if the marker was created by this call.
+        """
+
+        try:
+            fd = os.open(os.path.join(self.temp_dir, '{0}_claimed'.format(name)),
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+
+        os.close(fd)
+
+        return True
+
+    def release(self, name):
+        """ Removes a marker created by `claim`. """
+
+        try:
+            os.remove(os.path.join(self.temp_dir, '{0}_claimed'.format(name)))
+        except FileNotFoundError:
+            pass
+
+
+def create(temp_dir, loci_hashes):
+    """ Creates the status log of a new upload.
+
+        Parameters
+        ----------
+        temp_dir : str
+            Path to the temporary directory of the upload.
+        loci_hashes : iter
+            Hashes of the schema loci.
+    """
+
+    path = status_file(temp_dir)
+    temp_path = '{0}.tmp'.format(path)
+    with open(temp_path, 'w') as outfile:
+        outfile.write(status_lines([(h, LOCUS, None) for h in loci_hashes]))
+    os.replace(temp_path, path)
+
+
+def migrate(temp_dir):
+    """ Creates the status log of an upload that was started with
+        the pickled status file. Several processes can migrate the
+        same upload at the same time, only the first log that is
+        created is kept.
+    """
+
+    path = status_file(temp_dir)
+    legacy_file = os.path.join(temp_dir, LEGACY_FILE.format(*upload_ids(temp_dir)))
+    try:
+        with open(legacy_file, 'rb') as hf:
+            loci_hashes = pickle.load(hf)
+    except FileNotFoundError:
+        # another process might have migrated the upload
+        return os.path.isfile(path)
+
+    entries = []
+    for h, v in loci_hashes.items():
+        entries.append((h, LOCUS, None))
+        if v[0] is True:
+            entries.append((h, ALLELES, None))
+        if v[1][0] is not False:
+            entries.append((h, INSERTED, v[1][0]))
+        for transition, done in [(SPECIES, v[1][1]), (SCHEMA, v[1][2])]:
+            if done is True:
+                entries.append((h, transition, None))
+
+    temp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'w') as outfile:
+        outfile.write(status_lines(entries))
+    # the log is not replaced if another process created it
+    # and might have appended transitions to it
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+
+    try:
+        os.remove(legacy_file)
+    except FileNotFoundError:
+        pass
+
+    return True
+
+
+def get_status(temp_dir):
+    """ Gets the status of an upload with the lines appended
+        since the last access.
+
+        Returns
+        -------
+        UploadStatus
+            The status of the upload (None if the upload has
+            no status log).
+    """
+
+    path = status_file(temp_dir)
+    if os.path.isfile(path) is False and migrate(temp_dir) is False:
+        return None
+
+    with _lock:
+        status = _cache.get(path)
+        if status is None:
+            status = _cache[path] = UploadStatus(temp_dir)
+
+    return status.refresh()
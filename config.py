@@ -59,9 +59,29 @@ class Config(object):
 
     URL_SEND_LOCAL_VIRTUOSO = os.environ.get('URL_SEND_LOCAL_VIRTUOSO')
 
+    # load large schemas with Virtuoso's Graph Store endpoint instead
+    # of SPARQL INSERT queries
+    BULK_LOAD = os.environ.get('BULK_LOAD', 'true').lower() == 'true'
+    # Graph Store endpoint (defaults to the endpoint of LOCAL_SPARQL)
+    VIRTUOSO_GRAPH_CRUD = os.environ.get('VIRTUOSO_GRAPH_CRUD')
+    # minimum size (bytes) of the compressed alleles data of a schema
+    # to use bulk loading (smaller schemas use SPARQL INSERT)
+    BULK_LOAD_MIN_SIZE = int(os.environ.get('BULK_LOAD_MIN_SIZE', 20 * 1024 * 1024))
+    # maximum size (bytes, uncompressed) of each N-Triples file
+    BULK_LOAD_FILE_SIZE = int(os.environ.get('BULK_LOAD_FILE_SIZE', 64 * 1024 * 1024))
+
     # CELERY CONFIG
     CELERY_BROKER_URL = 'redis://172.19.1.4:6379/0'
     CELERY_RESULT_BACKEND = 'redis://172.19.1.4:6379/0'
+    # time (seconds) after which Redis delivers unacknowledged tasks
+    # again, must be longer than the longest insertion job
+    CELERY_VISIBILITY_TIMEOUT = int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 48*3600))
+
+    # Redis database that stores service metrics
+    METRICS_REDIS_URL = os.environ.get('METRICS_REDIS_URL') or 'redis://172.19.1.4:6379/1'
+    # interval (seconds) between the writes of the metrics recorded
+    # by each process to Redis
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
 
     # FLASK-RESTPLUS CONFIG
     SWAGGER_UI_JSON_EDITOR = True
@@ -71,11 +91,63 @@ class Config(object):
     SCHEMAS_PTF = './prodigal_training_files'
     SCHEMAS_ZIP = './compressed_schemas'
 
+    # serve compressed schemas and training files with nginx
+    # (X-Accel-Redirect) instead of Flask workers
+    X_ACCEL_REDIRECT = os.environ.get('X_ACCEL_REDIRECT', 'false').lower() == 'true'
+    # nginx internal locations that map to SCHEMAS_ZIP and SCHEMAS_PTF
+    X_ACCEL_SCHEMAS_ZIP = '/internal_redirect/compressed_schemas/'
+    X_ACCEL_SCHEMAS_PTF = '/internal_redirect/prodigal_training_files/'
+
     # pre-computed stats for frontend
     PRE_COMPUTE = './pre-computed-data'
+    # add changed schemas to the queue of the pre-computation daemon
+    # (precompute_engine.py -m daemon) instead of creating the
+    # pre-computed files in the insertion processes
+    PRECOMPUTE_DAEMON = os.environ.get('PRECOMPUTE_DAEMON', 'false').lower() == 'true'
+
+    # local index of sequence hashes (SQLite)
+    SEQUENCE_INDEX = os.environ.get('SEQUENCE_INDEX') or './pre-computed-data/sequence_index.sqlite'
+
+    # maximum number of concurrent requests sent by the insertion
+    # processes (adapted to Virtuoso's latency and errors)
+    INSERT_MAX_CONCURRENCY = int(os.environ.get('INSERT_MAX_CONCURRENCY', 4))
+    # requests that take longer than this (seconds) reduce concurrency
+    INSERT_LATENCY_TARGET = float(os.environ.get('INSERT_LATENCY_TARGET', 10))
+    # maximum size (bytes) of the multi-insert queries that insert alleles
+    MAX_INSERT_QUERY_SIZE = int(os.environ.get('MAX_INSERT_QUERY_SIZE', 500000))
+    # alleles longer than this are inserted with single-insert queries
+    MAX_MULTI_INSERT_LENGTH = int(os.environ.get('MAX_MULTI_INSERT_LENGTH', 4000))
+    # number of processes used by the insertion processes to hash alleles
+    HASH_PROCESSES = int(os.environ.get('HASH_PROCESSES', os.cpu_count() or 1))
+    # loci with fewer alleles are hashed without the process pool
+    HASH_POOL_MIN = int(os.environ.get('HASH_POOL_MIN', 20000))
+    # number of alleles sent to each hashing process at a time
+    HASH_CHUNK_SIZE = int(os.environ.get('HASH_CHUNK_SIZE', 5000))
 
     # schema upload directory
     SCHEMA_UP = './schema_insertion_temp'
 
+    # upload progress events (Server-Sent Events)
+    # maximum duration (seconds) of each progress stream
+    PROGRESS_STREAM_TIMEOUT = int(os.environ.get('PROGRESS_STREAM_TIMEOUT', 30))
+    # time (milliseconds) clients wait before reconnecting to a stream
+    PROGRESS_RETRY = int(os.environ.get('PROGRESS_RETRY', 2000))
+    # time (seconds) the latest progress of a schema is kept
+    PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', 7*24*3600))
+
     # file with hashes of tutorial files
     TUTORIAL_HASHES = 'tutorial_hashes'
+
+    # request profiling (disabled if sample rate is 0 and no header is set)
+    # fraction of requests that are profiled
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    # requests with this header are profiled, at most one per
+    # PROFILE_HEADER_INTERVAL seconds, e.g. 'X-Profile'
+    PROFILE_HEADER = os.environ.get('PROFILE_HEADER')
+    # minimum time (seconds) between requests profiled because of the header
+    PROFILE_HEADER_INTERVAL = float(os.environ.get('PROFILE_HEADER_INTERVAL', 60))
+    # directory for cProfile dumps of profiled requests
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # maximum number of cProfile dumps kept in PROFILE_DIR
+    PROFILE_MAX_DUMPS = int(os.environ.get('PROFILE_MAX_DUMPS', 100))
+    PROFILE_LOG = './log_files/request_profiling.log'
@@ -8,17 +8,17 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
 import logging
 import argparse
-import statistics
 import datetime as dt
-from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import allele_lengths as al
+from app.utils import length_statistics as ls
 from app.utils import sparql_queries
+from app.utils import metrics
 from app.utils import auxiliary_functions as aux
 
 
@@ -59,10 +59,6 @@ def fast_update(schema, last_modified, file, lengths_dir,
     loci_names = {l['locus']['value']: l['name']['value'] for l in loci}
 
     if len(loci_list) == 0:
-        length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-        # sort by locus id
-        length_files = sorted(length_files, key= lambda x: int(x.split('_')[-1]))
-
         loci_list = []
         loci_min = []
         loci_q1 = []
@@ -73,44 +69,19 @@ def fast_update(schema, last_modified, file, lengths_dir,
         loci_sd = []
         alleles_counts = []
 
-        for locus_file in length_files:
-            with open(locus_file, 'rb') as lf:
-                locus_data = pickle.load(lf)
-
-            locus_uri = list(locus_data.keys())[0]
-
-            # get name of locus
-            locus_name = loci_names[locus_uri]
-            loci_list.append(locus_name)
-            alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-            alleles_lengths.sort()
-            nr_alleles = len(alleles_lengths)
-            alleles_counts.append(nr_alleles)
-            # minimum and maximum values
-            loci_min.append(min(alleles_lengths))
-            loci_max.append(max(alleles_lengths))
-            # standard deviation
-            if nr_alleles > 1:
-                locus_sd = statistics.stdev(alleles_lengths)
-            else:
-                locus_sd = 0.0
-            loci_sd.append(locus_sd)
-            # mean
-            locus_mean = round(sum(alleles_lengths)/nr_alleles)
-            loci_mean.append(locus_mean)
-            # median
-            locus_median = round(statistics.median(alleles_lengths))
-            loci_median.append(locus_median)
-            # q1 and q3
-            if nr_alleles > 1:
-                half = int(nr_alleles//2)
-                q1 = statistics.median(alleles_lengths[:half])
-                q3 = statistics.median(alleles_lengths[-half:])
-            else:
-                q1 = alleles_lengths[0]
-                q3 = alleles_lengths[0]
-            loci_q1.append(q1)
-            loci_q3.append(q3)
+        # loci sorted by locus id
+        schema_lengths = al.load(lengths_dir)
+        summaries = ls.loci_summaries(schema_lengths.offsets, schema_lengths.lengths)
+        for locus_uri, locus_stats in zip(schema_lengths.loci, summaries):
+            loci_list.append(loci_names[locus_uri])
+            alleles_counts.append(locus_stats['nr_alleles'])
+            loci_min.append(locus_stats['min'])
+            loci_q1.append(locus_stats['q1'])
+            loci_median.append(locus_stats['median'])
+            loci_q3.append(locus_stats['q3'])
+            loci_max.append(locus_stats['max'])
+            loci_mean.append(locus_stats['mean'])
+            loci_sd.append(locus_stats['sd'])
 
         json_to_file = {'schema': schema,
                         'last_modified': last_modified,
@@ -137,10 +108,6 @@ def fast_update(schema, last_modified, file, lengths_dir,
             logging.info('Information for schema {0} is up-to-date.'.format(schema))
 
         elif json_date != virtuoso_date:
-            length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-            # sort by locus id
-            length_files = sorted(length_files, key= lambda x: int(x.split('_')[-1]))
-
             loci_list = []
             loci_min = []
             loci_q1 = []
@@ -151,43 +118,19 @@ def fast_update(schema, last_modified, file, lengths_dir,
             loci_sd = []
             alleles_counts = []
 
-            for locus_file in length_files:
-                with open(locus_file, 'rb') as f:
-                    locus_data = pickle.load(f)
-
-                locus_uri = list(locus_data.keys())[0]
-                # get name of locus
-                locus_name = loci_names[locus_uri]
-                loci_list.append(locus_name)
-                alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-                alleles_lengths.sort()
-                nr_alleles = len(alleles_lengths)
-                alleles_counts.append(nr_alleles)
-                # minimum and maximum values
-                loci_min.append(min(alleles_lengths))
-                loci_max.append(max(alleles_lengths))
-                # standard deviation
-                if nr_alleles > 1:
-                    locus_sd = statistics.stdev(alleles_lengths)
-                else:
-                    locus_sd = 0.0
-                loci_sd.append(locus_sd)
-                # mean
-                locus_mean = round(sum(alleles_lengths)/nr_alleles)
-                loci_mean.append(locus_mean)
-                # median
-                locus_median = round(statistics.median(alleles_lengths))
-                loci_median.append(locus_median)
-                # q1 and q3
-                if nr_alleles > 1:
-                    half = int(nr_alleles//2)
-                    q1 = statistics.median(alleles_lengths[:half])
-                    q3 = statistics.median(alleles_lengths[-half:])
-                else:
-                    q1 = alleles_lengths[0]
-                    q3 = alleles_lengths[0]
-                loci_q1.append(q1)
-                loci_q3.append(q3)
+            # loci sorted by locus id
+            schema_lengths = al.load(lengths_dir)
+            summaries = ls.loci_summaries(schema_lengths.offsets, schema_lengths.lengths)
+            for locus_uri, locus_stats in zip(schema_lengths.loci, summaries):
+                loci_list.append(loci_names[locus_uri])
+                alleles_counts.append(locus_stats['nr_alleles'])
+                loci_min.append(locus_stats['min'])
+                loci_q1.append(locus_stats['q1'])
+                loci_median.append(locus_stats['median'])
+                loci_q3.append(locus_stats['q3'])
+                loci_max.append(locus_stats['max'])
+                loci_mean.append(locus_stats['mean'])
+                loci_sd.append(locus_stats['sd'])
 
             json_to_file = {'schema': schema,
                             'last_modified': last_modified,
@@ -399,9 +342,10 @@ if __name__ == '__main__':
 
     args = parse_arguments()
 
-    if args[0] == 'global_species':
-        global_species(args[3], args[4], args[5])
-    elif args[0] == 'single_species':
-        single_species(args[1], args[3], args[4], args[5])
-    elif args[0] == 'single_schema':
-        single_schema(args[1], args[2], args[3], args[4], args[5]) 
+    with metrics.job_timer('loci_boxplot'):
+        if args[0] == 'global_species':
+            global_species(args[3], args[4], args[5])
+        elif args[0] == 'single_species':
+            single_species(args[1], args[3], args[4], args[5])
+        elif args[0] == 'single_schema':
+            single_schema(args[1], args[2], args[3], args[4], args[5])
@@ -18,17 +18,17 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
 import logging
 import argparse
-import statistics
 import datetime as dt
-from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import allele_lengths as al
+from app.utils import length_statistics as ls
 from app.utils import sparql_queries
+from app.utils import metrics
 from app.utils import auxiliary_functions as aux
 
 
@@ -94,23 +94,34 @@ def loci_alleles_length(alleles):
 	return loci_data
 
 
-def length_stats(loci_data):
-	"""
+def summary_stats(loci, offsets, lengths):
+	""" Computes the length statistics of all loci with
+	    array operations (loci without alleles are skipped).
 	"""
 
 	stats = [(k,
 		  	  k.split('-')[-1],
-		  	  len(v),
-		  	  Counter(v).most_common()[0][0],
-		  	  round(sum(v)/len(v)),
-		  	  round(statistics.median(v)),
-		  	  min(v),
-		  	  max(v))
-		  	  for k, v in loci_data.items()]
+		  	  s['nr_alleles'],
+		  	  s['mode'],
+		  	  s['mean'],
+		  	  s['median'],
+		  	  s['min'],
+		  	  s['max'])
+		  	  for k, s in zip(loci, ls.loci_summaries(offsets, lengths))
+		  	  if s is not None]
 
 	return stats
 
 
+def length_stats(loci_data):
+	"""
+	"""
+
+	loci, offsets, lengths = ls.from_lists(loci_data)
+
+	return summary_stats(loci, offsets, lengths)
+
+
 def determine_modes(loci_stats):
 	"""
 	"""
@@ -199,28 +210,9 @@ def fast_update(schema, last_modified, file, lengths_dir,
 	loci_names = {l['locus']['value']: l['name']['value'] for l in loci}
 
 	if len(loci_modes) == 0:
-		length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-
-		loci_stats = []
-		for locus_file in length_files:
-			with open(locus_file, 'rb') as lf:
-				locus_data = pickle.load(lf)
-			
-			locus_uri = list(locus_data.keys())[0]
-			locus_name = loci_names[locus_uri]
-			locus_id = locus_name.split('-')[-1]
-			alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-
-			nr_alleles = len(alleles_lengths)
-			locus_mode = Counter(alleles_lengths).most_common()[0][0]
-			locus_mean = round(sum(alleles_lengths)/nr_alleles)
-			locus_median = round(statistics.median(alleles_lengths))
-			locus_min = min(alleles_lengths)
-			locus_max = max(alleles_lengths)
-
-			loci_stats.append((locus_name, locus_id, nr_alleles,
-							   locus_mode, locus_mean, locus_median,
-							   locus_min, locus_max))
+		schema_lengths = al.load(lengths_dir)
+		loci = [loci_names[locus_uri] for locus_uri in schema_lengths.loci]
+		loci_stats = summary_stats(loci, schema_lengths.offsets, schema_lengths.lengths)
 
 		modes = determine_modes(loci_stats)
 		total_alleles = loci_total_alleles(loci_stats)
@@ -245,28 +237,9 @@ def fast_update(schema, last_modified, file, lengths_dir,
 			logging.info('Information about number  for schema {0} is up-to-date.'.format(schema))
 
 		elif json_date != virtuoso_date:
-			length_files = [os.path.join(lengths_dir, f) for f in os.listdir(lengths_dir)]
-
-			loci_stats = []
-			for locus_file in length_files:
-				with open(locus_file, 'rb') as f:
-					locus_data = pickle.load(f)
-				
-				locus_uri = list(locus_data.keys())[0]
-				locus_name = loci_names[locus_uri]
-				locus_id = locus_name.split('-')[-1]
-				alleles_lengths = [v for k, v in locus_data[locus_uri].items()]
-
-				nr_alleles = len(alleles_lengths)
-				locus_mode = Counter(alleles_lengths).most_common()[0][0]
-				locus_mean = round(sum(alleles_lengths)/nr_alleles)
-				locus_median = round(statistics.median(alleles_lengths))
-				locus_min = min(alleles_lengths)
-				locus_max = max(alleles_lengths)
-
-				loci_stats.append((locus_name, locus_id, nr_alleles,
-								   locus_mode, locus_mean, locus_median,
-								   locus_min, locus_max))
+			schema_lengths = al.load(lengths_dir)
+			loci = [loci_names[locus_uri] for locus_uri in schema_lengths.loci]
+			loci_stats = summary_stats(loci, schema_lengths.offsets, schema_lengths.lengths)
 
 			modes = determine_modes(loci_stats)
 			total_alleles = loci_total_alleles(loci_stats)
@@ -512,11 +485,12 @@ if __name__ == '__main__':
 
 	args = parse_arguments()
 
-	if args[0] == 'global_species':
-		global_species(args[3], args[4], args[5])
-	elif args[0] == 'single_species':
-		single_species(args[1], args[3], args[4],
-			           args[5])
-	elif args[0] == 'single_schema':
-		single_schema(args[1], args[2], args[3],
-			          args[4], args[5])
+	with metrics.job_timer('loci_mode'):
+		if args[0] == 'global_species':
+			global_species(args[3], args[4], args[5])
+		elif args[0] == 'single_species':
+			single_species(args[1], args[3], args[4],
+				           args[5])
+		elif args[0] == 'single_schema':
+			single_schema(args[1], args[2], args[3],
+				          args[4], args[5])
@@ -18,7 +18,6 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
 import logging
 import argparse
@@ -26,7 +25,9 @@ import datetime as dt
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import allele_lengths as al
 from app.utils import sparql_queries
+from app.utils import metrics
 from app.utils import auxiliary_functions as aux
 
 
@@ -72,15 +73,9 @@ def fast_update(schema, last_modified, file, lengths_dir):
 			logging.info('Information about number of loci and number of alleles for schema {0} is up-to-date.'.format(schema))
 
 		elif json_date != virtuoso_date:
-			length_files = [os.path.join(lengths_dir, file) for file in os.listdir(lengths_dir)]
-
 			loci_data = []
-			for file in length_files:
-				with open(file, 'rb') as f:
-					locus_data = pickle.load(f)
-				
-				locus_uri = list(locus_data.keys())[0]
-				loci_data.append({'locus': locus_uri, 'nr_alleles': len(locus_data[locus_uri])})
+			for locus_uri, alleles in al.iter_loci(lengths_dir):
+				loci_data.append({'locus': locus_uri, 'nr_alleles': len(alleles)})
 
 			proc_data = {'schema': schema,
 					 	 'last_modified': virtuoso_date,
@@ -94,15 +89,9 @@ def fast_update(schema, last_modified, file, lengths_dir):
 
 	# new schema that is not in the json file
 	elif schema_id not in schemas_indexes:
-		length_files = [os.path.join(lengths_dir, file) for file in os.listdir(lengths_dir)]
-
 		loci_data = []
-		for file in length_files:
-			with open(file, 'rb') as f:
-				locus_data = pickle.load(f)
-			
-			locus_uri = list(locus_data.keys())[0]
-			loci_data.append({'locus': locus_uri, 'nr_alleles': len(locus_data[locus_uri])})
+		for locus_uri, alleles in al.iter_loci(lengths_dir):
+			loci_data.append({'locus': locus_uri, 'nr_alleles': len(alleles)})
 
 		proc_data = {'schema': schema,
 					 'last_modified': last_modified,
@@ -355,11 +344,12 @@ if __name__ == '__main__':
 
 	args = parse_arguments()
 
-	if args[0] == 'global_species':
-		global_species(args[3], args[4], args[5])
-	elif args[0] == 'single_species':
-		single_species(args[1], args[3], args[4],
-			           args[5])
-	elif args[0] == 'single_schema':
-		single_schema(args[1], args[2], args[3],
-			          args[4], args[5])
+	with metrics.job_timer('loci_totals'):
+		if args[0] == 'global_species':
+			global_species(args[3], args[4], args[5])
+		elif args[0] == 'single_species':
+			single_species(args[1], args[3], args[4],
+				           args[5])
+		elif args[0] == 'single_schema':
+			single_schema(args[1], args[2], args[3],
+				          args[4], args[5])
@@ -13,6 +13,11 @@ from celery import Celery
 from celery.schedules import crontab
 
 import rm_functions as rf
+from SPARQLWrapper import SPARQLWrapper
+
+from app.utils import ns_counters
+from app.utils import sparql_queries as sq
+from app.utils import auxiliary_functions as aux
 
 
 app = Celery('periodic', broker=os.environ.get('CELERY_BROKER_URL'),
@@ -45,10 +50,42 @@ def periodic_remover():
 		                         os.environ.get('VIRTUOSO_PASS'))
 
 
+@app.task(queue='periodic_queue')
+def periodic_sequence_index():
+	"""
+	"""
+
+	result = subprocess.check_output(['python',
+		'sequence_index_builder.py',
+		'--g', os.environ.get('DEFAULTHGRAPH'),
+		'--s', os.environ.get('LOCAL_SPARQL')])
+
+
+@app.task(queue='periodic_queue')
+def periodic_counters():
+	""" Replaces the materialized counts with the values
+		counted by Virtuoso.
+	"""
+
+	result = aux.get_data(SPARQLWrapper(os.environ.get('LOCAL_SPARQL')),
+						  sq.NS_STATS.format(os.environ.get('DEFAULTHGRAPH')))
+	stats = result['results']['bindings']
+	if len(stats) > 0:
+		ns_counters.reconcile(ns_counters.from_bindings(stats))
+
+
 # add periodic tasks to the beat schedule
 app.conf.beat_schedule = {
     "remover-task": {
     	"task": "periodic_jobs.periodic_remover",
     	"schedule": crontab(minute=0, hour='*')
+    },
+    "counters-task": {
+    	"task": "periodic_jobs.periodic_counters",
+    	"schedule": crontab(minute=15, hour='*')
+    },
+    "sequence-index-task": {
+    	"task": "periodic_jobs.periodic_sequence_index",
+    	"schedule": crontab(minute=30, hour=3)
     }
 }
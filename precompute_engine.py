@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+
+This module is used by the Chewie-NS to create the pre-computed
+files with the statistics displayed by the frontend. All files of
+a schema are created in a single pass over the schema data (see
+app/utils/precompute.py).
+
+It has two execution modes: single and daemon. The former creates
+the files of a single schema and the latter runs continuously and
+creates the files of the schemas added to the pre-computation
+queue by the processes that insert and synchronize schemas.
+
+Expected input
+--------------
+
+It is necessary to specify the execution mode through the
+following argument:
+
+- ``-m``, ``mode`` :
+
+    - e.g.: ``single`` or ``daemon``
+
+The ``single`` mode also receives the identifier of a species
+and the identifier of a schema for that species:
+
+- ``--sp``, ``species_id`` :
+
+    - e.g.: ``1``
+
+- ``--sc``, ``schema_id`` :
+
+    - e.g.: ``4``
+
+Code documentation
+------------------
+"""
+
+
+import os
+import time
+import logging
+import argparse
+
+import redis
+
+from app.utils import metrics
+from app.utils import precompute
+
+
+logfile = './log_files/precompute_engine.log'
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%dT%H:%M:%S',
+                    filename=logfile)
+
+
+def single_schema(species_id, schema_id, virtuoso_graph, local_sparql, base_url):
+    """ Creates the pre-computed files of a schema.
+
+        Parameters
+        ----------
+        species_id : str
+            Identifier of the species in the Chewie-NS.
+        schema_id : str
+            Identifier of the schema in the Chewie-NS.
+        virtuoso_graph : str
+            URI of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        base_url : str
+            Base URL of the Chewie-NS.
+    """
+
+    start = time.time()
+    with metrics.job_timer('precompute'):
+        updated = precompute.update_schema(species_id, schema_id, virtuoso_graph,
+                                           local_sparql, base_url)
+
+    logging.info('Processed schema {0} of species {1} in {2:.1f}s '
+                 '(updated: {3}).'.format(schema_id, species_id,
+                                          time.time() - start,
+                                          ', '.join(updated) or 'none'))
+
+
+def daemon(virtuoso_graph, local_sparql, base_url):
+    """ Creates the pre-computed files of the schemas added to
+        the pre-computation queue.
+
+        Parameters
+        ----------
+        virtuoso_graph : str
+            URI of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        base_url : str
+            Base URL of the Chewie-NS.
+    """
+
+    logging.info('Started pre-computation daemon.')
+    client = precompute.get_client()
+    while True:
+        try:
+            schema = precompute.next_schema(client)
+        except redis.RedisError as e:
+            logging.warning('Could not get schema from queue: {0}'.format(e))
+            time.sleep(10)
+            continue
+
+        if schema is None:
+            continue
+
+        species_id, schema_id = schema
+        try:
+            single_schema(species_id, schema_id, virtuoso_graph,
+                          local_sparql, base_url)
+        except Exception as e:
+            logging.exception('Could not process schema {0} of species '
+                              '{1}: {2}'.format(schema_id, species_id, e))
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-m', type=str,
+                        dest='mode', required=True,
+                        choices=['single', 'daemon'],
+                        help='Execution mode. The "single" mode '
+                             'creates the pre-computed files of a '
+                             'single schema and the "daemon" mode '
+                             'creates the files of the schemas in '
+                             'the pre-computation queue.')
+
+    parser.add_argument('--sp', type=str, default=None,
+                        dest='species_id', required=False,
+                        help='The identifier of the species in the '
+                             'Chewie-NS (only relevant for the "single" '
+                             'mode).')
+
+    parser.add_argument('--sc', type=str, default=None,
+                        dest='schema_id', required=False,
+                        help='The identifier of the schema in the '
+                             'Chewie-NS (only relevant for the "single" '
+                             'mode).')
+
+    parser.add_argument('--g', type=str,
+                        dest='virtuoso_graph',
+                        default=os.environ.get('DEFAULTHGRAPH'),
+                        help='')
+
+    parser.add_argument('--s', type=str,
+                        dest='local_sparql',
+                        default=os.environ.get('LOCAL_SPARQL'),
+                        help='')
+
+    parser.add_argument('--b', type=str,
+                        dest='base_url',
+                        default=os.environ.get('BASE_URL'),
+                        help='')
+
+    args = parser.parse_args()
+
+    return [args.mode, args.species_id, args.schema_id,
+            args.virtuoso_graph, args.local_sparql,
+            args.base_url]
+
+
+if __name__ == '__main__':
+
+    args = parse_arguments()
+
+    if args[0] == 'single':
+        single_schema(args[1], args[2], args[3],
+                      args[4], args[5])
+    elif args[0] == 'daemon':
+        daemon(args[3], args[4], args[5])
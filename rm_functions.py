@@ -35,7 +35,9 @@ import datetime as dt
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import ns_counters
 from app.utils import sparql_queries as sq
+from app.utils import sequence_index as si
 from app.utils import auxiliary_functions as aux
 from app.utils import PrepExternalSchema
 
@@ -224,6 +226,10 @@ def collapse_loci(loci_uris, virtuoso_graph, local_sparql,
 		           'triples).'.format(deleted, total_alleles, triples))
 	log_results(stdout_text, stderr, noeffect)
 
+	# remove alleles from the local sequence index
+	failed = [u for v in stderr.values() for u in v]
+	si.remove_loci([u[0].split('/')[-1] for u in loci_uris if u not in failed])
+
 	# delete all loci
 	print('Deleting loci...')
 	deleted, stderr, noeffect, triples = \
@@ -232,6 +238,7 @@ def collapse_loci(loci_uris, virtuoso_graph, local_sparql,
 
 	deleted_triples += triples
 	total_loci = int(triples/8)
+	deleted_loci = deleted
 	stdout_text = ('Deleted {0} loci ({1} triples).'
 		           ''.format(deleted, triples))
 	log_results(stdout_text, stderr, noeffect)
@@ -258,6 +265,8 @@ def collapse_loci(loci_uris, virtuoso_graph, local_sparql,
 	stdout_text = 'Deleted {0} links to schema ({1} triples).'.format(deleted, triples)
 	log_results(stdout_text, stderr, noeffect)
 
+	ns_counters.increment({'alleles': -total_alleles, 'loci': -deleted_loci})
+
 	return [deleted_triples, total_alleles, total_loci, total_splinks, total_sclinks]
 
 
@@ -383,6 +392,7 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 	if status_code in [200, 201]:
 		if schema_triples > 0:
 			schema_del = 1
+			ns_counters.increment({'schemas': -1})
 			print('Deleted {0}'.format(schema_uri))
 			logging.info('Deleted {0}'.format(schema_uri))
 			total_triples += schema_triples
@@ -506,6 +516,16 @@ def rm_alleles(identifier, locus_id, virtuoso_graph, local_sparql,
 	total_alleles = triples/8
 	stdout_text = 'Deleted {0} alleles ({1} triples).'.format(deleted, triples)
 	log_results(stdout_text, stderr, noeffect)
+	ns_counters.increment({'alleles': -int(total_alleles)})
+
+	# remove alleles from the local sequence index
+	failed = [u for v in stderr.values() for u in v]
+	removed = {}
+	for u in uris:
+		if u not in failed:
+			removed.setdefault(u[1].split('/')[-1], []).append(u[0].split('/')[-1])
+	for locus_id, allele_ids in removed.items():
+		si.remove_alleles(locus_id, allele_ids)
 
 	return_dict = {'alleles': total_alleles,
 				   'total_triples': triples}
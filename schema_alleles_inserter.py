@@ -12,6 +12,11 @@ create the first compressed version of the schema, generate
 the pre-computed files for the Frontend and unlock the schema
 to make it fully available.
 
+Alleles of large schemas (BULK_LOAD_MIN_SIZE) are written to
+N-Triples files that are loaded with Virtuoso's Graph Store
+endpoint. Smaller schemas, and loci that could not be loaded,
+are inserted with SPARQL INSERT queries.
+
 Expected input
 --------------
 
@@ -31,23 +36,31 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
-import zipfile
-import hashlib
 import logging
 import argparse
 import requests
 import threading
 import statistics
 import datetime as dt
-import concurrent.futures
-from itertools import repeat
 from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import ns_counters
+from app.utils import sync_lock
+from app.utils import precompute
+from app.utils import insertion_journal as ij
+from app.utils import bulk_loader
+from app.utils import query_stream
+from app.utils import insert_queries as iq
+from app.utils import adaptive_concurrency as ac
 from app.utils import sparql_queries as sq
+from app.utils import sequence_index as si
+from app.utils import upload_data as ud
+from app.utils import upload_status as us
+from app.utils import upload_progress as up
+from app.utils import sequence_hashing as seqhash
 from app.utils import auxiliary_functions as aux
 
 
@@ -57,8 +70,6 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%Y-%m-%dT%H:%M:%S',
                     filename=logfile)
 
-sync_lock = './schema_insertion_temp/sync_lock'
-
 thread_local = threading.local()
 
 
@@ -156,119 +167,17 @@ def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user,
             return True
 
 
-def create_single_insert(alleles, species, locus_uri, user_uri, base_url, virtuoso_graph):
-	""" Creates SPARQL queries that allow the insertion of a single allele.
+def locus_queries(post_files, base_url, virtuoso_graph, index_records, journal):
+	""" Creates SPARQL queries to insert alleles, one locus
+	    at a time, while the queries are sent. Batches that
+	    were inserted by a previous run are skipped.
 
 		Parameters
 		----------
-		alleles : tup
-		    A tuple with alleles DNA sequences.
-		species : str
-            Scientific name of the species the alleles
-            were identified in.
-        locus_uri : str
-            URI of the locus in the Chewie-NS.
-        user_uri : str
-            URI of the user that sent the data to the Chewie-NS.
-
-		Returns
-		-------
-		queries : list
-		    A list with two elements: the locus URI and
-		    a sublist with the single-insert queries to
-		    insert alleles.
-	"""
-
-	queries = [locus_uri, []]
-	allele_id = 1
-	for a in alleles:
-		sequence = a
-		# determine sequence hash
-		sequence_hash = hashlib.sha256(sequence.encode('utf-8')).hexdigest()
-		seq_uri = '{0}sequences/{1}'.format(base_url, sequence_hash)
-
-		allele_uri = '{0}/alleles/{1}'.format(locus_uri, allele_id)
-
-		insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
-
-		query = (sq.INSERT_ALLELE_NEW_SEQUENCE.format(virtuoso_graph, seq_uri,
-													  sequence, allele_uri,
-													  species, user_uri,
-													  locus_uri, insert_date,
-													  allele_id))
-		queries[1].append(query)
-
-		allele_id += 1
-
-	return queries
-
-
-def create_multiple_insert(alleles, species, locus_uri, user_uri, base_url, virtuoso_graph):
-	""" Creates SPARQL queries that alow the insertion of multiple alleles.
-
-        Parameters
-        ----------
-        alleles : tup
-		    A tuple with alleles DNA sequences.
-        species : str
-			Scientific name of the species the alleles
-            were identified in.
-        locus_uri : str
-			URI of the locus in the Chewie-NS.
-        user_uri : str
-			URI of the user that sent the data to the Chewie-NS.
-
-        Returns
-        -------
-        queries : list
-			A list with two elements: the locus URI and
-		    a sublist with the multi-insert queries to
-		    insert alleles.
-	"""
-
-	queries = [locus_uri, []]
-	allele_id = 1
-	allele_set = []
-	max_alleles = 100
-	for i, a in enumerate(alleles):
-		sequence = a
-		# determine hash
-		sequence_hash = hashlib.sha256(sequence.encode('utf-8')).hexdigest()
-		seq_uri = '{0}sequences/{1}'.format(base_url, sequence_hash)
-
-		allele_uri = '{0}/alleles/{1}'.format(locus_uri, allele_id)
-
-		insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
-
-		allele_set.append('({0} {1} {2} {3}'
-						  ' {4} {5} {6} {7})'.format('<{0}>'.format(seq_uri),
-													 '"{0}"^^xsd:string'.format(sequence),
-													 '<{0}>'.format(allele_uri),
-													 '"{0}"^^xsd:string'.format(species),
-													 '<{0}>'.format(user_uri),
-													 '<{0}>'.format(locus_uri),
-													 '"{0}"^^xsd:dateTime'.format(insert_date),
-													 '"{0}"^^xsd:integer'.format(allele_id)))
-
-		if len(allele_set) == max_alleles or i == (len(alleles)-1):
-			query = (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)))
-			queries[1].append(query)
-			allele_set = []
-
-		allele_id += 1
-
-	return queries
-
-
-def create_queries(locus_file, base_url, virtuoso_graph):
-	""" Creates SPARQL queries to insert alleles.
-
-		Parameters
-		----------
-		locus_file : str
-		    Path to the file with the data necessary
-		    to create the SPARQL queries. The file is
-		    a pickled file with a list that contains the
+		post_files : list
+		    Paths to the ZIP archives with the data necessary
+		    to create the SPARQL queries. The data of each
+		    archive is read as a list that contains the
 		    following elements:
 
 		    - The locus URI in the Chewie-NS.
@@ -278,40 +187,41 @@ def create_queries(locus_file, base_url, virtuoso_graph):
 		      the Chewie-NS.
 		    - A tuple with the alleles that belong to the
 		      locus.
-
-		Returns
-		-------
-		queries_file : str
-		    Path to the file with the queries that were
-		    created to insert the alleles into the Chewie-NS.
+		    - Optionally, a list with the hashes of the
+		      alleles (verified before they are used).
+		index_records : dict
+		    Receives the locus URIs as keys and the sequence
+		    index records of the alleles of each locus as
+		    values.
+		journal : Journal
+		    Progress journal of the upload.
+
+		Yields
+		------
+		tup
+		    The locus URI and a tuple with the batch key, a
+		    query to insert alleles of that locus and the
+		    sequence index records of the alleles in the query.
 	"""
 
-	with open(locus_file, 'rb') as f:
-		locus_data = pickle.load(f)
-
-	locus_url = locus_data[0]
-	spec_name = locus_data[1]
-	user_url = locus_data[2]
-	alleles = locus_data[3]
-	# compute mean length
-	max_length = max([len(a) for a in alleles])
-
-	# multi-insert queries that contain alleles with more than ~8000 bps
-	# might not be inserted
-	if max_length < 4000:
-		queries = create_multiple_insert(alleles, spec_name,
-									   	 locus_url, user_url,
-									   	 base_url, virtuoso_graph)
-	else:
-		queries = create_single_insert(alleles, spec_name,
-									   locus_url, user_url,
-									   base_url, virtuoso_graph)
-
-	queries_file = '{0}_queries'.format(locus_file.split('alleles')[0])
-	with open(queries_file, 'wb') as qf:
-		pickle.dump(queries, qf)
-
-	return queries_file
+	for file in post_files:
+		locus_data = read_locus(file)
+		locus_url, spec_name, user_url, alleles = locus_data[:4]
+		hashes = seqhash.locus_hashes(locus_data)
+		records = si.allele_records(locus_url, alleles, hashes=hashes)
+		index_records[locus_url] = records
+		if ij.locus_key(locus_url) in journal:
+			continue
+
+		# batches are the same in every run, alleles
+		# identifiers only depend on the order of the alleles
+		queries = iq.multiple_insert(alleles, hashes, spec_name,
+									 locus_url, user_url, 1,
+									 base_url, virtuoso_graph)
+		for i, (query, allele_ids) in enumerate(queries):
+			key = ij.batch_key(locus_url, i)
+			if key not in journal:
+				yield (locus_url, (key, query, [records[a-1] for a in allele_ids]))
 
 
 def get_session():
@@ -337,113 +247,216 @@ def get_session():
     return thread_local.session
 
 
-def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
-	""" Sends POST requests to insert alleles of a locus
-	    into the Chewie-NS.
+def index_alleles(records):
+	""" Adds alleles that were inserted into Virtuoso to the
+	    local sequence index and changes the NS counts.
+
+		Parameters
+		----------
+		records : list
+		    Sequence index records of the alleles.
+	"""
+
+	new_seqs = si.add_alleles(records)
+	ns_counters.alleles_added(records, new_seqs)
+
+
+def post_query(locus, batch, local_sparql, virtuoso_user, virtuoso_pass,
+			   controller, journal):
+	""" Sends a POST request to insert alleles of a locus
+	    into the Chewie-NS. If the alleles are inserted they
+	    are added to the sequence index and the batch is
+	    recorded in the journal.
 
         Parameters
         ----------
-        input_file : str
-            Path to a pickled file with SPARQL queries to
-            insert alleles into the Chewie-NS.
+        locus : str
+            URI of the locus.
+        batch : tup
+            The batch key, the SPARQL query to insert
+            alleles into the Chewie-NS and the sequence
+            index records of the alleles.
+        controller : AIMDController
+            Limits the number of concurrent requests sent
+            to Virtuoso.
+        journal : Journal
+            Progress journal of the upload.
 
         Returns
         -------
-        responses : list
-		    A list with the response objects for all queries
-		    that were sent to Virtuoso's SPARQL endpoint in
-		    order to insert alleles.
+        status_code : int
+		    Status code of the last response received from
+		    Virtuoso's SPARQL endpoint.
     """
 
-	with open(input_file, 'rb') as f:
-		locus_data = pickle.load(f)
-		locus = locus_data[0]
-		queries = locus_data[1]
-
-	responses = [locus, []]
+	key, query, records = batch
 	session = get_session()
 	headers = {'content-type': 'application/sparql-query'}
-	for q in queries:
-		tries = 0
-		max_tries = 5
-		max_wait = 5
-		valid = False
-		while valid is False and tries < max_tries:
-			# check if there is a Sync process
-			while os.path.isfile(sync_lock) is True:
-				time.sleep(5)
-			# insert alleles
-			with session.post(local_sparql, data=q, headers=headers,
-				              auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass)) as response:
-				status_code = response.status_code
-				if status_code > 201:
-					tries += 1
-					logging.warning('Could not insert query for locus {0}'
-						            '\nResponse:\n{1}\n'.format(locus, response.text))
-					# wait some time, a 404 error can occur when Virtuoso
-					# performs checkpoint() and waiting coupled with retries
-					# will help resume POST after checkpoint ends
-					time.sleep(max_wait)
-					max_wait += max_wait
-				else:
-					valid = True
-		responses[1].append(response)
-		if status_code > 201:
-			logging.warning('Could not execute query for locus {0}'
-				            '\nQuery:\n{1}\n'.format(locus, q))
+	tries = 0
+	max_tries = 5
+	max_wait = 5
+	valid = False
+	while valid is False and tries < max_tries:
+		# wait for a concurrency slot before waiting while a Sync
+		# process inserts data, the lock is only held during the request
+		with controller.request() as slot:
+			with sync_lock.insertion():
+				# the time waiting for the lock is not latency
+				slot.restart()
+				response = session.post(local_sparql, data=query, headers=headers,
+										auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass))
+			status_code = response.status_code
+			slot.ok = status_code <= 201
+			slot.size = len(query)
+			if status_code > 201:
+				tries += 1
+				logging.warning('Could not insert query for locus {0}'
+					            '\nResponse:\n{1}\n'.format(locus, response.text))
+			else:
+				valid = True
+
+		if valid is False:
+			# wait some time, a 404 error can occur when Virtuoso
+			# performs checkpoint() and waiting coupled with retries
+			# will help resume POST after checkpoint ends
+			time.sleep(max_wait)
+			max_wait += max_wait
+
+	if status_code > 201:
+		logging.warning('Could not execute query for locus {0}'
+			            '\nQuery:\n{1}\n'.format(locus, query))
+	else:
+		# the index answers existence checks while the upload
+		# runs, alleles are indexed before the batch is recorded
+		# so that batches skipped by a new run are indexed
+		index_alleles(records)
+		journal.record(key)
 
-	return responses
+	return status_code
 
 
-def send_alleles(post_files, local_sparql, virtuoso_user, virtuoso_pass):
+def send_alleles(queries, local_sparql, virtuoso_user, virtuoso_pass, journal):
 	""" Sends POST requests to insert alleles of a set of loci.
 
 		Parameters
 		----------
-		post_files : list
-		    A list with paths to pickled files with SPARQL
-		    queries.
+		queries : iter
+		    Iterable that yields tuples with a locus URI
+		    and a tuple with a batch key and a query to
+		    insert alleles of that locus.
+		journal : Journal
+		    Progress journal of the upload.
 
 		Return
 		------
 		responses : dict
-		    A dictionary with loci 
+		    A dictionary with loci URIs as keys and lists
+		    with the status codes of the responses as values
+		    (None for requests that could not be sent).
 	"""
 
-	responses = {}
-	total = 0
-	with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-		for res in executor.map(post_alleles, post_files, repeat(local_sparql), repeat(virtuoso_user), repeat(virtuoso_pass)):
-			responses[res[0]] = res[1]
-			total += 1
+	controller = ac.get_controller()
+	responses = query_stream.stream(queries, post_query, controller.max_limit,
+									args=(local_sparql, virtuoso_user,
+										  virtuoso_pass, controller, journal))
+
+	logging.info('Sent alleles of {0} loci: {1}'.format(len(responses), controller.summary()))
 
 	return responses
 
 
-def unzip(zip_file, dest_dir):
-	""" Unzips a ZIP archive.
+def bulk_insert(post_files, base_url, virtuoso_graph, local_sparql, temp_dir,
+				virtuoso_user, virtuoso_pass, index_records, journal):
+	""" Inserts alleles by loading N-Triples files with
+	    Virtuoso's Graph Store endpoint.
 
 		Parameters
 		----------
-		zip_file : str
-		    Path to the ZIP archive to be
-		    extracted.
-		dest_dir : str
-		    Path to where ZIP contents will
-		    be extracted.
+		post_files : list
+		    Paths to the ZIP archives with the data of
+		    each locus.
+		temp_dir : str
+		    Path to the directory where the N-Triples
+		    files are created.
+		index_records : dict
+		    Receives the locus URIs as keys and the sequence
+		    index records of the alleles of each locus as
+		    values.
+		journal : Journal
+		    Progress journal of the upload (loci that were
+		    inserted by a previous run are skipped).
 
 		Returns
 		-------
-		locus_file : str
-		    Path to extracted file.
+		list
+		    A list with two elements: the URIs of the loci
+		    that were inserted and the paths to the ZIP
+		    archives of the loci that could not be inserted.
 	"""
 
-	with zipfile.ZipFile(zip_file) as zf:
-		zipinfo = zf.infolist()
-		locus_file = zipinfo[0].filename
-		zf.extractall(dest_dir)
+	inserted = []
+	writer = bulk_loader.TriplesWriter(temp_dir)
+	for file in post_files:
+		locus_data = read_locus(file)
+		locus_url, spec_name, user_url, alleles = locus_data[:4]
+		records = si.allele_records(locus_url, alleles,
+									hashes=seqhash.locus_hashes(locus_data))
+		index_records[locus_url] = records
+		if ij.locus_key(locus_url) in journal:
+			inserted.append(locus_url)
+			continue
+
+		writer.start_group((file, locus_url))
+		for record, sequence in zip(records, alleles):
+			seq_uri = '{0}sequences/{1}'.format(base_url, record[0])
+			allele_uri = '{0}/alleles/{1}'.format(locus_url, record[2])
+			insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
+			writer.write(bulk_loader.allele_triples(seq_uri, sequence, allele_uri,
+													spec_name, user_url, locus_url,
+													insert_date, record[2]))
+	bulk_files = writer.close()
+
+	graph_store = bulk_loader.graph_store_url(local_sparql)
+	failed = []
+	for path, loci in bulk_files:
+		# wait while a Sync process inserts data
+		with sync_lock.insertion():
+			loaded = bulk_loader.load_file(path, graph_store, virtuoso_graph,
+										   virtuoso_user, virtuoso_pass)
+		if loaded is True:
+			for l in loci:
+				index_alleles(index_records[l[1]])
+				journal.record(ij.locus_key(l[1]))
+				inserted.append(l[1])
+		else:
+			failed.extend([l[0] for l in loci])
+		os.remove(path)
+
+	logging.info('Loaded {0} files with alleles of {1} loci. Could not '
+				 'load alleles of {2} loci.'.format(len(bulk_files),
+													len(inserted),
+													len(failed)))
+
+	return [inserted, failed]
+
+
+def read_locus(zip_file):
+	""" Reads the locus data in a ZIP archive without
+	    extracting it. All alleles of the locus are loaded,
+	    they are hashed and inserted as a whole.
+
+		Parameters
+		----------
+		zip_file : str
+		    Path to the ZIP archive.
+
+		Returns
+		-------
+		locus_data : list
+		    The data in the archive (see upload_data.read_archive).
+	"""
 
-	return locus_file
+	return ud.read_archive(zip_file)
 
 
 def parse_arguments():
@@ -484,14 +497,23 @@ def parse_arguments():
                         default=os.environ.get('VIRTUOSO_PASS'),
                         help='')
 
+    parser.add_argument('--pipeline', action='store_true',
+                        dest='pipeline',
+                        help='Only insert the alleles. Schema '
+                             'compression, creation of the '
+                             'pre-computed files and removal of '
+                             'the temporary directory are performed '
+                             'by the tasks of the upload pipeline.')
+
     args = parser.parse_args()
 
     return [args.input_dir, args.virtuoso_graph,
             args.local_sparql, args.base_url,
-            args.virtuoso_user, args.virtuoso_pass]
+            args.virtuoso_user, args.virtuoso_pass,
+            args.pipeline]
 
 
-def main(temp_dir, graph, sparql, base_url, user, password):
+def main(temp_dir, graph, sparql, base_url, user, password, pipeline=False):
 
 	start = time.time()
 
@@ -504,35 +526,74 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 
 	logging.info('Started alleles insertion for schema {0}'.format(schema_uri))
 
+	# a job delivered again while this upload is being inserted exits
+	upload_lock = ij.lock_upload(temp_dir)
+	if upload_lock is None:
+		logging.warning('Alleles of schema {0} are already being '
+						'inserted.\n\n'.format(schema_uri))
+		sys.exit(ij.ALREADY_RUNNING)
+
 	# schemas hashes are the filenames
-	schema_file = os.path.join(temp_dir, '{0}_{1}_hashes'.format(species_id, schema_id))
-	with open(schema_file, 'rb') as sh:
-		schema_vals = pickle.load(sh)
-		schema_hashes = schema_vals.keys()
+	upload_status = us.get_status(temp_dir)
+	if upload_status is None:
+		logging.warning('Could not find schema upload status file.\n\n')
+		sys.exit(1)
+
+	schema_hashes = list(upload_status.loci.keys())
 
 	post_files = [os.path.join(temp_dir, file) for file in schema_hashes]
 	if all([os.path.isfile(file) for file in post_files]) is False:
 		logging.warning('Missing files with data for alleles insertion.\n\n')
+		up.publish(species_id, schema_id, up.FAILED,
+				   {'message': 'Missing files with data for alleles insertion.'})
 		sys.exit(1)
 
-	# extract files
-	schema_files = []
-	dest_dir = os.path.dirname(post_files[0])
-	for file in post_files:
-		locus_file = unzip(file, dest_dir)
-		locus_file = os.path.join(temp_dir, locus_file)
-		schema_files.append(locus_file)
-
-	# create SPARQL multiple INSERT queries
-	queries_files = []
-	with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-		for res in executor.map(create_queries, schema_files, repeat(base_url), repeat(graph)):
-			queries_files.append(res)
+	up.publish(species_id, schema_id, 'alleles', {'loci': len(post_files),
+												  'inserted_loci': 0})
 
 	start = time.time()
-	# insert data
-	# sort reponses to include summary in log file
-	post_results = send_alleles(queries_files, sparql, user, password)
+	# hash large loci in parallel (started before any threads)
+	seqhash.start_pool()
+
+	# batches inserted by previous runs of this upload are skipped
+	journal = ij.Journal(temp_dir)
+	if len(journal) > 0:
+		logging.info('Resuming insertion, {0} entries in journal.'.format(len(journal)))
+
+	inserted = []
+	loci_records = {}
+	# load large schemas with the Graph Store endpoint
+	schema_size = sum([os.path.getsize(file) for file in post_files])
+	if Config.BULK_LOAD is True and schema_size >= Config.BULK_LOAD_MIN_SIZE:
+		inserted, post_files = bulk_insert(post_files, base_url, graph,
+										   sparql, temp_dir, user,
+										   password, loci_records, journal)
+
+	# create SPARQL multiple INSERT queries for each locus
+	# and insert data while the queries are created
+	# (loci that could not be loaded are inserted again)
+	if len(post_files) > 0:
+		bulk_loci = set(inserted)
+		queries = locus_queries(post_files, base_url, graph, loci_records, journal)
+		post_results = send_alleles(queries, sparql, user, password, journal)
+		# loci without results were inserted by a previous run
+		for locus in loci_records:
+			responses = post_results.get(locus, [])
+			if locus not in bulk_loci and all([r is not None and r <= 201 for r in responses]):
+				inserted.append(locus)
+
+	journal.close()
+	seqhash.close_pool()
+
+	up.publish(species_id, schema_id, 'alleles', {'loci': len(loci_records),
+												  'inserted_loci': len(inserted)})
+
+	# a new run inserts the batches that could not be inserted
+	if len(inserted) < len(loci_records):
+		logging.warning('Could not insert alleles of {0} loci of schema '
+						'{1}.\n\n'.format(len(loci_records) - len(inserted),
+										  schema_uri))
+		sys.exit(1)
 
 	end = time.time()
 	delta = end - start
@@ -545,6 +606,12 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 	modification_res = change_date(schema_uri, 'last_modified', insert_date,
 		                           graph, sparql, user, password)
 
+	# the upload pipeline compresses the schema and creates the
+	# pre-computed files in parallel before unlocking the schema
+	if pipeline is True:
+		logging.info('Finished alleles insertion for schema {0}\n\n'.format(schema_uri))
+		return
+
 	# after inserting create compressed version
 	os.system('python schema_compressor.py -m single '
 		      '--sp {0} --sc {1} --g {2} --s {3} '
@@ -553,21 +620,7 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 		      	               				   user, password))
 
 	# create pre-computed frontend files
-	os.system('python schema_totals.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_totals.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_mode.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python annotations.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_boxplot.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
+	precompute.schema_changed(species_id, schema_id, graph, sparql, base_url)
 
 	# unlock schema
 	unlocked = change_lock(schema_uri, 'Unlocked',
@@ -576,6 +629,8 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 		logging.warning('Could not unlock schema. Response:'
 			            '\n{0}\n\n'.format(unlocked[1]))
 
+	up.publish(species_id, schema_id, up.COMPLETE)
+
 	# remove temp directory
 	shutil.rmtree(temp_dir)
 
@@ -585,4 +640,5 @@ if __name__ == '__main__':
     args = parse_arguments()
 
     main(args[0], args[1], args[2],
-         args[3], args[4], args[5])
+         args[3], args[4], args[5],
+         args[6])
@@ -51,6 +51,7 @@ import datetime as dt
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import metrics
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 from app.utils import PrepExternalSchema
@@ -678,7 +679,10 @@ def global_compressor(graph, sparql, base_url):
     # for each schema: get loci, download FASTA to temp folder, apply PrepExternalSchema and compress
     for schema in to_compress:
 
-        response = compress_schema(schema, old_zips[schema[0]], sparql, graph)
+        with metrics.job_timer('compression') as job:
+            response = compress_schema(schema, old_zips[schema[0]], sparql, graph)
+            if response != 0:
+                job['outcome'] = 'error'
         if response == 0:
             logging.info('Successfully compressed schema {0} '
                          '({1})'.format(schema[0], schema[-2]))
@@ -762,7 +766,10 @@ def single_compressor(species_id, schema_id, graph, sparql, base_url, user, pass
         old_zip[schema_uri] = os.path.join(Config.SCHEMAS_ZIP, old_zip[schema_uri])
 
     # adapt and compress schema
-    response = compress_schema(to_compress[0], old_zip[schema_uri], sparql, graph)
+    with metrics.job_timer('compression') as job:
+        response = compress_schema(to_compress[0], old_zip[schema_uri], sparql, graph)
+        if response != 0:
+            job['outcome'] = 'error'
     if response == 0:
         logging.info('Successfully compressed schema {0} '
                      '({1})'.format(schema_uri, single_schema_name))
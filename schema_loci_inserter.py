@@ -39,6 +39,11 @@ from itertools import repeat
 
 from SPARQLWrapper import SPARQLWrapper
 
+from app.utils import ns_counters
+from app.utils import upload_data as ud
+from app.utils import upload_status as us
+from app.utils import upload_progress as up
+from app.utils import adaptive_concurrency as ac
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 
@@ -76,7 +81,8 @@ def get_session():
     return thread_local.session
 
 
-def post_loci(query_data, local_sparql, virtuoso_user, virtuoso_pass):
+def post_loci(query_data, local_sparql, virtuoso_user, virtuoso_pass,
+              controller):
     """ Performs a POST request to insert a new locus or link
         a locus to its species or schema.
 
@@ -86,6 +92,9 @@ def post_loci(query_data, local_sparql, virtuoso_user, virtuoso_pass):
             A tuple with three elements: the locus hash, the locus
             URI and the SPARQL query that will be executed by
             Virtuoso's SPARQL endpoint.
+        controller : AIMDController
+            Limits the number of concurrent requests sent
+            to Virtuoso.
 
         Returns
         -------
@@ -103,9 +112,12 @@ def post_loci(query_data, local_sparql, virtuoso_user, virtuoso_pass):
     max_tries = 5
     valid = False
     while valid is False and tries < max_tries:
-        with session.post(local_sparql, data=query, headers=headers,
+        with controller.request() as slot, \
+             session.post(local_sparql, data=query, headers=headers,
                           auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass)) as response:
             status_code = response.status_code
+            slot.ok = status_code <= 201
+            slot.size = len(query)
             if status_code > 201:
                 tries += 1
                 logging.warning('Could not insert data for locus {0}\n'
@@ -138,14 +150,18 @@ def send_queries(loci_queries, local_sparql, virtuoso_user, virtuoso_pass):
 
     responses = {}
     total = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    controller = ac.get_controller()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
         for res in executor.map(post_loci, loci_queries, repeat(local_sparql),
-                                repeat(virtuoso_user), repeat(virtuoso_pass)):
+                                repeat(virtuoso_user), repeat(virtuoso_pass),
+                                repeat(controller)):
             responses[res[0]] = res[1]
             total += 1
             # slow down insertion during tutorial
             time.sleep(1)
 
+    logging.info('Sent {0} loci queries: {1}'.format(total, controller.summary()))
+
     return responses
 
 
@@ -462,15 +478,14 @@ def main(temp_dir, graph, sparql, base_url, user, password):
     logging.info('Started loci insertion for '
                  'schema {0}'.format(schema_uri))
 
-    # define path to file with loci data
-    loci_file = os.path.join(temp_dir, '{0}_{1}_loci'.format(species_id,
-                                                             schema_id))
+    # define path to the archive with loci data
+    loci_file = os.path.join(temp_dir, '{0}_{1}_loci.zip'.format(species_id,
+                                                                 schema_id))
 
-    # read loci data
+    # read loci data without extracting the archive
     if os.path.isfile(loci_file) is True:
-        with open(loci_file, 'rb') as lf:
-            loci_prefix, loci_data = pickle.load(lf)
-            logging.info('Loci prefix is {0}.'.format(loci_prefix))
+        loci_prefix, loci_data = ud.read_archive(loci_file)
+        logging.info('Loci prefix is {0}.'.format(loci_prefix))
     else:
         logging.warning('Could not find file {0}. '
                         'Aborting\n\n'.format(loci_file))
@@ -489,18 +504,14 @@ def main(temp_dir, graph, sparql, base_url, user, password):
     elif highest_locus == []:
         start_id = 1
 
-    # define path to file with schema upload status data
-    hashes_file = os.path.join(temp_dir,
-                               '{0}_{1}_hashes'.format(species_id, schema_id))
-
     # read schema upload status data
-    if os.path.isfile(hashes_file) is True:
-        with open(hashes_file, 'rb') as hf:
-            schema_hashes = pickle.load(hf)
-    else:
+    upload_status = us.get_status(temp_dir)
+    if upload_status is None:
         logging.warning('Could not find schema upload status file. Aborting.\n\n')
         sys.exit(1)
 
+    schema_hashes = upload_status.loci
+
     # assign identifiers to new loci based on the total number of loci in the Chewie-NS
     response, hash_to_uri, loci_data, = assign_identifiers(loci_data, schema_hashes,
                                                            loci_prefix, start_id,
@@ -519,17 +530,21 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         insert_status, success, failed = results_status(loci_insertion)
 
         for h, v in insert_status.items():
-            if v is True:
-                schema_hashes[h][1][0] = hash_to_uri[h]
-                response[h].append(v)
-            elif v is False:
-                response[h].append(v)
+            response[h].append(v)
+
+        # save status of inserted loci before halting
+        upload_status.record([(h, us.INSERTED, hash_to_uri[h])
+                              for h, v in insert_status.items() if v is True])
 
         logging.info('Successfully inserted {0} loci. '
                      'Failed {1}'.format(success, failed))
+        ns_counters.increment({'loci': success})
+        up.publish(species_id, schema_id, 'loci', upload_status.summary())
         # halt process if it could not insert all loci
         if failed > 0:
             logging.warning('Could not insert all loci. Aborting.\n\n')
+            up.publish(species_id, schema_id, up.FAILED,
+                       {'message': 'Could not insert all loci.'})
             sys.exit(1)
 
     # link loci to species
@@ -546,14 +561,14 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         link_status, success, failed = results_status(species_links)
 
         for h, v in link_status.items():
-            if v is True:
-                schema_hashes[h][1][1] = True
-                response[h].append(v)
-            elif v is False:
-                response[h].append(v)
+            response[h].append(v)
+
+        upload_status.record([(h, us.SPECIES, None)
+                              for h, v in link_status.items() if v is True])
 
         logging.info('Successfully linked {0} loci to species. '
                      'Failed {1}'.format(success, failed))
+        up.publish(species_id, schema_id, 'loci', upload_status.summary())
 
     # link loci to schema
     sc_queries, link = schema_link_queries(loci_data,
@@ -569,18 +584,25 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         link_status, success, failed = results_status(schema_links)
 
         for h, v in link_status.items():
-            if v is True:
-                schema_hashes[h][1][2] = True
-                response[h].append(v)
-            elif v is False:
-                response[h].append(v)
+            response[h].append(v)
+
+        upload_status.record([(h, us.SCHEMA, None)
+                              for h, v in link_status.items() if v is True])
 
         logging.info('Successfully linked {0} loci to schema. '
                      'Failed {1}'.format(success, failed))
 
-    # save updated schema hashes
-    with open(hashes_file, 'wb') as hf:
-        pickle.dump(schema_hashes, hf)
+    # report the number of loci in the Chewie-NS, linked to the
+    # species and linked to the schema (the status routes read
+    # these values instead of counting the loci on each request)
+    counts = {}
+    for name, query in [('nr_loci', sq.COUNT_TOTAL_LOCI.format(graph)),
+                        ('sp_loci', sq.COUNT_SPECIES_LOCI.format(graph, species_uri)),
+                        ('sc_loci', sq.COUNT_SCHEMA_LOCI.format(graph, schema_uri))]:
+        result = aux.get_data(SPARQLWrapper(sparql), query)
+        counts[name] = result['results']['bindings'][0]['count']['value']
+    counts.update(upload_status.summary())
+    up.publish(species_id, schema_id, 'loci_inserted', counts)
 
     # write response to file
     response_file = os.path.join(temp_dir,
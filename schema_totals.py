@@ -18,7 +18,6 @@ import os
 import sys
 import json
 import time
-import pickle
 import shutil
 import logging
 import argparse
@@ -26,7 +25,9 @@ import datetime as dt
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import allele_lengths as al
 from app.utils import sparql_queries as sq
+from app.utils import metrics
 from app.utils import auxiliary_functions as aux
 
 
@@ -75,18 +76,10 @@ def fast_update(species_file, files_dir, schema_uri, schema_data,
 			logging.info('Information about number of loci and number of alleles for schema {0} is up-to-date.'.format(schema_uri))
 
 		elif json_date != virtuoso_date:
-			length_files = [os.path.join(files_dir, file) for file in os.listdir(files_dir)]
+			schema_lengths = al.load(files_dir)
 
-			total_loci = len(length_files)
-
-			total_alleles = 0
-			for file in length_files:
-				locus_id = os.path.basename(file).split('_')[-1]
-				locus_uri = '{0}loci/{1}'.format(base_url, locus_id)
-				with open(file, 'rb') as f:
-					locus_data = pickle.load(f)
-				
-				total_alleles += len(locus_data[locus_uri])
+			total_loci = len(schema_lengths)
+			total_alleles = len(schema_lengths.lengths)
 
 			current_schema['last_modified'] = virtuoso_date
 			current_schema['nr_loci'] = str(total_loci)
@@ -99,18 +92,10 @@ def fast_update(species_file, files_dir, schema_uri, schema_data,
 			logging.info('Updated data for schema {0}'.format(schema_uri))
 	# new schema that is not in the json file
 	elif schema_id not in schemas_indexes:
-		length_files = [os.path.join(files_dir, file) for file in os.listdir(files_dir)]
-
-		total_loci = len(length_files)
-
-		total_alleles = 0
-		for file in length_files:
-			locus_id = os.path.basename(file).split('_')[-1]
-			locus_uri = '{0}loci/{1}'.format(base_url, locus_id)
-			with open(file, 'rb') as f:
-				locus_data = pickle.load(f)
+		schema_lengths = al.load(files_dir)
 
-			total_alleles += len(locus_data[locus_uri])
+		total_loci = len(schema_lengths)
+		total_alleles = len(schema_lengths.lengths)
 
 		# determine user that uploaded the file
 		admin = aux.get_data(SPARQLWrapper(local_sparql),
@@ -387,11 +372,12 @@ if __name__ == '__main__':
 
 	args = parse_arguments()
 
-	if args[0] == 'global_species':
-		global_species(args[3], args[4], args[5])
-	elif args[0] == 'single_species':
-		single_species(args[1], args[3], args[4],
-			           args[5])
-	elif args[0] == 'single_schema':
-		single_schema(args[1], args[2], args[3],
-					  args[4], args[5])
+	with metrics.job_timer('schema_totals'):
+		if args[0] == 'global_species':
+			global_species(args[3], args[4], args[5])
+		elif args[0] == 'single_species':
+			single_species(args[1], args[3], args[4],
+				           args[5])
+		elif args[0] == 'single_schema':
+			single_schema(args[1], args[2], args[3],
+						  args[4], args[5])
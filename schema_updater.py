@@ -27,7 +27,6 @@ import time
 import pickle
 import shutil
 import zipfile
-import hashlib
 import logging
 import argparse
 import requests
@@ -40,7 +39,18 @@ from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import ns_counters
+from app.utils import sync_lock
+from app.utils import precompute
+from app.utils import insertion_journal as ij
+from app.utils import query_stream
+from app.utils import insert_queries as iq
+from app.utils import adaptive_concurrency as ac
 from app.utils import sparql_queries as sq
+from app.utils import sequence_index as si
+from app.utils import upload_data as ud
+from app.utils import sequence_hashing as seqhash
+from app.utils import upload_progress as up
 from app.utils import auxiliary_functions as aux
 
 
@@ -50,70 +60,42 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%Y-%m-%dT%H:%M:%S',
                     filename=logfile)
 
-sync_lock = './schema_insertion_temp/sync_lock'
-
 thread_local = threading.local()
 
 
-def fasta_sequences(locus, local_sparql, virtuoso_graph):
-    """ Get the DNA sequences of all alleles of a locus.
+def locus_hashes(locus, local_sparql, virtuoso_graph):
+    """ Gets the hashes of the DNA sequences of all alleles of a
+        locus, without transferring the sequences.
 
         Parameters
         ----------
         locus : str
             The URI of the locus in the Chewie-NS.
-        date : str
-            Last modification date of the schema in
-            the format YYYY-MM-DDTHH:MM:SS.f.
 
         Returns
         -------
-        fasta_seqs : list of dict
-            A list with one dictionary per allele.
-            Each dictionary has the identifier and the DNA
-            sequence of an allele.
+        hashes : dict
+            Sequence hashes as keys and allele identifiers
+            as values.
     """
 
     # setting [SPARQL] ResultSetMaxRows = 400000 in virtuoso.ini
-    # is important to return all sequences at once
-    fasta_result = aux.get_data(SPARQLWrapper(local_sparql),
-                                (sq.SELECT_LOCUS_FASTA.format(virtuoso_graph, locus)))
+    # is important to return all alleles at once
+    result = aux.get_data(SPARQLWrapper(local_sparql),
+                          (sq.SELECT_LOCUS_SEQS.format(virtuoso_graph, locus)))
 
-    # virtuoso returned an error because request length exceeded maximum value of Temp Col
-    # get each allele separately
     try:
-        fasta_seqs = fasta_result['results']['bindings']
+        alleles = result['results']['bindings']
     # virtuoso returned an error
-    # probably because sequence/request length exceeded maximum value
-    except:
-        logging.warning('Could not retrieve FASTA records for locus {0}\n'
-                        'Response content:\n{1}\nTrying to get each sequence '
-                        'separately...\n'.format(locus, fasta_result))
-        # get each allele separately
-        result = aux.get_data(SPARQLWrapper(local_sparql),
-                              (sq.SELECT_LOCUS_SEQS.format(virtuoso_graph, locus)))
-        try:
-            fasta_seqs = result['results']['bindings']
-            if len(fasta_seqs) == 0:
-                logging.warning('Locus {0} has 0 sequences.'.format(locus))
-                return False
-        except:
-            logging.warning('Could not retrieve sequences hashes '
-                            'for locus {0}.'.format(locus))
-            return False
-
-        total = 0
-        hashes = []
-        for s in range(len(fasta_seqs)):
-            # get the sequence corresponding to the hash
-            result2 = aux.get_data(SPARQLWrapper(local_sparql),
-                                   (sq.SELECT_SEQ_FASTA.format(virtuoso_graph, fasta_seqs[s]['sequence']['value'])))
-            hashes.append(fasta_seqs[s]['sequence']['value'])
-
-            fasta_seqs[s]['nucSeq'] = result2['results']['bindings'][0]['nucSeq']
-            total += 1
-
-    return fasta_seqs
+    except (KeyError, TypeError):
+        raise Exception('Could not retrieve sequences hashes for locus {0}\n'
+                        'Response content:\n{1}'.format(locus, result))
+
+    # sequence URIs end with the sequence hash
+    hashes = {a['sequence']['value'].split('/')[-1]: a['allele_id']['value']
+              for a in alleles}
+
+    return hashes
 
 
 def change_date(schema_uri, date_type, date_value, virtuoso_graph, local_sparql, virtuoso_user, virtuoso_pass):
@@ -163,123 +145,78 @@ def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user,
 									virtuoso_pass)
 
 
-def create_single_insert(alleles, species, locus_uri, user_uri, start_id, base_url, virtuoso_graph, attributed):
-	"""
-	"""
-
-	queries = []
-	allele_id = start_id
-	for a in alleles:
-		sequence = a
-		# determine sequence hash
-		sequence_hash = hashlib.sha256(sequence.encode('utf-8')).hexdigest()
-		seq_uri = '{0}sequences/{1}'.format(base_url, sequence_hash)
-
-		allele_uri = '{0}/alleles/{1}'.format(locus_uri, allele_id)
-
-		insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
-
-		query = (sq.INSERT_ALLELE_NEW_SEQUENCE.format(virtuoso_graph, seq_uri,
-													  sequence, allele_uri,
-													  species, user_uri,
-													  locus_uri, insert_date,
-													  allele_id))
-		queries.append(query)
-		attributed[sequence_hash] = allele_id
-
-		allele_id += 1
-
-	return [queries, attributed]
-
-
-def create_multiple_insert(alleles, species, locus_uri, user_uri, start_id, base_url, virtuoso_graph, attributed):
-	"""
-	"""
-
-	queries = []
-	allele_id = start_id
-	allele_set = []
-	max_alleles = 100
-	for i, a in enumerate(alleles):
-		sequence = a
-		# determine hash
-		sequence_hash = hashlib.sha256(sequence.encode('utf-8')).hexdigest()
-		seq_uri = '{0}sequences/{1}'.format(base_url, sequence_hash)
-
-		allele_uri = '{0}/alleles/{1}'.format(locus_uri, allele_id)
-
-		insert_date = str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
-
-		allele_set.append('({0} {1} {2} {3}'
-						  ' {4} {5} {6} {7})'.format('<{0}>'.format(seq_uri),
-													 '"{0}"^^xsd:string'.format(sequence),
-													 '<{0}>'.format(allele_uri),
-													 '"{0}"^^xsd:string'.format(species),
-													 '<{0}>'.format(user_uri),
-													 '<{0}>'.format(locus_uri),
-													 '"{0}"^^xsd:dateTime'.format(insert_date),
-													 '"{0}"^^xsd:integer'.format(allele_id)))
-		attributed[sequence_hash] = allele_id
-
-		if len(allele_set) == max_alleles or i == (len(alleles)-1):
-			query = (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)))
-			queries.append(query)
-			allele_set = []
-
-		allele_id += 1
-
-	return [queries, attributed]
-
-
-def create_queries(locus_file, virtuoso_graph, local_sparql, base_url):
+def create_queries(locus_file, virtuoso_graph, local_sparql, base_url, journal):
 	"""
 	"""
 
 	# get sequences sent by user
-	with open(locus_file, 'rb') as f:
-		locus_data = pickle.load(f)
+	locus_data = read_locus(locus_file)
 
 	locus_url = locus_data[0]
 	locus_id = locus_url.split('/')[-1]
 
-	# get sequences in the NS
-	sequences = fasta_sequences(locus_url, local_sparql, virtuoso_graph)
-	ns_seqs = fasta_seqs = {f['nucSeq']['value']: f['allele_id']['value'] for f in sequences}
+	# get hashes of the sequences in the NS
+	ns_hashes = locus_hashes(locus_url, local_sparql, virtuoso_graph)
 
-	# count number of alleles for locus
-	count_query = (sq.COUNT_LOCUS_ALLELES.format(virtuoso_graph,
-											  	 locus_url))
+	# use the start identifier of a previous run of this upload
+	start_key = 'start {0}'.format(locus_id)
+	start_id = journal.get(start_key)
+	if start_id is None:
+		# count number of alleles for locus
+		count_query = (sq.COUNT_LOCUS_ALLELES.format(virtuoso_graph,
+												  	 locus_url))
 
-	count_res = aux.get_data(SPARQLWrapper(local_sparql),
-                                  		   count_query)
+		count_res = aux.get_data(SPARQLWrapper(local_sparql),
+	                                  		   count_query)
 
-	start_id = int(count_res['results']['bindings'][0]['count']['value']) + 1
+		start_id = int(count_res['results']['bindings'][0]['count']['value']) + 1
+		journal.record(start_key, start_id)
+	else:
+		start_id = int(start_id)
+
+	# alleles inserted by a previous run of this upload are still
+	# novel, so that batches are the same in every run
+	ns_hashes = {k: v for k, v in ns_hashes.items() if int(v) < start_id}
 
 	spec_name = locus_data[1]
 	user_url = locus_data[2]
 	alleles = locus_data[3]
-	novel = [a for a in alleles if a not in ns_seqs]
-	repeated = {hashlib.sha256(a.encode('utf-8')).hexdigest(): ns_seqs[a] for a in alleles if a in ns_seqs}
+	# compare hashes, sequences in the NS are not downloaded
+	hashes = seqhash.locus_hashes(locus_data)
+	novel = [(a, h) for a, h in zip(alleles, hashes) if h not in ns_hashes]
+	repeated = {h: ns_hashes[h] for h in hashes if h in ns_hashes}
 	
-	attributed = {}
 	if len(novel) > 0:
-		max_length = max([len(a) for a in novel])
-		if max_length < 7000:
-			queries, attributed = create_multiple_insert(novel, spec_name, locus_url,
-				                                         user_url, start_id, base_url,
-				                                         virtuoso_graph, attributed)
-		else:
-			queries, attributed = create_single_insert(novel, spec_name, locus_url,
-				                                       user_url, start_id, base_url,
-				                                       virtuoso_graph, attributed)
-
-		queries_file = '{0}_queries'.format(locus_file.split('alleles')[0])
-		with open(queries_file, 'wb') as qf:
-			pickle.dump(queries, qf)
-
-		return [queries_file, locus_id, repeated, attributed]
+		novel, novel_hashes = [list(v) for v in zip(*novel)]
+		# queries are created while they are sent
+		queries = iq.multiple_insert(novel, novel_hashes, spec_name,
+			                      locus_url, user_url, start_id,
+			                      base_url, virtuoso_graph)
+
+		index_records = si.allele_records(locus_url, novel, start_id,
+			                              hashes=novel_hashes)
+		attributed = {r[0]: r[2] for r in index_records}
+
+		return [queries, locus_id, repeated, attributed, index_records]
 	else:
-		return [None, locus_id, repeated, attributed]
+		return [None, locus_id, repeated, {}, []]
+
+
+def locus_queries(loci_queries, journal):
+	""" Yields tuples with a locus identifier and a tuple with
+	    a batch key, a query to insert alleles of that locus
+	    and the sequence index records of the alleles in the
+	    query. Batches inserted by a previous run are skipped.
+	"""
+
+	for locus_id, queries, records in loci_queries:
+		records = {r[2]: r for r in records}
+		for i, (query, allele_ids) in enumerate(queries):
+			key = ij.batch_key(locus_id, i)
+			if key not in journal:
+				yield (locus_id, (key, query, [records[a] for a in allele_ids]))
+		# slow down process during tutorial
+		time.sleep(1)
 
 
 def get_session():
@@ -288,65 +225,73 @@ def get_session():
     return thread_local.session
 
 
-def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
-	"""
+def index_alleles(records):
+	""" Adds alleles that were inserted into Virtuoso to the
+	    local sequence index and changes the NS counts.
 	"""
 
-	with open(input_file, 'rb') as f:
-		locus_data = pickle.load(f)
+	new_seqs = si.add_alleles(records)
+	ns_counters.alleles_added(records, new_seqs)
+
+
+def post_query(locus, batch, local_sparql, virtuoso_user, virtuoso_pass,
+			   controller, journal):
+	""" Sends a query and, if the alleles are inserted, adds
+	    them to the sequence index before recording the batch.
+	"""
 
-	responses = []
+	key, query, records = batch
 	session = get_session()
 	headers = {'content-type': 'application/sparql-query'}
-	for d in locus_data:
-		tries = 0
-		max_tries = 5
-		valid = False
-		while valid is False:
-			with session.post(local_sparql, data=d, headers=headers, auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass)) as response:
-				if response.status_code > 201:
-					tries += 1
-					print('failed', response.status_code, tries)
-					with open('errors.txt', 'a') as f:
-						f.write(response.text)
-					if tries < max_tries:
-						time.sleep(1)
-					else:
-						valid = True
-						responses.append(list(response))
-				else:
+	tries = 0
+	max_tries = 5
+	valid = False
+	while valid is False:
+		with controller.request() as slot, \
+			 session.post(local_sparql, data=query, headers=headers, auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass)) as response:
+			status_code = response.status_code
+			slot.ok = status_code <= 201
+			slot.size = len(query)
+			if status_code > 201:
+				tries += 1
+				print('failed', status_code, tries)
+				with open('errors.txt', 'a') as f:
+					f.write(response.text)
+				if tries == max_tries:
 					valid = True
-					responses.append(list(response))
+			else:
+				valid = True
+				index_alleles(records)
+				journal.record(key)
 
-	return responses
+		if valid is False:
+			time.sleep(1)
 
+	return status_code
 
-def send_alleles(post_files, local_sparql, virtuoso_user, virtuoso_pass):
-	"""
+
+def send_alleles(queries, local_sparql, virtuoso_user, virtuoso_pass, journal):
+	""" Sends the queries yielded by `queries` and returns the
+	    status codes of the responses for each locus.
 	"""
 
-	responses = []
-	total = 0
-	with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-		for res in executor.map(post_alleles, post_files, repeat(local_sparql), repeat(virtuoso_user), repeat(virtuoso_pass)):
-			responses.append(res)
-			total += 1
-			# slow down process during tutorial
-			time.sleep(1)
+	controller = ac.get_controller()
+	responses = query_stream.stream(queries, post_query, controller.max_limit,
+									args=(local_sparql, virtuoso_user,
+										  virtuoso_pass, controller, journal))
+
+	logging.info('Sent alleles of {0} loci: {1}'.format(len(responses), controller.summary()))
 
 	return responses
 
 
-def unzip(zip_file, dest_dir):
+def read_locus(zip_file):
+	""" Reads the locus data in a ZIP archive without
+	    extracting it. All alleles of the locus are loaded,
+	    they are hashed and inserted as a whole.
 	"""
-	"""
-
-	with zipfile.ZipFile(zip_file) as zf:
-		zipinfo = zf.infolist()
-		locus_file = zipinfo[0].filename
-		zf.extractall(dest_dir)
 
-	return locus_file
+	return ud.read_archive(zip_file)
 
 
 def parse_arguments():
@@ -405,41 +350,70 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 	# create schema URI
 	schema_uri = '{0}species/{1}/schemas/{2}'.format(base_url, species_id, schema_id)
 
+	# a job delivered again while this update is being inserted exits
+	upload_lock = ij.lock_upload(temp_dir)
+	if upload_lock is None:
+		logging.warning('Alleles of schema {0} are already being '
+						'inserted.\n\n'.format(schema_uri))
+		sys.exit(ij.ALREADY_RUNNING)
+
+	# temp directory also has the files created by previous runs
 	post_files = [os.path.join(temp_dir, file) for file in os.listdir(temp_dir)]
+	post_files = [file for file in post_files if zipfile.is_zipfile(file) is True]
+
+	up.publish(species_id, schema_id, 'alleles', {'loci': len(post_files)})
+
+	# hash large loci in parallel (started before any threads)
+	seqhash.start_pool()
 
-	# extract files
-	schema_files = []
-	for file in post_files:
-		dest_dir = os.path.dirname(file)
-		locus_file = unzip(file, dest_dir)
-		locus_file = os.path.join(temp_dir, locus_file)
-		schema_files.append(locus_file)
+	# batches inserted by previous runs of this upload are skipped
+	journal = ij.Journal(temp_dir)
+	if len(journal) > 0:
+		logging.info('Resuming insertion, {0} entries in journal.'.format(len(journal)))
 
-	# create SPARQL multiple INSERT queries
+	# determine novel alleles
 	new_seqs = 0
 	identifiers = {}
-	queries_files = []
+	loci_queries = []
+	index_records = {}
 	with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-		for res in executor.map(create_queries, schema_files, repeat(graph), repeat(sparql), repeat(base_url)):
+		for res in executor.map(create_queries, post_files, repeat(graph), repeat(sparql),
+								repeat(base_url), repeat(journal)):
 			if res[0] is not None:
-				queries_files.append(res[0])
+				loci_queries.append((res[1], res[0], res[4]))
+				index_records[res[1]] = res[4]
 			identifiers[res[1]] = [res[2], res[3]]
 			new_seqs += len(res[3])
 
 	start = time.time()
-	# insert data
-	# sort reponses to include summary in log file
-	# create lock file
-	with open(sync_lock, 'w') as lf:
-		lf.write('{0}\n{1}'.format(temp_dir, user))
-	post_results = send_alleles(queries_files, sparql, user, password)
-	# remove lock file after insertion
-	os.remove(sync_lock)
-
-	# create file with identifiers
+	# insert data, SPARQL multiple INSERT queries
+	# are created while they are sent
+	# insertion of new schemas and other Sync processes
+	# wait until the lock is released
+	with sync_lock.synchronization():
+		logging.info('Acquired sync lock for {0}'.format(temp_dir))
+		post_results = send_alleles(locus_queries(loci_queries, journal), sparql,
+									user, password, journal)
+
+	# loci without results were inserted by a previous run
+	failed = [locus for locus in index_records
+			  if not all([c is not None and c <= 201 for c in post_results.get(locus, [])])]
+	journal.close()
+	seqhash.close_pool()
+
+	# a new run inserts the batches that could not be inserted
+	# (the identifiers are only sent after all alleles are inserted)
+	if len(failed) > 0:
+		logging.warning('Could not insert alleles of {0} loci of schema '
+						'{1}.\n\n'.format(len(failed), schema_uri))
+		sys.exit(1)
+
+	# create file with identifiers (renamed after it is
+	# written, the file is complete when it exists)
 	identifiers_file = os.path.join(temp_dir, 'identifiers')
-	with open(identifiers_file, 'wb') as rf:
+	with open(identifiers_file + '.tmp', 'wb') as rf:
 		pickle.dump(identifiers, rf)
+	os.replace(identifiers_file + '.tmp', identifiers_file)
 
 	end = time.time()
 	delta = end - start
@@ -452,21 +426,14 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 					sparql, user, password)
 
 		# create pre-computed frontend files
-		os.system('python schema_totals.py -m single_schema '
-			      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-			      ''.format(species_id, schema_id, graph, sparql, base_url))
-		os.system('python loci_totals.py -m single_schema '
-			      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-			      ''.format(species_id, schema_id, graph, sparql, base_url))
-		os.system('python loci_mode.py -m single_schema '
-			      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-			      ''.format(species_id, schema_id, graph, sparql, base_url))
-		os.system('python annotations.py -m single_schema '
-			      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-			      ''.format(species_id, schema_id, graph, sparql, base_url))
-		os.system('python loci_boxplot.py -m single_schema '
-			      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-			      ''.format(species_id, schema_id, graph, sparql, base_url))
+		precompute.schema_changed(species_id, schema_id, graph, sparql, base_url)
+
+	# count alleles once for the clients waiting for the update
+	result = aux.get_data(SPARQLWrapper(sparql),
+						  sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(graph, schema_uri))
+	nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
+	up.publish(species_id, schema_id, up.COMPLETE, {'nr_alleles': nr_alleles,
+													'new_alleles': new_seqs})
 
 	# unlock schema
 	change_lock(schema_uri, 'Unlocked',
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+
+This module is used by the Chewie-NS to build the local index
+of sequence hashes and its Bloom filter from the data in Virtuoso.
+The index is used by the API to determine if sequences exist in
+the Chewie-NS without querying Virtuoso. The insertion and deletion
+processes keep the index up-to-date after it has been built.
+Building the index again periodically adds any alleles that were
+not added to the index (e.g.: if a process was interrupted) and
+resizes the Bloom filter for the current number of sequences.
+
+Expected input
+--------------
+
+The process uses the Virtuoso graph and SPARQL endpoint defined
+in the environment variables if the following arguments are not
+provided:
+
+- ``--g``, ``virtuoso_graph`` :
+
+    - e.g.: ``http://localhost:8890/chewiens``
+
+- ``--s``, ``local_sparql`` :
+
+    - e.g.: ``http://172.19.1.3:8890/sparql``
+
+Code documentation
+------------------
+"""
+
+
+import os
+import sys
+import time
+import logging
+import argparse
+from SPARQLWrapper import SPARQLWrapper
+
+from config import Config
+from app.utils import metrics
+from app.utils import sequence_index as si
+from app.utils import sparql_queries as sq
+from app.utils import auxiliary_functions as aux
+
+
+logfile = './log_files/sequence_index.log'
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%dT%H:%M:%S',
+                    filename=logfile)
+
+
+def index_records(local_sparql, virtuoso_graph, paging, limit=10000):
+    """ Gets the data of all alleles in the Chewie-NS.
+
+        Parameters
+        ----------
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        virtuoso_graph : str
+            URI of the default graph.
+        paging : dict
+            Receives the number of alleles read ('read').
+        limit : int
+            Maximum number of results per query (must not be
+            greater than the ResultSetMaxRows value in
+            virtuoso.ini).
+
+        Yields
+        ------
+        tuple
+            Sequence hash, locus identifier, allele identifier
+            and sequence length.
+    """
+
+    paging['read'] = 0
+    last_allele = ''
+    while True:
+        result = aux.get_data(SPARQLWrapper(local_sparql),
+                              sq.SELECT_ALLELES_HASHES.format(virtuoso_graph,
+                                                              last_allele, limit))
+        # stop without marking the index as complete if a query fails
+        if isinstance(result, Exception):
+            raise result
+
+        alleles = result['results']['bindings']
+        for a in alleles:
+            yield (a['sequence']['value'].split('/')[-1],
+                   int(a['locus']['value'].split('/')[-1]),
+                   int(a['id']['value']),
+                   int(a['nucSeqLen']['value']))
+        paging['read'] += len(alleles)
+
+        if len(alleles) < limit:
+            break
+        last_allele = alleles[-1]['allele']['value']
+
+
+def count_alleles(local_sparql, virtuoso_graph):
+    """ Counts the alleles that `index_records` reads. """
+
+    result = aux.get_data(SPARQLWrapper(local_sparql),
+                          sq.COUNT_INDEXED_ALLELES.format(virtuoso_graph))
+    if isinstance(result, Exception):
+        raise result
+
+    return int(result['results']['bindings'][0]['count']['value'])
+
+
+def build_index(local_sparql, virtuoso_graph):
+    """ Adds the alleles in Virtuoso to the sequence index and
+        builds the Bloom filter.
+    """
+
+    start = time.time()
+    logging.info('Started building sequence index at {0}'.format(Config.SEQUENCE_INDEX))
+
+    paging = {}
+
+    def all_read():
+        # alleles that were not read are only removed from the index
+        # if the number of alleles read matches the count in Virtuoso
+        count = count_alleles(local_sparql, virtuoso_graph)
+        if paging['read'] < count:
+            logging.warning('Read {0} of {1} alleles, alleles that are no '
+                            'longer in Virtuoso are kept in the sequence '
+                            'index.'.format(paging['read'], count))
+            return False
+        return True
+
+    try:
+        total = si.build(index_records(local_sparql, virtuoso_graph, paging),
+                         complete=all_read)
+    except Exception as e:
+        logging.warning('Could not build sequence index: {0}\n\n'.format(e))
+        sys.exit(1)
+
+    logging.info('Added {0} alleles to the sequence index in {1:.0f}s.'
+                 '\n\n'.format(total, time.time()-start))
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--g', type=str,
+                        dest='virtuoso_graph',
+                        default=os.environ.get('DEFAULTHGRAPH'),
+                        help='')
+
+    parser.add_argument('--s', type=str,
+                        dest='local_sparql',
+                        default=os.environ.get('LOCAL_SPARQL'),
+                        help='')
+
+    args = parser.parse_args()
+
+    return [args.virtuoso_graph, args.local_sparql]
+
+
+if __name__ == '__main__':
+
+    args = parse_arguments()
+
+    with metrics.job_timer('sequence_index'):
+        build_index(args[1], args[0])
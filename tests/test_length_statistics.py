@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+Compares the alleles lengths statistics computed by
+app/utils/length_statistics.py with the values computed per locus
+with the `statistics` module and `collections.Counter`, as the
+pre-computed files were created before the NumPy kernels.
+
+Code documentation
+------------------
+"""
+
+
+import random
+import statistics
+from collections import Counter
+
+import pytest
+
+from app.utils import length_statistics as ls
+
+
+def locus_summary(lengths):
+    """ Computes the statistics of a locus as the previous
+        functions did.
+    """
+
+    if len(lengths) == 0:
+        return None
+
+    sorted_lengths = sorted(lengths)
+    nr_alleles = len(sorted_lengths)
+    if nr_alleles > 1:
+        half = nr_alleles // 2
+        q1 = statistics.median(sorted_lengths[:half])
+        q3 = statistics.median(sorted_lengths[-half:])
+        sd = statistics.stdev(sorted_lengths)
+    else:
+        q1 = q3 = sorted_lengths[0]
+        sd = 0.0
+
+    return {'nr_alleles': nr_alleles,
+            'mode': Counter(lengths).most_common()[0][0],
+            'mean': round(sum(lengths)/nr_alleles),
+            'median': round(statistics.median(sorted_lengths)),
+            'min': min(lengths),
+            'max': max(lengths),
+            'q1': q1,
+            'q3': q3,
+            'sd': sd}
+
+
+def assert_summaries(loci_data):
+
+    loci, offsets, lengths = ls.from_lists(loci_data)
+    summaries = ls.loci_summaries(offsets, lengths)
+
+    assert len(summaries) == len(loci)
+    for locus, summary in zip(loci, summaries):
+        expected = locus_summary(loci_data[locus])
+        if expected is None:
+            assert summary is None
+            continue
+
+        assert summary['sd'] == pytest.approx(expected.pop('sd'))
+        summary.pop('sd')
+        assert summary == expected
+        # quartiles keep the type returned by statistics.median
+        assert type(summary['q1']) is type(expected['q1'])
+        assert type(summary['q3']) is type(expected['q3'])
+
+
+def test_empty_loci():
+
+    assert_summaries({'a': [], 'b': [300, 303], 'c': [], 'd': [99]})
+
+    stats = ls.loci_statistics(*ls.from_lists({'a': [], 'b': []})[1:])
+    assert stats['count'].tolist() == [0, 0]
+    assert stats['mode'].tolist() == [0, 0]
+
+
+def test_single_allele():
+
+    assert_summaries({'a': [612]})
+    assert_summaries({'a': [612], 'b': [1002]})
+
+
+@pytest.mark.parametrize('lengths', [[300, 306, 303, 309],
+                                     [300, 306, 303, 309, 312],
+                                     [10, 10, 10, 10, 10, 10],
+                                     [7, 3]])
+def test_even_and_odd_counts(lengths):
+
+    assert_summaries({'a': lengths, 'b': lengths[::-1]})
+
+
+def test_mode_ties():
+
+    # the first length of the alleles order is the mode
+    loci_data = {'a': [303, 300, 300, 303],
+                 'b': [300, 303, 303, 300],
+                 'c': [9, 6, 3],
+                 'd': [3, 6, 9, 9, 6, 3]}
+    assert_summaries(loci_data)
+
+    loci, offsets, lengths = ls.from_lists(loci_data)
+    stats = ls.loci_statistics(offsets, lengths)
+    assert stats['mode'].tolist() == [303, 300, 9, 3]
+    assert stats['modes'].tolist() == [2, 2, 3, 3]
+
+
+def test_random_loci():
+
+    rng = random.Random(42)
+    loci_data = {}
+    for i in range(200):
+        nr_alleles = rng.choice([0, 1, 2, 3, rng.randint(4, 60)])
+        base = rng.randint(100, 3000)
+        loci_data[i] = [base + 3*rng.randint(-5, 5) for _ in range(nr_alleles)]
+
+    assert_summaries(loci_data)